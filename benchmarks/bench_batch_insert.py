@@ -0,0 +1,78 @@
+# Benchmark: inserción fila por fila vs inserción en lote de DevicesRecords
+# Benchmark: per-row insertion vs batch insertion of DevicesRecords
+#
+# Uso / Usage:
+#   python benchmarks/bench_batch_insert.py [num_registros]
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Usar una base de datos temporal para no tocar mydb.sqlite
+# Use a temporary database so mydb.sqlite is left untouched
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.sqlite')}"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import crud
+import models
+from database import SessionLocal, engine
+from models import DevicesRecords, DevicesRecordsDB
+
+
+# Generar registros sintéticos con IDs consecutivos a partir de start_id
+# Generate synthetic records with consecutive IDs starting at start_id
+def generar_registros(n: int, start_id: int):
+    base = datetime(2024, 1, 1)
+    return [
+        DevicesRecords(
+            id_record=start_id + i,
+            id_device=i % 10,
+            current_value=20.0 + (i % 100) / 10,
+            date_record=base + timedelta(seconds=i),
+        )
+        for i in range(n)
+    ]
+
+
+def bench_fila_por_fila(registros):
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        for registro in registros:
+            crud.create_device_record(db, registro)
+        return time.perf_counter() - inicio
+    finally:
+        db.close()
+
+
+def bench_lote(registros):
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        crud.create_device_records_batch(db, registros)
+        return time.perf_counter() - inicio
+    finally:
+        db.close()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    models.Base.metadata.create_all(bind=engine)
+
+    t_fila = bench_fila_por_fila(generar_registros(n, start_id=1))
+    t_lote = bench_lote(generar_registros(n, start_id=n + 1))
+
+    db = SessionLocal()
+    total = db.query(DevicesRecordsDB).count()
+    db.close()
+
+    print(f"Registros por método / Records per method: {n} (total en BD / total in DB: {total})")
+    print(f"Fila por fila / Per-row: {t_fila:.3f} s  ({n / t_fila:,.0f} registros/s)")
+    print(f"Lote / Batch:            {t_lote:.3f} s  ({n / t_lote:,.0f} registros/s)")
+    print(f"Aceleración / Speedup:   {t_fila / t_lote:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Benchmark: leer 200 luces con 200 GET /luces/{id} vs un GET /luces/batch?ids=..., con la caché de
+# metadatos fría (METADATA_CACHE=0) y caliente (METADATA_CACHE=1)
+# Benchmark: reading 200 lights with 200 GET /luces/{id} calls vs one GET /luces/batch?ids=..., with
+# the metadata cache cold (METADATA_CACHE=0) and warm (METADATA_CACHE=1)
+#
+# Uso / Usage:
+#   python benchmarks/bench_batch_reads.py [num_luces]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPETICIONES = 10
+MODOS = {"METADATA_CACHE=0": "0", "METADATA_CACHE=1": "1"}
+
+
+def worker(n):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    cliente = TestClient(main.app)
+    for i in range(1, n + 1):
+        cliente.post("/luces/", json={"id_device": i, "lumens": i * 1.5, "nombre": f"luz {i}",
+                                      "vendor": "bench"}).raise_for_status()
+    ids = ",".join(str(i) for i in range(1, n + 1))
+
+    def uno_por_uno():
+        for i in range(1, n + 1):
+            cliente.get(f"/luces/{i}").raise_for_status()
+
+    def en_lote():
+        respuesta = cliente.get("/luces/batch", params={"ids": ids})
+        respuesta.raise_for_status()
+        assert len(respuesta.json()) == n
+
+    tiempos = []
+    for leer in (uno_por_uno, en_lote):
+        leer()
+        inicio = time.perf_counter()
+        for _ in range(REPETICIONES):
+            leer()
+        tiempos.append((time.perf_counter() - inicio) / REPETICIONES * 1000)
+    print(f"{os.environ['MODO']:<18} {tiempos[0]:>12.2f} ms {tiempos[1]:>12.2f} ms {tiempos[0] / tiempos[1]:>8.1f}x",
+          flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{n} luces / lights, media de / mean of {REPETICIONES}")
+    print(f"{'modo':<18} {'uno por uno':>15} {'en lote':>15} {'mejora':>9}", flush=True)
+    for modo, cache in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   METADATA_CACHE=cache, MODO=modo)
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,121 @@
+# Benchmark: resincronizar una caché de borde descargando /devices/info/, /luces/ y /controladores/
+# completos vs GET /changes?since=<cursor> después de unas pocas escrituras, y el costo que CHANGE_LOG=1
+# agrega a cada escritura
+# Benchmark: resyncing an edge cache by downloading /devices/info/, /luces/ and /controladores/ in full vs
+# GET /changes?since=<cursor> after a few writes, and the cost CHANGE_LOG=1 adds to every write
+#
+# Uso / Usage:
+#   python benchmarks/bench_change_feed.py [num_filas]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ESCRITURAS = 100
+REPETICIONES = 5
+PUTS = 2_000
+MODOS = {"descarga completa / full download": "0", "CHANGE_LOG=1": "1"}
+
+
+def worker(n):
+    from fastapi.testclient import TestClient
+
+    import change_log
+    import main
+    from database import SessionLocal
+    from models import ControladorVoltajeDB, DevicesInfoDB, LucesDB
+
+    db = SessionLocal()
+    try:
+        db.add_all([LucesDB(id_device=i, lumens=i * 1.5, nombre=f"Luz del pasillo {i}", vendor="Iluminaciones del Norte")
+                    for i in range(1, n + 1)])
+        db.add_all([ControladorVoltajeDB(id_device=i, encendido=1, voltaje=120.0, nombre=f"Controlador {i}",
+                                         vendor="Voltajes del Sur") for i in range(1, n + 1)])
+        db.add_all([DevicesInfoDB(id_device=i, id_type=i, id_signal_type=i, nombre=f"Sensor {i}", vendor="bench")
+                    for i in range(1, n + 1)])
+        db.commit()
+        change_log.rebuild(db)
+    finally:
+        db.close()
+
+    cliente = TestClient(main.app)
+    con_registro = change_log.CHANGE_LOG_ENABLED
+
+    # Costo de escritura: PUT /luces/{id} con y sin registro de cambios
+    # Write cost: PUT /luces/{id} with and without the change log
+    inicio = time.perf_counter()
+    for paso in range(PUTS):
+        i = paso % n + 1
+        cliente.put(f"/luces/{i}", json={"id_device": i, "lumens": paso * 0.5, "nombre": f"Luz del pasillo {i}",
+                                         "vendor": "Iluminaciones del Norte"}).raise_for_status()
+    put_ms = (time.perf_counter() - inicio) / PUTS * 1000
+
+    # La caché de borde arranca con todo el registro
+    # The edge cache starts from the whole log
+    cursor = 0
+    if con_registro:
+        while True:
+            cuerpo = cliente.get("/changes", params={"since": cursor, "limit": 10_000}).json()
+            cursor = cuerpo["cursor"]
+            if not cuerpo["more"]:
+                break
+
+    tiempos, tamanos = [], []
+    for repeticion in range(REPETICIONES):
+        # Unas pocas escrituras repartidas entre las tres tablas
+        # A few writes spread over the three tables
+        for paso in range(ESCRITURAS):
+            i = (repeticion * ESCRITURAS + paso) * 97 % n + 1
+            if paso % 3 == 0:
+                cliente.put(f"/luces/{i}", json={"id_device": i, "lumens": paso * 2.0, "nombre": f"Luz del pasillo {i}",
+                                                 "vendor": "Iluminaciones del Norte"}).raise_for_status()
+            elif paso % 3 == 1:
+                cliente.put(f"/controladores/{i}", json={"id_device": i, "encendido": paso % 2 == 0, "voltaje": 110.0,
+                                                         "nombre": f"Controlador {i}", "vendor": "Voltajes del Sur"}
+                            ).raise_for_status()
+            else:
+                cliente.put(f"/devices/info/{i}", json={"id_device": i, "id_type": i, "id_signal_type": i,
+                                                        "nombre": f"Sensor {i} v{paso}", "vendor": "bench"}
+                            ).raise_for_status()
+        inicio = time.perf_counter()
+        if con_registro:
+            respuesta = cliente.get("/changes", params={"since": cursor, "limit": 10_000})
+            respuesta.raise_for_status()
+            assert len(respuesta.json()["changes"]) == ESCRITURAS and not respuesta.json()["more"]
+            cursor = respuesta.json()["cursor"]
+            tamano = len(respuesta.content)
+        else:
+            tamano = 0
+            for url in ("/devices/info/", "/luces/", "/controladores/"):
+                respuesta = cliente.get(url)
+                respuesta.raise_for_status()
+                tamano += len(respuesta.content)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        tamanos.append(tamano)
+    print(f"{os.environ['MODO']:<34} {put_ms:>10.3f} ms {sum(tiempos) / REPETICIONES:>12.2f} ms "
+          f"{sum(tamanos) // REPETICIONES:>14,}", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    print(f"{n} filas por tabla / rows per table, {ESCRITURAS} escrituras entre resincronizaciones / "
+          f"writes between resyncs, media de / mean of {REPETICIONES}")
+    print(f"{'modo':<34} {'PUT /luces':>13} {'resincronizar':>15} {'bytes':>14}", flush=True)
+    for modo, registro in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   CHANGE_LOG=registro, DB_PERFORMANCE_PROFILE="1", MODO=modo)
+        try:
+            subprocess.run([sys.executable, "-W", "ignore", __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,115 @@
+# Benchmark: registros por fila en DevicesRecords vs bloques comprimidos por hora (CHUNKED_STORAGE=1)
+# Benchmark: one DevicesRecords row per reading vs per-hour compressed chunks (CHUNKED_STORAGE=1)
+#
+# Siembra lecturas cada segundo (un paseo aleatorio redondeado a 0.01, como un sensor real) para varios
+# dispositivos, mide el tamaño por lectura y una consulta de rango de 6 horas de un dispositivo, luego
+# comprime con chunk_store.compress y vuelve a medir. Usa COMPACT_STORAGE=1 para conservar la hora.
+# Seeds per-second readings (a random walk rounded to 0.01, like a real sensor) for several devices,
+# measures the size per reading and a 6-hour range query on one device, then compresses with
+# chunk_store.compress and measures again. Uses COMPACT_STORAGE=1 to keep the time of day.
+#
+# Uso / Usage:
+#   python benchmarks/bench_chunk_storage.py [dispositivos] [horas]
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp_dir = tempfile.mkdtemp()
+RUTA = os.path.join(_tmp_dir, "bench.sqlite")
+os.environ["DATABASE_URL"] = f"sqlite:///{RUTA}"
+os.environ["COMPACT_STORAGE"] = "1"
+os.environ["CHUNKED_STORAGE"] = "1"
+os.environ["RECORD_ROLLUPS"] = "0"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import text
+
+import chunk_store
+import crud
+import models
+from database import SessionLocal, engine
+from models import DevicesRecords
+
+BASE = datetime(2024, 1, 1)
+REPETICIONES = 5
+
+
+def sembrar_datos(dispositivos, horas):
+    random.seed(1)
+    valores = [20.0] * dispositivos
+    db = SessionLocal()
+    try:
+        lote = []
+        id_record = 1
+        for segundo in range(horas * 3600):
+            fecha = BASE + timedelta(seconds=segundo)
+            for dispositivo in range(dispositivos):
+                valores[dispositivo] += random.gauss(0, 0.02)
+                lote.append(DevicesRecords(id_record=id_record, id_device=dispositivo,
+                                           current_value=round(valores[dispositivo], 2), date_record=fecha))
+                id_record += 1
+            if len(lote) >= 50_000:
+                crud.create_device_records_batch(db, lote)
+                lote = []
+        if lote:
+            crud.create_device_records_batch(db, lote)
+    finally:
+        db.close()
+    return id_record - 1
+
+
+def bytes_por_lectura(total):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        conexion.execute(text("VACUUM"))
+    return os.path.getsize(RUTA) / total
+
+
+# Mejor tiempo de una consulta de 6 horas del dispositivo 0, a mitad del período
+# Best time of a 6-hour query on device 0, in the middle of the period
+def medir_rango(horas):
+    desde = BASE + timedelta(hours=horas // 2)
+    hasta = desde + timedelta(hours=6) - timedelta(seconds=1)
+    mejor = None
+    for _ in range(REPETICIONES):
+        db = SessionLocal()
+        inicio = time.perf_counter()
+        filas = crud.get_devices_records_by_device_id(db, 0, desde, hasta)
+        duracion = time.perf_counter() - inicio
+        db.close()
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return len(filas), mejor
+
+
+def main():
+    dispositivos = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    horas = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+    models.Base.metadata.create_all(bind=engine)
+    total = sembrar_datos(dispositivos, horas)
+
+    tamano_filas = bytes_por_lectura(total)
+    n_filas, t_filas = medir_rango(horas)
+
+    db = SessionLocal()
+    inicio = time.perf_counter()
+    resumen = chunk_store.compress(db, BASE + timedelta(hours=horas))
+    t_compresion = time.perf_counter() - inicio
+    db.close()
+
+    tamano_bloques = bytes_por_lectura(total)
+    n_bloques, t_bloques = medir_rango(horas)
+    assert n_filas == n_bloques
+
+    print(f"{total:,} lecturas / readings ({dispositivos} dispositivos / devices x {horas} h x 1/s), "
+          f"{resumen['chunks']} bloques / chunks comprimidos / compressed en / in {t_compresion:.1f} s")
+    print(f"{'modo':<22} {'bytes/lectura':>14} {'rango 6 h':>12} {'filas/s':>12}")
+    print(f"{'filas / rows':<22} {tamano_filas:>14.1f} {t_filas * 1000:>9.1f} ms {n_filas / t_filas:>12,.0f}")
+    print(f"{'bloques / chunks':<22} {tamano_bloques:>14.1f} {t_bloques * 1000:>9.1f} ms {n_bloques / t_bloques:>12,.0f}")
+    print(f"reducción / reduction: {tamano_filas / tamano_bloques:.1f}x disco / disk, "
+          f"{t_filas / t_bloques:.1f}x rango / range")
+
+
+if __name__ == "__main__":
+    main()
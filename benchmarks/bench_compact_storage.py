@@ -0,0 +1,83 @@
+# Benchmark: almacenamiento actual (Numeric + Date) vs compacto (COMPACT_STORAGE=1: INTEGER/REAL + epoch ms)
+# Benchmark: current storage (Numeric + Date) vs compact (COMPACT_STORAGE=1: INTEGER/REAL + epoch ms)
+#
+# Para cada modo, en su propio subproceso y con su propia base: inserción en lotes de
+# DevicesRecords, tamaño por fila (archivo tras VACUUM / filas) y lectura completa como objetos
+# ORM y como tuplas de columnas.
+# For each mode, in its own subprocess and with its own database: batched DevicesRecords inserts,
+# size per row (file after VACUUM / rows) and a full read as ORM objects and as column tuples.
+#
+# Uso / Usage:
+#   python benchmarks/bench_compact_storage.py [num_registros]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 10_000
+MODOS = {"Numeric + Date": "0", "COMPACT_STORAGE=1": "1"}
+
+
+def worker(n, ruta):
+    import crud
+    import models
+    from database import SessionLocal, engine
+    from models import DevicesRecords
+    from sqlalchemy import text
+
+    models.Base.metadata.create_all(bind=engine)
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        for desde in range(0, n, LOTE):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % 50, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + timedelta(seconds=i * 7))
+                for i in range(desde, min(n, desde + LOTE))
+            ])
+        insercion = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        filas_orm = len(crud.get_all_devices_records(db))
+        lectura_orm = time.perf_counter() - inicio
+        db.expunge_all()
+
+        inicio = time.perf_counter()
+        filas_tuplas = len(crud.get_all_devices_records_rows(db))
+        lectura_tuplas = time.perf_counter() - inicio
+        assert filas_orm == filas_tuplas == n
+    finally:
+        db.close()
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        conexion.execute(text("VACUUM"))
+    bytes_por_fila = os.path.getsize(ruta) / n
+    print(f"{os.environ['MODO']:<18} {bytes_por_fila:>9.1f} B {n / insercion:>13,.0f} {n / lectura_orm:>13,.0f} "
+          f"{n / lectura_tuplas:>13,.0f}", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{n} registros / records (filas/s / rows/s)")
+    print(f"{'modo':<18} {'fila/row':>11} {'inserción':>13} {'lectura ORM':>13} {'lectura tuplas':>13}", flush=True)
+    for modo, compacto in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        ruta = os.path.join(tmp_dir, "bench.sqlite")
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{ruta}", COMPACT_STORAGE=compacto, MODO=modo,
+                   RECORD_ROLLUPS="0")
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", str(n), ruta], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]), sys.argv[3])
+    else:
+        main()
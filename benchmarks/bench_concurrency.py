@@ -0,0 +1,124 @@
+# Benchmark: endpoints síncronos vs asíncronos (ASYNC_DB=1) con 100/500/1000 clientes concurrentes
+# Benchmark: sync vs async (ASYNC_DB=1) endpoints with 100/500/1000 concurrent clients
+#
+# Cada modo corre en un subproceso propio porque el modo se elige al importar main.py.
+# Las solicitudes pasan por la app ASGI en el mismo proceso (httpx.ASGITransport), así que
+# los endpoints síncronos siguen limitados por el threadpool igual que detrás de uvicorn.
+# Each mode runs in its own subprocess because the mode is chosen when main.py is imported.
+# Requests go through the ASGI app in-process (httpx.ASGITransport), so sync endpoints are
+# still bound by the threadpool exactly as they would be behind uvicorn.
+#
+# Requiere / Requires: httpx, aiosqlite
+# Uso / Usage:
+#   python benchmarks/bench_concurrency.py
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+CLIENTES = [100, 500, 1000]
+DISPOSITIVOS = 50
+REGISTROS_POR_DISPOSITIVO = 2000
+
+
+# Llenar la base de datos temporal con luces y registros
+# Fill the temporary database with lights and records
+def sembrar_datos():
+    import crud
+    from database import SessionLocal
+    from models import DevicesRecords, Luces
+
+    db = SessionLocal()
+    try:
+        for id_device in range(DISPOSITIVOS):
+            crud.create_luces(db, Luces(id_device=id_device, lumens=800, nombre=f"Luz {id_device}", vendor="bench"))
+        base = datetime(2024, 1, 1)
+        registros = [
+            DevicesRecords(
+                id_record=i + 1,
+                id_device=i % DISPOSITIVOS,
+                current_value=float(i % 100),
+                date_record=base + timedelta(minutes=i),
+            )
+            for i in range(DISPOSITIVOS * REGISTROS_POR_DISPOSITIVO)
+        ]
+        crud.create_device_records_batch(db, registros)
+    finally:
+        db.close()
+
+
+# Un cliente hace una lectura por ID y una página de registros de su dispositivo
+# Each client does one read by ID and one page of records of its device
+async def cliente(http, i, latencias, errores):
+    id_device = i % DISPOSITIVOS
+    for url in (f"/luces/{id_device}", f"/devices/records/device/{id_device}?limit=100"):
+        inicio = time.perf_counter()
+        try:
+            respuesta = await http.get(url)
+            respuesta.raise_for_status()
+            latencias.append(time.perf_counter() - inicio)
+        except Exception:
+            # Por ejemplo, agotar el pool de conexiones (QueuePool limit ... reached)
+            # For example, exhausting the connection pool (QueuePool limit ... reached)
+            errores.append(url)
+
+
+async def correr(app, n):
+    import httpx
+
+    latencias = []
+    errores = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+                                 base_url="http://bench", timeout=None) as http:
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente(http, i, latencias, errores) for i in range(n)))
+        total = time.perf_counter() - inicio
+    if not latencias:
+        return total, 0.0, float("nan"), float("nan"), len(errores)
+    latencias.sort()
+    p99 = latencias[max(int(len(latencias) * 0.99) - 1, 0)]
+    return total, len(latencias) / total, statistics.median(latencias) * 1000, p99 * 1000, len(errores)
+
+
+# Todas las rondas corren en el mismo event loop: el pool asíncrono queda ligado a él
+# All rounds run on the same event loop: the async pool is bound to it
+async def correr_rondas(app, modo):
+    for n in CLIENTES:
+        total, rps, p50, p99, errores = await correr(app, n)
+        print(f"{modo:<6} {n:>6} {total:>9.2f} {rps:>10,.0f} {p50:>9.1f} {p99:>9.1f} {errores:>7}", flush=True)
+
+
+def worker(modo):
+    import main
+
+    sembrar_datos()
+    asyncio.run(correr_rondas(main.app, modo))
+
+
+def main():
+    print(f"{'modo':<6} {'client':>6} {'total s':>9} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errores':>7}", flush=True)
+    for modo in ("sync", "async"):
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+            ASYNC_DB="1" if modo == "async" else "0",
+        )
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", modo], env=env, check=True,
+                           cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(sys.argv[2])
+    else:
+        main()
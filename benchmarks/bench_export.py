@@ -0,0 +1,87 @@
+# Benchmark: exportar todo DevicesRecords como JSON, NDJSON (?stream=true), Parquet y Arrow IPC
+# Benchmark: export all of DevicesRecords as JSON, NDJSON (?stream=true), Parquet and Arrow IPC
+#
+# Cada formato corre en su propio subproceso para medir su pico de memoria (ru_maxrss) por separado.
+# Las respuestas se descargan por partes y se descartan, como haría un cliente que escribe a disco.
+# Each format runs in its own subprocess so its peak memory (ru_maxrss) is measured separately.
+# Responses are downloaded in chunks and discarded, like a client writing to disk would.
+#
+# Requiere / Requires: polars, pyarrow
+# Uso / Usage:
+#   python benchmarks/bench_export.py [num_registros]
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+FORMATOS = {
+    "json": "/devices/records/",
+    "ndjson": "/devices/records/?stream=true",
+    "parquet": "/devices/records/export?format=parquet",
+    "arrow": "/devices/records/export?format=arrow",
+}
+
+
+def sembrar_datos(n):
+    import crud
+    import models
+    from database import SessionLocal, engine
+    from models import DevicesRecords
+
+    models.Base.metadata.create_all(bind=engine)
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        for inicio in range(0, n, 100_000):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % 50, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + timedelta(minutes=i))
+                for i in range(inicio, min(n, inicio + 100_000))
+            ])
+    finally:
+        db.close()
+
+
+def worker(formato):
+    from fastapi.testclient import TestClient
+    import main
+
+    cliente = TestClient(main.app)
+    inicio = time.perf_counter()
+    total = 0
+    with cliente.stream("GET", FORMATOS[formato]) as respuesta:
+        respuesta.raise_for_status()
+        for parte in respuesta.iter_bytes():
+            total += len(parte)
+    duracion = time.perf_counter() - inicio
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{formato:<8} {duracion:>8.2f} s {total / 1024 / 1024:>10.1f} MiB {pico:>12.0f} MiB", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tmp_dir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}")
+    try:
+        subprocess.run([sys.executable, __file__, "--seed", str(n)], env=env, check=True)
+        print(f"{n} registros / records")
+        print(f"{'formato':<8} {'tiempo':>10} {'tamaño':>14} {'pico RSS':>16}", flush=True)
+        for formato in FORMATOS:
+            subprocess.run([sys.executable, __file__, "--worker", formato], env=env, check=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] in ("--seed", "--worker"):
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        if sys.argv[1] == "--seed":
+            sembrar_datos(int(sys.argv[2]))
+        else:
+            worker(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,73 @@
+# Benchmark: GET /devices/records/ con response_model (Pydantic por fila) vs el camino rápido (FAST_JSON)
+# Benchmark: GET /devices/records/ through response_model (per-row Pydantic) vs the fast path (FAST_JSON)
+#
+# Uso / Usage:
+#   python benchmarks/bench_fast_json.py [num_registros]
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Usar una base de datos temporal para no tocar mydb.sqlite
+# Use a temporary database so mydb.sqlite is left untouched
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.sqlite')}"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi.testclient import TestClient
+
+import crud
+import main
+from database import SessionLocal
+from models import DevicesRecords
+
+REPETICIONES = 3
+
+
+def sembrar_datos(n):
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        crud.create_device_records_batch(db, [
+            DevicesRecords(id_record=i + 1, id_device=i % 50, current_value=20.0 + (i % 1000) / 7,
+                           date_record=base + timedelta(minutes=i))
+            for i in range(n)
+        ])
+    finally:
+        db.close()
+
+
+# Mejor tiempo de REPETICIONES solicitudes completas
+# Best time out of REPETICIONES full requests
+def medir(cliente):
+    mejor = None
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        respuesta = cliente.get("/devices/records/")
+        respuesta.raise_for_status()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, respuesta.content
+
+
+def main_bench():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sembrar_datos(n)
+    cliente = TestClient(main.app)
+
+    main.FAST_JSON_ENABLED = False
+    t_pydantic, cuerpo_pydantic = medir(cliente)
+    main.FAST_JSON_ENABLED = True
+    t_rapido, cuerpo_rapido = medir(cliente)
+
+    import json
+    iguales = json.loads(cuerpo_pydantic) == json.loads(cuerpo_rapido)
+    print(f"{n} registros / records, mejor de / best of {REPETICIONES}")
+    print(f"response_model (Pydantic): {t_pydantic:>7.2f} s {n / t_pydantic:>12,.0f} filas/s / rows/s")
+    print(f"FAST_JSON (tuplas/orjson): {t_rapido:>7.2f} s {n / t_rapido:>12,.0f} filas/s / rows/s")
+    print(f"mismo JSON / same JSON: {iguales}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,86 @@
+# Benchmark: listados completos vs proyectados con ?fields= (bytes enviados y tiempo por solicitud)
+# para /devices/records/, /devices/records/device/{id} y /luces/
+# Benchmark: full vs ?fields= projected lists (bytes sent and time per request)
+# for /devices/records/, /devices/records/device/{id} and /luces/
+#
+# Uso / Usage:
+#   python benchmarks/bench_fields.py [num_registros]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 10_000
+DISPOSITIVOS = 20
+LUCES = 10_000
+REPETICIONES = 5
+CASOS = [
+    ("/devices/records/", None),
+    ("/devices/records/", "current_value,date_record"),
+    ("/devices/records/device/7", None),
+    ("/devices/records/device/7", "current_value,date_record"),
+    ("/luces/", None),
+    ("/luces/", "id_device,lumens"),
+]
+MODOS = {"FAST_JSON=1": "1", "FAST_JSON=0": "0"}
+
+
+def worker(n):
+    from fastapi.testclient import TestClient
+
+    import crud
+    import main
+    from database import SessionLocal
+    from models import DevicesRecords, LucesDB
+
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        for desde in range(0, n, LOTE):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % DISPOSITIVOS, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + timedelta(seconds=i * 7))
+                for i in range(desde, min(n, desde + LOTE))
+            ])
+        db.add_all([LucesDB(id_device=i, lumens=i * 1.5, nombre=f"Luz del pasillo {i}", vendor="Iluminaciones del Norte")
+                    for i in range(1, LUCES + 1)])
+        db.commit()
+    finally:
+        db.close()
+
+    cliente = TestClient(main.app)
+    for url, campos in CASOS:
+        params = {"fields": campos} if campos else {}
+        respuesta = cliente.get(url, params=params)
+        respuesta.raise_for_status()
+        inicio = time.perf_counter()
+        for _ in range(REPETICIONES):
+            cliente.get(url, params=params).raise_for_status()
+        tiempo = (time.perf_counter() - inicio) / REPETICIONES * 1000
+        print(f"{os.environ['MODO']:<12} {url:<27} {campos or 'todos / all':<26} {len(respuesta.content):>12,} "
+              f"{tiempo:>10.2f} ms", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    print(f"{n} registros / records, {LUCES} luces / lights, media de / mean of {REPETICIONES}")
+    print(f"{'modo':<12} {'url':<27} {'fields':<26} {'bytes':>12} {'tiempo':>13}", flush=True)
+    for modo, rapido in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   FAST_JSON=rapido, MODO=modo, RESPONSE_CACHE="0", COMPACT_STORAGE="1", RECENT_CACHE="0")
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
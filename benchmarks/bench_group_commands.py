@@ -0,0 +1,76 @@
+# Benchmark: apagar/encender N controladores con N PUT /controladores/{id} vs un solo
+# POST /controladores/command (por vendor y por lista de IDs)
+# Benchmark: switching N controllers off/on with N PUT /controladores/{id} calls vs a single
+# POST /controladores/command (by vendor and by ID list)
+#
+# Uso / Usage:
+#   python benchmarks/bench_group_commands.py [num_controladores]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPETICIONES = 10
+MODOS = {"sync": "0", "ASYNC_DB=1": "1"}
+
+
+def worker(n):
+    from fastapi.testclient import TestClient
+
+    import main
+    from database import SessionLocal
+    from models import ControladorVoltajeDB
+
+    db = SessionLocal()
+    try:
+        db.add_all([ControladorVoltajeDB(id_device=i, encendido=1, voltaje=120.0, nombre=f"zona{i % 50}-{i}",
+                                         vendor="Voltajes del Sur") for i in range(1, n + 1)])
+        db.commit()
+    finally:
+        db.close()
+
+    cliente = TestClient(main.app)
+    # Un PUT por controlador, como hoy (una sola pasada: son n solicitudes)
+    # One PUT per controller, as today (a single pass: it is n requests)
+    inicio = time.perf_counter()
+    for i in range(1, n + 1):
+        cliente.put(f"/controladores/{i}", json={"id_device": i, "encendido": False, "voltaje": 120.0,
+                                                 "nombre": f"zona{i % 50}-{i}", "vendor": "Voltajes del Sur"}
+                    ).raise_for_status()
+    uno_por_uno = (time.perf_counter() - inicio) * 1000
+
+    tiempos = []
+    ids = list(range(1, n + 1))
+    for filtro in ({"vendor": "Voltajes del Sur"}, {"ids": ids}):
+        inicio = time.perf_counter()
+        for repeticion in range(REPETICIONES):
+            respuesta = cliente.post("/controladores/command", json=dict(filtro, encendido=repeticion % 2 == 0))
+            respuesta.raise_for_status()
+            assert respuesta.json() == {"updated": n}
+        tiempos.append((time.perf_counter() - inicio) / REPETICIONES * 1000)
+    print(f"{os.environ['MODO']:<12} {uno_por_uno:>14.2f} ms {tiempos[0]:>12.2f} ms {tiempos[1]:>12.2f} ms "
+          f"{uno_por_uno / tiempos[0]:>8.0f}x", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    print(f"{n} controladores / controllers, comandos: media de / commands: mean of {REPETICIONES}")
+    print(f"{'modo':<12} {'n × PUT':>17} {'por vendor':>15} {'por ids':>15} {'mejora':>9}", flush=True)
+    for modo, asincrono in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   ASYNC_DB=asincrono, MODO=modo)
+        try:
+            subprocess.run([sys.executable, "-W", "ignore", __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,127 @@
+# Benchmark: ingesta de lecturas individuales con y sin el buffer write-behind (INGEST_BUFFER=1)
+# Benchmark: single-reading ingestion with and without the write-behind buffer (INGEST_BUFFER=1)
+#
+# 1) HTTP: clientes concurrentes hacen POST /devices/records/ durante N segundos
+#    (en el mismo proceso vía httpx.ASGITransport).
+# 2) Buffer directo: cuántos registros por segundo acepta y escribe el buffer sin la capa HTTP.
+# 1) HTTP: concurrent clients POST /devices/records/ for N seconds
+#    (in-process through httpx.ASGITransport).
+# 2) Direct buffer: how many records per second the buffer accepts and writes without HTTP.
+#
+# Requiere / Requires: httpx
+# Uso / Usage:
+#   python benchmarks/bench_ingest_buffer.py [segundos]
+import asyncio
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+CLIENTES = 50
+REGISTROS_DIRECTOS = 200_000
+
+
+async def bench_http(app, duracion):
+    import httpx
+
+    ids = itertools.count(1)
+    conteo = {"ok": 0, "429": 0, "otros": 0}
+    fin = time.perf_counter() + duracion
+
+    async def cliente(http):
+        while time.perf_counter() < fin:
+            respuesta = await http.post("/devices/records/", json={
+                "id_record": next(ids), "id_device": 1, "current_value": 21.5,
+                "date_record": "2024-01-01T00:00:00",
+            })
+            if respuesta.status_code in (201, 202):
+                conteo["ok"] += 1
+            elif respuesta.status_code == 429:
+                conteo["429"] += 1
+            else:
+                conteo["otros"] += 1
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as http:
+        await asyncio.gather(*(cliente(http) for _ in range(CLIENTES)))
+    return conteo
+
+
+def contar_registros():
+    from database import SessionLocal
+    from models import DevicesRecordsDB
+
+    db = SessionLocal()
+    try:
+        return db.query(DevicesRecordsDB).count()
+    finally:
+        db.close()
+
+
+def worker_http(duracion):
+    import main
+
+    if main.ingest_buffer is not None:
+        main.ingest_buffer.start()
+    inicio = time.perf_counter()
+    conteo = asyncio.run(bench_http(main.app, duracion))
+    if main.ingest_buffer is not None:
+        main.ingest_buffer.stop()
+    total = time.perf_counter() - inicio
+    modo = "buffer" if main.ingest_buffer is not None else "directo"
+    print(f"HTTP {modo:<8} {conteo['ok'] / duracion:>10,.0f} req/s aceptadas/accepted  "
+          f"429: {conteo['429']:>6}  otros/other: {conteo['otros']}  "
+          f"en BD / in DB: {contar_registros()} (tras/after {total:.1f} s)", flush=True)
+
+
+def worker_directo():
+    import models
+    from database import engine
+    from ingest_buffer import IngestBuffer
+    from models import DevicesRecords
+
+    models.Base.metadata.create_all(bind=engine)
+    buffer = IngestBuffer(capacity=REGISTROS_DIRECTOS)
+    registros = [
+        DevicesRecords(id_record=i + 1, id_device=i % 10, current_value=21.5, date_record=datetime(2024, 1, 1))
+        for i in range(REGISTROS_DIRECTOS)
+    ]
+    buffer.start()
+    inicio = time.perf_counter()
+    for registro in registros:
+        buffer.put(registro)
+    t_encolar = time.perf_counter() - inicio
+    buffer.stop()
+    t_total = time.perf_counter() - inicio
+    print(f"Buffer directo / direct: encolar/enqueue {REGISTROS_DIRECTOS / t_encolar:>12,.0f} registros/s, "
+          f"escritos en BD / written to DB {buffer.flushed / t_total:>10,.0f} registros/s", flush=True)
+
+
+def main():
+    duracion = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    corridas = [("--http", "0"), ("--http", "1"), ("--directo", "1")]
+    for modo, buffer in corridas:
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+            INGEST_BUFFER=buffer,
+        )
+        try:
+            subprocess.run([sys.executable, __file__, modo, str(duracion)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] in ("--http", "--directo"):
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        if sys.argv[1] == "--http":
+            worker_http(float(sys.argv[2]))
+        else:
+            worker_directo()
+    else:
+        main()
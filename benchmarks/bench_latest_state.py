@@ -0,0 +1,83 @@
+# Benchmark: "valor actual del dispositivo X" leyendo todos sus registros vs GET /devices/{id}/latest y
+# la foto de toda la flota con GET /devices/latest, sin y con la tabla DeviceLatestState (LATEST_STATE=1)
+# Benchmark: "current value of device X" by reading all of its records vs GET /devices/{id}/latest and
+# the whole-fleet snapshot with GET /devices/latest, without and with the DeviceLatestState table (LATEST_STATE=1)
+#
+# Uso / Usage:
+#   python benchmarks/bench_latest_state.py [num_registros]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 10_000
+DISPOSITIVOS = 200
+REPETICIONES = 20
+MODOS = {"índice / index": "0", "LATEST_STATE=1": "1"}
+
+
+# Tiempo medio de una solicitud GET, en milisegundos
+# Mean time of a GET request, in milliseconds
+def medir(cliente, url, params=None):
+    cliente.get(url, params=params).raise_for_status()
+    inicio = time.perf_counter()
+    for _ in range(REPETICIONES):
+        cliente.get(url, params=params).raise_for_status()
+    return (time.perf_counter() - inicio) / REPETICIONES * 1000
+
+
+def worker(n):
+    from fastapi.testclient import TestClient
+
+    import crud
+    import main
+    from database import SessionLocal
+    from models import DevicesRecords
+
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        for desde in range(0, n, LOTE):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % DISPOSITIVOS, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + timedelta(seconds=i * 7))
+                for i in range(desde, min(n, desde + LOTE))
+            ])
+        insercion = time.perf_counter() - inicio
+    finally:
+        db.close()
+
+    cliente = TestClient(main.app)
+    todos = medir(cliente, "/devices/records/device/7")
+    uno = medir(cliente, "/devices/7/latest")
+    flota = medir(cliente, "/devices/latest")
+    assert len(cliente.get("/devices/latest").json()) == DISPOSITIVOS
+    print(f"{os.environ['MODO']:<16} {n / insercion:>11,.0f} {todos:>13.2f} ms {uno:>11.2f} ms {flota:>11.2f} ms",
+          flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    print(f"{n} registros / records, {DISPOSITIVOS} dispositivos / devices, media de / mean of {REPETICIONES}")
+    print(f"{'modo':<16} {'inserción/s':>11} {'registros de 1':>16} {'latest de 1':>14} {'flota':>14}", flush=True)
+    for modo, estado in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   LATEST_STATE=estado, MODO=modo, RECORD_ROLLUPS="0", CHUNKED_STORAGE="0", RECORD_PARTITIONS="0",
+                   COMPACT_STORAGE="1")
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,93 @@
+# Benchmark: retención con DELETE sobre DevicesRecords vs DROP TABLE de particiones mensuales (RECORD_PARTITIONS=1)
+# Benchmark: retention with DELETE on DevicesRecords vs DROP TABLE of monthly partitions (RECORD_PARTITIONS=1)
+#
+# Para cada modo, en su propio subproceso y con su propia base: inserción en lotes de MESES meses de
+# registros, una consulta por rango de un día de un dispositivo (paginada por keyset, como la API) y la
+# retención de la primera mitad de los meses (DELETE por rango + commit vs partitions.drop_before).
+# For each mode, in its own subprocess and with its own database: batched inserts of MESES months of
+# records, a one-day range query for one device (keyset paginated, like the API) and retention of the
+# first half of the months (range DELETE + commit vs partitions.drop_before).
+#
+# Uso / Usage:
+#   python benchmarks/bench_partitions.py [num_registros]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 10_000
+MESES = 12
+DISPOSITIVOS = 50
+REPETICIONES = 20
+MODOS = {"DevicesRecords": "0", "RECORD_PARTITIONS=1": "1"}
+
+
+def worker(n):
+    import crud
+    import models
+    import partitions
+    from database import SessionLocal, engine
+    from models import DevicesRecords, DevicesRecordsDB, date_record_bound
+    from sqlalchemy import delete
+
+    models.Base.metadata.create_all(bind=engine)
+    base = datetime(2024, 1, 1)
+    paso = (datetime(2024 + MESES // 12, MESES % 12 + 1, 1) - base) / n
+    corte = datetime(2024, MESES // 2 + 1, 1)
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        for desde in range(0, n, LOTE):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % DISPOSITIVOS, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + paso * i)
+                for i in range(desde, min(n, desde + LOTE))
+            ])
+        insercion = time.perf_counter() - inicio
+
+        desde_dia = datetime(2024, MESES - 1, 15)
+        inicio = time.perf_counter()
+        for _ in range(REPETICIONES):
+            filas = crud.get_devices_records_by_device_id(db, 7, desde_dia, desde_dia + timedelta(days=1), 1000)
+        rango = (time.perf_counter() - inicio) / REPETICIONES
+        db.expunge_all()
+
+        inicio = time.perf_counter()
+        if partitions.RECORD_PARTITIONS_ENABLED:
+            partitions.drop_before(db, corte)
+        else:
+            db.execute(delete(DevicesRecordsDB).where(DevicesRecordsDB.date_record < date_record_bound(corte)))
+            db.commit()
+        retencion = time.perf_counter() - inicio
+        restantes = len(crud.get_all_devices_records_rows(db))
+    finally:
+        db.close()
+    print(f"{os.environ['MODO']:<20} {n / insercion:>11,.0f} {rango * 1000:>10.2f} ms {len(filas):>6} "
+          f"{retencion * 1000:>11.1f} ms {restantes:>10}", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{n} registros / records en / over {MESES} meses / months, retención de / retention of {MESES // 2}")
+    print(f"{'modo':<20} {'inserción/s':>11} {'rango 1 día':>13} {'filas':>6} {'retención':>14} {'restantes':>10}",
+          flush=True)
+    for modo, particiones in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   RECORD_PARTITIONS=particiones, MODO=modo, RECORD_ROLLUPS="0", CHUNKED_STORAGE="0",
+                   COMPACT_STORAGE="1")
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,98 @@
+# Benchmark: purgar los registros de un intervalo con un DELETE /devices/records/{id} por registro vs un
+# solo DELETE /devices/records?to=... (de una vez y por lotes de batch_size filas)
+# Benchmark: purging the records of an interval with one DELETE /devices/records/{id} per record vs a
+# single DELETE /devices/records?to=... (all at once and in batches of batch_size rows)
+#
+# Uso / Usage:
+#   python benchmarks/bench_range_delete.py [num_registros]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 50_000
+DISPOSITIVOS = 50
+POR_ID = 2_000
+MODOS = {"uno por uno / one by one": "", "rango / range": "0", "rango / range, batch_size=10000": "10000"}
+
+
+def worker(n, batch_size):
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, func, select
+
+    import crud
+    import main
+    from database import SessionLocal, engine
+    from models import DevicesRecords, DevicesRecordsDB
+
+    # Un año de registros; se purgan los primeros seis meses
+    # One year of records; the first six months are purged
+    base = datetime(2024, 1, 1)
+    paso = timedelta(days=366) / n
+    corte = datetime(2024, 7, 1)
+    db = SessionLocal()
+    try:
+        for desde in range(0, n, LOTE):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % DISPOSITIVOS, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + paso * i)
+                for i in range(desde, min(n, desde + LOTE))
+            ])
+        a_borrar = db.execute(select(func.count()).select_from(DevicesRecordsDB)
+                              .where(DevicesRecordsDB.date_record <= corte)).scalar()
+    finally:
+        db.close()
+
+    # Transacción de escritura más larga (desde BEGIN hasta COMMIT) mientras se purga
+    # Longest write transaction (from BEGIN to COMMIT) while purging
+    transacciones = []
+    inicio_transaccion = [None]
+    event.listen(engine, "begin", lambda conexion: inicio_transaccion.__setitem__(0, time.perf_counter()))
+    event.listen(engine, "commit", lambda conexion: transacciones.append(time.perf_counter() - inicio_transaccion[0]))
+
+    cliente = TestClient(main.app)
+    if not batch_size:
+        # Un DELETE por registro: se mide una muestra y se extrapola a todo el intervalo
+        # One DELETE per record: a sample is timed and extrapolated to the whole interval
+        inicio = time.perf_counter()
+        for i in range(1, POR_ID + 1):
+            assert cliente.delete(f"/devices/records/{i}").status_code == 204
+        tiempo = (time.perf_counter() - inicio) / POR_ID * a_borrar
+        estimado = " (estimado / estimated)"
+    else:
+        params = {"to": corte.isoformat()}
+        if batch_size != "0":
+            params["batch_size"] = batch_size
+        inicio = time.perf_counter()
+        respuesta = cliente.delete("/devices/records", params=params)
+        tiempo = time.perf_counter() - inicio
+        respuesta.raise_for_status()
+        assert respuesta.json() == {"deleted": a_borrar}
+        estimado = ""
+    print(f"{os.environ['MODO']:<34} {a_borrar:>10,} {tiempo:>12.2f} s{estimado} "
+          f"{max(transacciones) * 1000:>10.1f} ms", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{n} registros / records, {DISPOSITIVOS} dispositivos / devices")
+    print(f"{'modo':<34} {'borrados':>10} {'tiempo':>14} {'transacción más larga':>24}", flush=True)
+    for modo, lote in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   COMPACT_STORAGE="1", DB_PERFORMANCE_PROFILE="1", MODO=modo)
+        try:
+            subprocess.run([sys.executable, "-W", "ignore", __file__, "--worker", str(n), lote], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]), sys.argv[3])
+    else:
+        main()
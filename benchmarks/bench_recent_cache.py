@@ -0,0 +1,105 @@
+# Benchmark: "últimas N lecturas" y "últimos 15 minutos" de un dispositivo desde la base vs desde la
+# caché de registros recientes (RECENT_CACHE=1), con escrituras intercaladas como en producción
+# Benchmark: "last N readings" and "last 15 minutes" of a device from the database vs from the
+# recent record cache (RECENT_CACHE=1), with interleaved writes as in production
+#
+# Uso / Usage:
+#   python benchmarks/bench_recent_cache.py [num_registros]
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 10_000
+DISPOSITIVOS = 200
+CONSULTAS = 2_000
+ESCRIBIR_CADA = 10
+MODOS = {"base / database": "0", "RECENT_CACHE=1": "1"}
+
+
+def worker(n):
+    import crud
+    import main
+    from database import SessionLocal
+    from fastapi.testclient import TestClient
+    from models import DevicesRecords
+    from recent_cache import recent_cache
+
+    base = datetime(2024, 1, 1)
+    paso = timedelta(seconds=1)
+    db = SessionLocal()
+    try:
+        for desde in range(0, n, LOTE):
+            crud.create_device_records_batch(db, [
+                DevicesRecords(id_record=i + 1, id_device=i % DISPOSITIVOS, current_value=20.0 + (i % 1000) / 7,
+                               date_record=base + paso * i)
+                for i in range(desde, min(n, desde + LOTE))
+            ])
+    finally:
+        db.close()
+
+    cliente = TestClient(main.app)
+    # Primera lectura de cada dispositivo (con la caché, la que carga su ventana), medida aparte
+    # First read of each device (with the cache, the one that loads its window), timed separately
+    inicio = time.perf_counter()
+    for id_device in range(DISPOSITIVOS):
+        cliente.get(f"/devices/records/device/{id_device}", params={"last": 1}).raise_for_status()
+    primera = (time.perf_counter() - inicio) / DISPOSITIVOS * 1000
+
+    resultados = []
+    for params in ({"last": 100}, {"minutos": 15}):
+        azar = random.Random(1)
+        siguiente = n
+        lectura = 0.0
+        for consulta in range(CONSULTAS):
+            # Una lectura nueva cada ESCRIBIR_CADA consultas, por la API como un dispositivo real
+            # A new reading every ESCRIBIR_CADA queries, through the API like a real device
+            if consulta % ESCRIBIR_CADA == 0:
+                siguiente += 1
+                cliente.post("/devices/records/", json={
+                    "id_record": siguiente, "id_device": siguiente % DISPOSITIVOS, "current_value": 1.0,
+                    "date_record": (base + paso * siguiente).isoformat(),
+                }).raise_for_status()
+            id_device = azar.randrange(DISPOSITIVOS)
+            if "last" in params:
+                query = params
+            else:
+                query = {"since": (base + paso * (siguiente - params["minutos"] * 60)).isoformat()}
+            # Solo se mide la lectura; la escritura cuesta lo mismo en los dos modos
+            # Only the read is timed; the write costs the same in both modes
+            inicio = time.perf_counter()
+            cliente.get(f"/devices/records/device/{id_device}", params=query).raise_for_status()
+            lectura += time.perf_counter() - inicio
+        resultados.append(lectura / CONSULTAS * 1000)
+        n = siguiente
+    estadisticas = recent_cache.stats()
+    print(f"{os.environ['MODO']:<16} {primera:>10.2f} ms {resultados[0]:>10.2f} ms {resultados[1]:>10.2f} ms "
+          f"{estadisticas['hit_ratio']:>10.1%} {estadisticas['records']:>10}", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    print(f"{n} registros / records, {DISPOSITIVOS} dispositivos / devices, {CONSULTAS} consultas / queries "
+          f"(1 escritura cada / 1 write every {ESCRIBIR_CADA})")
+    print(f"{'modo':<16} {'primera':>13} {'last=100':>13} {'15 min':>13} {'aciertos':>10} {'en caché':>10}", flush=True)
+    for modo, cache in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   RECENT_CACHE=cache, MODO=modo, RECORD_ROLLUPS="0", CHUNKED_STORAGE="0", RECORD_PARTITIONS="0",
+                   LATEST_STATE="0", COMPACT_STORAGE="1", FAST_JSON="1")
+        try:
+            subprocess.run([sys.executable, "-W", "ignore", __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,90 @@
+# Benchmark: reparto en proceso de registros nuevos (record_stream.RecordBroker)
+# Benchmark: in-process fan-out of new records (record_stream.RecordBroker)
+#
+# Un hilo publica registros a un ritmo fijo (como crud.create_device_record tras cada commit)
+# mientras N suscriptores en el event loop los consumen. Además hay un suscriptor que nunca lee,
+# para comprobar que un cliente lento no frena la publicación (solo pierde sus mensajes viejos).
+# A thread publishes records at a fixed rate (like crud.create_device_record after each commit)
+# while N subscribers on the event loop consume them. There is also a subscriber that never reads,
+# to check that a slow client does not stall publishing (it only loses its oldest messages).
+#
+# Uso / Usage:
+#   python benchmarks/bench_record_stream.py [suscriptores] [mensajes_por_segundo] [segundos]
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# No se toca la base de datos, pero importar models requiere una URL; se usa una temporal
+# The database is not touched, but importing models needs a URL; a temporary one is used
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.sqlite')}"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from models import DevicesRecords
+from record_stream import RecordBroker
+
+
+def publicar(broker, tasa, duracion, tiempos):
+    intervalo = 1 / tasa
+    inicio = time.perf_counter()
+    enviados = 0
+    while enviados < tasa * duracion:
+        # Ritmo fijo: se publica cada registro en su instante programado
+        # Fixed pace: every record is published at its scheduled time
+        objetivo = inicio + enviados * intervalo
+        espera = objetivo - time.perf_counter()
+        if espera > 0:
+            time.sleep(espera)
+        registro = DevicesRecords(id_record=enviados, id_device=enviados % 10, current_value=21.5,
+                                  date_record=datetime(2024, 1, 1))
+        tiempos.append(time.perf_counter())
+        broker.publish([registro])
+        enviados += 1
+    return time.perf_counter() - inicio
+
+
+async def main():
+    suscriptores = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    tasa = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    duracion = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+
+    broker = RecordBroker()
+    tiempos = []
+    latencias = []
+    recibidos = [0] * suscriptores
+
+    async def consumidor(n, subscription):
+        while True:
+            mensajes = await subscription.get()
+            recibidos[n] += len(mensajes)
+            # Latencia del último mensaje de cada lote (solo se decodifica ese)
+            # Latency of the last message of each batch (only that one is decoded)
+            ultimo = json.loads(mensajes[-1])["id_record"]
+            latencias.append(time.perf_counter() - tiempos[ultimo])
+
+    lento = broker.subscribe()
+    tareas = [asyncio.create_task(consumidor(n, broker.subscribe())) for n in range(suscriptores)]
+    total_publicacion = await asyncio.to_thread(publicar, broker, tasa, duracion, tiempos)
+    await asyncio.sleep(1)
+    for tarea in tareas:
+        tarea.cancel()
+
+    publicados = len(tiempos)
+    entregados = sum(recibidos)
+    latencias.sort()
+    print(f"{suscriptores} suscriptores / subscribers, {tasa} msg/s, {duracion:.0f} s")
+    print(f"publicados / published:        {publicados:>12,} ({publicados / total_publicacion:,.0f} msg/s)")
+    print(f"entregados / delivered:        {entregados:>12,} ({entregados / total_publicacion:,.0f} msg/s, "
+          f"{entregados / (publicados * suscriptores):.1%} del total / of total)")
+    print(f"latencia / latency p50 / p99:  {statistics.median(latencias) * 1000:>9.1f} / "
+          f"{latencias[int(len(latencias) * 0.99)] * 1000:.1f} ms")
+    print(f"suscriptor lento / slow subscriber: descartados / dropped {lento.dropped:,}, "
+          f"en cola / queued {len(lento._queue):,}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+# Benchmark: tráfico de actualizaciones (PUT) y borrados (DELETE) por entidad con el camino ORM
+# (cargar, modificar, confirmar, refrescar) vs RETURNING_WRITES=1 (un solo UPDATE/DELETE ... RETURNING)
+# Benchmark: update (PUT) and delete (DELETE) traffic per entity with the ORM path
+# (load, change, commit, refresh) vs RETURNING_WRITES=1 (a single UPDATE/DELETE ... RETURNING)
+#
+# Uso / Usage:
+#   python benchmarks/bench_returning_writes.py [num_filas]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+OPERACIONES = 2_000
+MODOS = {"ORM": "0", "RETURNING_WRITES=1": "1"}
+
+
+def worker(n):
+    from fastapi.testclient import TestClient
+
+    import crud
+    import main
+    from database import SessionLocal
+    from models import (ControladorVoltaje, ControladorVoltajeDB, DevicesInfo, DevicesInfoDB, Luces, LucesDB,
+                        TomaDecisiones, TomaDecisionesDB)
+
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        db.add_all([LucesDB(id_device=i, lumens=i * 1.5, nombre=f"luz {i}", vendor="bench") for i in range(1, n + 1)])
+        db.add_all([ControladorVoltajeDB(id_device=i, encendido=1, voltaje=120.0, nombre=f"ctl {i}", vendor="bench")
+                    for i in range(1, n + 1)])
+        db.add_all([DevicesInfoDB(id_device=i, id_type=i, id_signal_type=i, nombre=f"dev {i}", vendor="bench")
+                    for i in range(1, n + 1)])
+        db.add_all([TomaDecisionesDB(id_decision=i, velocidad=1.0, decision=0, date_record=base + timedelta(minutes=i))
+                    for i in range(1, n + 1)])
+        db.commit()
+    finally:
+        db.close()
+
+    # Cada operación usa su propia sesión, como una solicitud con get_db
+    # Each operation uses its own session, like a request with get_db
+    def directo(funcion, *args):
+        sesion = SessionLocal()
+        try:
+            return funcion(sesion, *args)
+        finally:
+            sesion.close()
+
+    entidades = [
+        ("luces", "/luces",
+         lambda i, paso: {"id_device": i, "lumens": paso * 0.5, "nombre": f"luz {i}", "vendor": "bench"},
+         lambda i, paso: directo(crud.update_luces, i, Luces(id_device=i, lumens=paso * 0.5, nombre=f"luz {i}",
+                                                             vendor="bench"))),
+        ("controladores", "/controladores",
+         lambda i, paso: {"id_device": i, "encendido": paso % 2 == 0, "voltaje": 110.0 + paso % 20,
+                          "nombre": f"ctl {i}", "vendor": "bench"},
+         lambda i, paso: directo(crud.update_controlador_voltaje, i, ControladorVoltaje(
+             id_device=i, encendido=paso % 2 == 0, voltaje=110.0 + paso % 20, nombre=f"ctl {i}", vendor="bench"))),
+        ("devices/info", "/devices/info",
+         lambda i, paso: {"id_device": i, "id_type": i, "id_signal_type": i, "nombre": f"dev {i} {paso}",
+                          "vendor": "bench"},
+         lambda i, paso: directo(crud.update_device_info, i, DevicesInfo(
+             id_device=i, id_type=i, id_signal_type=i, nombre=f"dev {i} {paso}", vendor="bench"))),
+        ("decisiones", "/decisiones",
+         lambda i, paso: {"id_decision": i, "velocidad": paso * 0.25, "decision": paso % 2,
+                          "date_record": (base + timedelta(minutes=i)).isoformat()},
+         lambda i, paso: directo(crud.update_toma_decisiones, i, TomaDecisiones(
+             id_decision=i, velocidad=paso * 0.25, decision=paso % 2, date_record=base + timedelta(minutes=i)))),
+    ]
+
+    cliente = TestClient(main.app)
+    for nombre, url, cuerpo, actualizar in entidades:
+        inicio = time.perf_counter()
+        for paso in range(OPERACIONES):
+            i = paso % n + 1
+            cliente.put(f"{url}/{i}", json=cuerpo(i, paso)).raise_for_status()
+        http = (time.perf_counter() - inicio) / OPERACIONES * 1000
+        inicio = time.perf_counter()
+        for paso in range(OPERACIONES):
+            assert actualizar(paso % n + 1, paso) is not None
+        crud_ms = (time.perf_counter() - inicio) / OPERACIONES * 1000
+        print(f"{os.environ['MODO']:<20} {'PUT ' + nombre:<22} {http:>10.3f} ms {crud_ms:>10.3f} ms", flush=True)
+
+    # Borrados: la mitad de las luces por HTTP y la otra mitad directo
+    # Deletes: half of the lights through HTTP and the other half directly
+    mitad = n // 2
+    inicio = time.perf_counter()
+    for i in range(1, mitad + 1):
+        assert cliente.delete(f"/luces/{i}").status_code == 204
+    http = (time.perf_counter() - inicio) / mitad * 1000
+    inicio = time.perf_counter()
+    for i in range(mitad + 1, n + 1):
+        assert directo(crud.delete_luces, i)
+    crud_ms = (time.perf_counter() - inicio) / (n - mitad) * 1000
+    print(f"{os.environ['MODO']:<20} {'DELETE luces':<22} {http:>10.3f} ms {crud_ms:>10.3f} ms", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    print(f"{n} filas por tabla / rows per table, {OPERACIONES} operaciones por entidad / operations per entity")
+    print(f"{'modo':<20} {'operación':<22} {'HTTP':>13} {'crud':>13}", flush=True)
+    for modo, returning in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   RETURNING_WRITES=returning, DB_PERFORMANCE_PROFILE="1", MODO=modo)
+        try:
+            subprocess.run([sys.executable, "-W", "ignore", __file__, "--worker", str(n)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]))
+    else:
+        main()
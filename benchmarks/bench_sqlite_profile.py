@@ -0,0 +1,129 @@
+# Benchmark: tráfico mixto de lectura/escritura sobre DevicesRecords, sin y con DB_PERFORMANCE_PROFILE
+# Benchmark: mixed read/write traffic on DevicesRecords, without and with DB_PERFORMANCE_PROFILE
+#
+# Varios hilos lectores piden páginas de registros por dispositivo mientras varios hilos escritores
+# insertan registros uno por uno (commit por fila), igual que POST /devices/records/.
+# Several reader threads request pages of records per device while several writer threads
+# insert records one by one (one commit per row), like POST /devices/records/.
+#
+# Uso / Usage:
+#   python benchmarks/bench_sqlite_profile.py [segundos]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+LECTORES = 8
+ESCRITORES = 4
+DISPOSITIVOS = 20
+REGISTROS_INICIALES = 100_000
+
+
+def sembrar_datos():
+    import crud
+    import models
+    from database import SessionLocal, engine
+    from models import DevicesRecords
+
+    models.Base.metadata.create_all(bind=engine)
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        crud.create_device_records_batch(db, [
+            DevicesRecords(id_record=i + 1, id_device=i % DISPOSITIVOS, current_value=float(i % 100),
+                           date_record=base + timedelta(seconds=i))
+            for i in range(REGISTROS_INICIALES)
+        ])
+    finally:
+        db.close()
+
+
+def worker(duracion):
+    import crud
+    from database import SessionLocal
+    from models import DevicesRecords
+
+    sembrar_datos()
+    contadores = {"lecturas": 0, "escrituras": 0, "errores": 0}
+    candado = threading.Lock()
+    fin = time.perf_counter() + duracion
+    siguiente_id = iter(range(REGISTROS_INICIALES + 1, 10**9))
+
+    def sumar(clave):
+        with candado:
+            contadores[clave] += 1
+
+    def lector(n):
+        db = SessionLocal()
+        try:
+            while time.perf_counter() < fin:
+                try:
+                    crud.get_devices_records_by_device_id(db, n % DISPOSITIVOS, limit=100)
+                    db.rollback()
+                    sumar("lecturas")
+                except Exception:
+                    db.rollback()
+                    sumar("errores")
+                n += 1
+        finally:
+            db.close()
+
+    def escritor(n):
+        db = SessionLocal()
+        try:
+            while time.perf_counter() < fin:
+                with candado:
+                    id_record = next(siguiente_id)
+                try:
+                    crud.create_device_record(db, DevicesRecords(
+                        id_record=id_record, id_device=n % DISPOSITIVOS,
+                        current_value=1.0, date_record=datetime(2024, 6, 1)))
+                    sumar("escrituras")
+                except Exception:
+                    # Por ejemplo "database is locked" sin busy_timeout
+                    # For example "database is locked" without busy_timeout
+                    db.rollback()
+                    sumar("errores")
+                n += 1
+        finally:
+            db.close()
+
+    hilos = [threading.Thread(target=lector, args=(i,)) for i in range(LECTORES)]
+    hilos += [threading.Thread(target=escritor, args=(i,)) for i in range(ESCRITORES)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    print(f"{os.environ['PERFIL']:<8} {contadores['lecturas'] / duracion:>12,.0f} "
+          f"{contadores['escrituras'] / duracion:>14,.0f} {contadores['errores']:>8}", flush=True)
+
+
+def main():
+    duracion = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    print(f"{LECTORES} lectores / readers, {ESCRITORES} escritores / writers, {duracion:.0f} s")
+    print(f"{'perfil':<8} {'lecturas/s':>12} {'escrituras/s':>14} {'errores':>8}", flush=True)
+    for perfil, activo in (("default", "0"), ("profile", "1")):
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+            DB_PERFORMANCE_PROFILE=activo,
+            PERFIL=perfil,
+        )
+        try:
+            subprocess.run([sys.executable, __file__, "--worker", str(duracion)], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(float(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,101 @@
+# Benchmark: JSON vs MessagePack (Accept / Content-Type: application/msgpack) en la lectura de
+# /devices/records/ y en la ingesta por /devices/records/batch: tamaño del cuerpo, tiempo del servidor y
+# tiempo de codificar/decodificar del lado del cliente
+# Benchmark: JSON vs MessagePack (Accept / Content-Type: application/msgpack) when reading
+# /devices/records/ and ingesting through /devices/records/batch: body size, server time and
+# client-side encode/decode time
+#
+# Uso / Usage:
+#   python benchmarks/bench_wire_format.py [num_registros]
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+LOTE = 1_000
+REPETICIONES = 5
+MODOS = {"JSON": "application/json", "MessagePack": "application/msgpack"}
+
+
+def worker(n, tipo):
+    import msgpack
+    import orjson
+    from fastapi.testclient import TestClient
+
+    import main
+
+    base = datetime(2024, 1, 1)
+    registros = [
+        {"id_record": i, "id_device": i % 50, "current_value": 20.0 + (i % 1000) / 7,
+         "date_record": (base + timedelta(seconds=30 * i)).isoformat()}
+        for i in range(1, n + 1)
+    ]
+    lotes = [registros[desde:desde + LOTE] for desde in range(0, n, LOTE)]
+    if tipo == "application/json":
+        codificar, decodificar = orjson.dumps, orjson.loads
+    else:
+        codificar, decodificar = msgpack.packb, msgpack.unpackb
+    cliente = TestClient(main.app)
+    encabezados = {"Content-Type": tipo, "Accept": tipo}
+
+    # Ingesta: el cliente codifica cada lote y lo envía
+    # Ingest: the client encodes each batch and sends it
+    inicio = time.perf_counter()
+    cuerpos = [codificar(lote) for lote in lotes]
+    codificar_ms = (time.perf_counter() - inicio) * 1000
+    inicio = time.perf_counter()
+    for cuerpo in cuerpos:
+        cliente.post("/devices/records/batch", content=cuerpo, headers=encabezados).raise_for_status()
+    ingesta_ms = (time.perf_counter() - inicio) * 1000
+    bytes_ingesta = sum(len(cuerpo) for cuerpo in cuerpos)
+
+    # Lectura de la lista completa: tiempo del servidor y decodificación en el cliente
+    # Reading the full list: server time and decoding on the client
+    lectura, decodificacion = [], []
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        respuesta = cliente.get("/devices/records/", headers=encabezados)
+        lectura.append((time.perf_counter() - inicio) * 1000)
+        respuesta.raise_for_status()
+        assert respuesta.headers["content-type"] == tipo
+        inicio = time.perf_counter()
+        lista = decodificar(respuesta.content)
+        decodificacion.append((time.perf_counter() - inicio) * 1000)
+        assert len(lista) == n
+    # JSON también con json de la biblioteca estándar, como un cliente sin orjson
+    # JSON also with the standard library json, like a client without orjson
+    stdlib = "-"
+    if tipo == "application/json":
+        inicio = time.perf_counter()
+        json.loads(respuesta.content)
+        stdlib = f"{(time.perf_counter() - inicio) * 1000:.1f} ms"
+    print(f"{os.environ['MODO']:<12} {bytes_ingesta:>13,} {codificar_ms:>9.1f} ms {ingesta_ms:>9.1f} ms "
+          f"{len(respuesta.content):>12,} {sum(lectura) / REPETICIONES:>9.1f} ms "
+          f"{sum(decodificacion) / REPETICIONES:>9.1f} ms {stdlib:>12}", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{n} registros / records, lotes de / batches of {LOTE}, lectura: media de / read: mean of {REPETICIONES}")
+    print(f"{'formato':<12} {'bytes ingesta':>13} {'codificar':>12} {'ingesta':>12} {'bytes lista':>12} "
+          f"{'GET lista':>12} {'decodificar':>12} {'json stdlib':>12}", flush=True)
+    for modo, tipo in MODOS.items():
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite')}",
+                   COMPACT_STORAGE="1", DB_PERFORMANCE_PROFILE="1", MODO=modo)
+        try:
+            subprocess.run([sys.executable, "-W", "ignore", __file__, "--worker", str(n), tipo], env=env, check=True)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        worker(int(sys.argv[2]), sys.argv[3])
+    else:
+        main()
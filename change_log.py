@@ -0,0 +1,173 @@
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from models import (ChangeLogDB, ChangeLogStateDB, ControladorVoltajeDB, ControladorVoltajeResponse, DevicesInfoDB,
+                    DevicesInfoResponse, LucesDB, LucesResponse, TomaDecisionesDB, TomaDecisionesResponse)
+
+# Registro de cambios de las tablas de metadatos (CHANGE_LOG=1), escrito por las funciones de crud.py en la
+# misma transacción que cada alta, modificación o baja, y leído con GET /changes?since=<cursor>. Así las
+# cachés de borde traen solo lo que cambió desde su último cursor en lugar de las tablas completas.
+# Se compacta solo: cada fila conserva únicamente su última entrada (un "upsert" con la fila actual o un
+# "delete"), así que el registro nunca es más grande que las filas vivas más las bajas. Las bajas viejas
+# se borran con `python change_log.py compact`; un cursor anterior a ellas recibe 410 y vuelve a empezar
+# desde since=0. En una base existente hay que llenarlo una vez con `python change_log.py rebuild`.
+# Los registros de dispositivos no entran: ya se leen por rango de tiempo, cursor y /devices/records/live.
+# Change log of the metadata tables (CHANGE_LOG=1), written by the crud.py functions in the same
+# transaction as every create, update or delete, and read with GET /changes?since=<cursor>. That way edge
+# caches fetch only what changed since their last cursor instead of the full tables.
+# It compacts itself: each row keeps only its latest entry (an "upsert" with the current row or a
+# "delete"), so the log is never larger than the live rows plus the deletes. Old deletes are removed with
+# `python change_log.py compact`; a cursor older than them gets a 410 and starts over from since=0. On an
+# existing database it has to be filled once with `python change_log.py rebuild`.
+# Device records are not included: they are already read by time range, cursor and /devices/records/live.
+CHANGE_LOG_ENABLED = os.getenv("CHANGE_LOG", "0").lower() in ("1", "true", "yes")
+
+# Tablas registradas: modelo, columna clave y modelo de respuesta de `data`
+# Logged tables: model, key column and response model of `data`
+TABLES = {
+    DevicesInfoDB.__tablename__: (DevicesInfoDB, DevicesInfoDB.id_device, DevicesInfoResponse),
+    TomaDecisionesDB.__tablename__: (TomaDecisionesDB, TomaDecisionesDB.id_decision, TomaDecisionesResponse),
+    LucesDB.__tablename__: (LucesDB, LucesDB.id_device, LucesResponse),
+    ControladorVoltajeDB.__tablename__: (ControladorVoltajeDB, ControladorVoltajeDB.id_device,
+                                         ControladorVoltajeResponse),
+}
+
+_COLUMNS = ["table_name", "key", "op", "changed_at"]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Anotar que cambiaron (op="upsert") o se borraron (op="delete") las filas `keys` de `model`. Se llama
+# antes del commit de la escritura; las tablas no registradas se ignoran.
+# Record that the `keys` rows of `model` changed (op="upsert") or were deleted (op="delete"). Called
+# before the write's commit; tables that are not logged are ignored.
+def rows_changed(db: Session, model, keys: list, op: str = "upsert"):
+    if not CHANGE_LOG_ENABLED or model.__tablename__ not in TABLES or not keys:
+        return
+    log = ChangeLogDB
+    db.execute(delete(log).where(log.table_name == model.__tablename__, log.key.in_(keys)))
+    changed_at = _now()
+    db.execute(insert(log), [{"table_name": model.__tablename__, "key": key, "op": op, "changed_at": changed_at}
+                             for key in keys])
+
+
+# Anotar una fila nueva que todavía no se confirmó
+# Record a new row that is not committed yet
+def row_added(db: Session, row):
+    if row.__tablename__ in TABLES:
+        rows_changed(db, type(row), [getattr(row, TABLES[row.__tablename__][1].key)])
+
+
+# Anotar las filas que cambió un comando en lote (las que cumplen `filters`), sin leer sus IDs
+# Record the rows a bulk command changed (the ones matching `filters`), without reading their IDs
+def group_changed(db: Session, model, filters: list):
+    if not CHANGE_LOG_ENABLED or model.__tablename__ not in TABLES:
+        return
+    log = ChangeLogDB
+    key = TABLES[model.__tablename__][1]
+    db.execute(delete(log).where(log.table_name == model.__tablename__, log.key.in_(select(key).where(*filters))))
+    db.execute(insert(log).from_select(_COLUMNS, select(
+        literal(model.__tablename__), key, literal("upsert"), literal(_now(), DateTime),
+    ).where(*filters).order_by(key)))
+
+
+# True si `since` es anterior a bajas ya compactadas: el cliente tiene que volver a empezar desde 0
+# True if `since` is older than already compacted deletes: the client has to start over from 0
+def cursor_expired(db: Session, since: int) -> bool:
+    state = db.get(ChangeLogStateDB, 1)
+    return since > 0 and state is not None and since < state.compacted_seq
+
+
+# Página de hasta `limit` cambios posteriores a `since`, en orden de seq, con la fila actual de cada upsert
+# Page of up to `limit` changes after `since`, in seq order, with each upsert's current row
+def get_changes(db: Session, since: int, limit: int) -> dict:
+    log = ChangeLogDB
+    entries = db.execute(select(log).where(log.seq > since).order_by(log.seq).limit(limit + 1)).scalars().all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    data = {}
+    for table_name, (model, key, response_model) in TABLES.items():
+        keys = [entry.key for entry in entries if entry.table_name == table_name and entry.op == "upsert"]
+        if keys:
+            for row in db.execute(select(model).where(key.in_(keys))).scalars():
+                data[(table_name, getattr(row, key.key))] = response_model.model_validate(row).model_dump()
+    return {
+        "changes": [
+            {"seq": entry.seq, "table": entry.table_name, "id": entry.key, "op": entry.op,
+             "data": data.get((entry.table_name, entry.key)) if entry.op == "upsert" else None}
+            for entry in entries
+        ],
+        "cursor": entries[-1].seq if entries else since,
+        "more": more,
+    }
+
+
+# Borrar las bajas anteriores a `before` y subir el seq compactado; devuelve cuántas se borraron
+# Delete the deletes older than `before` and raise the compacted seq; returns how many were deleted
+def compact(db: Session, before: datetime) -> int:
+    log = ChangeLogDB
+    old = [log.op == "delete", log.changed_at < before]
+    newest = db.execute(select(func.max(log.seq)).where(*old)).scalar()
+    if newest is None:
+        return 0
+    deleted = db.execute(delete(log).where(*old)).rowcount
+    _raise_compacted_seq(db, newest)
+    db.commit()
+    return deleted
+
+
+def _raise_compacted_seq(db: Session, seq: int):
+    state = db.get(ChangeLogStateDB, 1)
+    if state is None:
+        db.add(ChangeLogStateDB(id=1, compacted_seq=seq))
+    elif seq > state.compacted_seq:
+        state.compacted_seq = seq
+
+
+# Reconstruir el registro con un upsert por fila viva (al activarlo en una base existente). Las bajas
+# anteriores se pierden, así que los cursores anteriores vencen.
+# Rebuild the log with one upsert per live row (when enabling it on an existing database). Earlier
+# deletes are lost, so earlier cursors expire.
+def rebuild(db: Session):
+    log = ChangeLogDB
+    newest: Optional[int] = db.execute(select(func.max(log.seq))).scalar()
+    db.execute(delete(log))
+    if newest is not None:
+        _raise_compacted_seq(db, newest)
+    changed_at = _now()
+    for table_name, (model, key, _) in TABLES.items():
+        db.execute(insert(log).from_select(_COLUMNS, select(
+            literal(table_name), key, literal("upsert"), literal(changed_at, DateTime),
+        ).order_by(key)))
+    db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Registro de cambios / Change log")
+    parser.add_argument("command", choices=["rebuild", "compact"])
+    parser.add_argument("--keep-days", type=int, default=30,
+                        help="Días de bajas a conservar / Days of deletes to keep")
+    args = parser.parse_args()
+
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            rebuild(session)
+            total = session.query(ChangeLogDB).count()
+            print(f"Registro reconstruido / Log rebuilt: {total} entradas / entries")
+        else:
+            deleted = compact(session, _now() - timedelta(days=args.keep_days))
+            print(f"Bajas compactadas / Deletes compacted: {deleted}")
+    finally:
+        session.close()
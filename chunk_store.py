@@ -0,0 +1,457 @@
+import argparse
+import heapq
+import os
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, chain, groupby, islice
+from operator import attrgetter, itemgetter, xor
+from typing import Optional
+
+from sqlalchemy import Float, delete, func, insert, select, type_coerce
+from sqlalchemy.orm import Session
+
+import partitions
+import rollups
+from database import COMPACT_STORAGE_ENABLED
+from models import DevicesRecordsChunkDB, DevicesRecordsDB, EpochMillis, date_record_bound, record_row_fields
+
+# Almacenamiento comprimido por bloques (CHUNKED_STORAGE=1). `python chunk_store.py compress` empaqueta las
+# horas ya cerradas de cada dispositivo en un BLOB de DevicesRecordsChunk y borra esas filas de
+# DevicesRecords; las lecturas de crud.py combinan ambas tablas. Las filas nuevas siempre entran a
+# DevicesRecords, y actualizar o borrar un registro archivado desempaqueta primero su bloque.
+# Chunked compressed storage (CHUNKED_STORAGE=1). `python chunk_store.py compress` packs the closed hours
+# of each device into one DevicesRecordsChunk BLOB and deletes those rows from DevicesRecords; the reads
+# in crud.py merge both tables. New rows always go into DevicesRecords, and updating or deleting an
+# archived record unpacks its chunk first.
+CHUNKED_STORAGE_ENABLED = os.getenv("CHUNKED_STORAGE", "0").lower() in ("1", "true", "yes")
+
+CHUNK_MS = 3_600_000
+_EPOCH = datetime(1970, 1, 1)
+_to_millis = EpochMillis().process_bind_param
+# Tamaño de los lotes de id_record borrados con un solo DELETE ... IN (...)
+# Size of the id_record batches deleted with a single DELETE ... IN (...)
+_DELETE_BATCH_SIZE = 500
+
+# Registro leído de un bloque; mismos campos y orden que las tuplas de crud._devices_records_columns
+# Record read from a chunk; same fields and order as the crud._devices_records_columns tuples
+ChunkRecord = namedtuple("ChunkRecord", ["id_record", "id_device", "current_value", "date_record"])
+
+_time_key = attrgetter("date_record", "id_record")
+_id_key = attrgetter("id_record")
+
+
+# Codificación de un bloque: las marcas de tiempo como delta de deltas (casi todo ceros con muestreo
+# regular), los id_record como deltas y cada float como XOR con el anterior (estilo Gorilla: valores
+# parecidos comparten signo, exponente y los bits altos de la mantisa). En lugar de empaquetar bit a bit,
+# los bytes de cada entero de 64 bits se reordenan por posición (todos los bytes 0, luego los 1, ...)
+# para que zlib vea las largas corridas de ceros; así tanto codificar como decodificar corren en C
+# (array, itertools.accumulate, zlib).
+# Chunk encoding: timestamps as delta-of-deltas (almost all zeros with regular sampling), id_record as
+# deltas and each float XORed with the previous one (Gorilla style: similar values share the sign,
+# exponent and high mantissa bits). Instead of bit-level packing, the bytes of each 64-bit integer are
+# regrouped by position (all byte 0s, then all byte 1s, ...) so zlib sees the long runs of zeros; that
+# way both encoding and decoding run in C (array, itertools.accumulate, zlib).
+def _diff(values) -> list:
+    return [values[0], *(b - a for a, b in zip(values, values[1:]))]
+
+
+def _shuffle(raw: bytes) -> bytes:
+    return b"".join(raw[i::8] for i in range(8))
+
+
+def _unshuffle(data: bytes, count: int) -> bytes:
+    raw = bytearray(count * 8)
+    for i in range(8):
+        raw[i::8] = data[i * count:(i + 1) * count]
+    return bytes(raw)
+
+
+def encode_chunk(millis: list, ids: list, values: list) -> bytes:
+    bits = array("Q", array("d", values).tobytes())
+    xors = array("Q", [bits[0], *(a ^ b for a, b in zip(bits, bits[1:]))])
+    streams = (array("q", _diff(_diff(millis))), array("q", _diff(ids)), xors)
+    return zlib.compress(b"".join(_shuffle(stream.tobytes()) for stream in streams))
+
+
+def decode_chunk(data: bytes, count: int):
+    raw = zlib.decompress(data)
+    size = count * 8
+    millis = array("q", _unshuffle(raw[:size], count))
+    ids = array("q", _unshuffle(raw[size:2 * size], count))
+    xors = array("Q", _unshuffle(raw[2 * size:], count))
+    values = array("d", array("Q", accumulate(xors, xor)).tobytes())
+    return list(accumulate(accumulate(millis))), list(accumulate(ids)), values.tolist()
+
+
+# Registros de un bloque en orden (date_record, id_record), con date_record del mismo tipo que la columna
+# A chunk's records in (date_record, id_record) order, with date_record of the same type as the column
+def chunk_records(chunk) -> list:
+    millis, ids, values = decode_chunk(chunk.data, chunk.count)
+    dates = [_EPOCH + timedelta(milliseconds=value) for value in millis]
+    if not COMPACT_STORAGE_ENABLED:
+        dates = [value.date() for value in dates]
+    return list(map(ChunkRecord._make, zip(ids, [chunk.id_device] * chunk.count, values, dates)))
+
+
+def _hour_start(millis: int) -> int:
+    return millis - millis % CHUNK_MS
+
+
+def _records_columns(model=DevicesRecordsDB):
+    return select(
+        model.id_record,
+        model.id_device,
+        type_coerce(model.current_value, Float).label("current_value"),
+        model.date_record,
+    )
+
+
+# Guardar (o reemplazar) el bloque de una hora de un dispositivo
+# Store (or replace) one hour's chunk of a device
+def _write_chunk(db: Session, id_device: int, chunk_start: int, records: list):
+    db.execute(delete(DevicesRecordsChunkDB).where(
+        DevicesRecordsChunkDB.id_device == id_device, DevicesRecordsChunkDB.chunk_start == chunk_start,
+    ))
+    ids = [record.id_record for record in records]
+    db.execute(insert(DevicesRecordsChunkDB).values(
+        id_device=id_device,
+        chunk_start=chunk_start,
+        count=len(records),
+        min_id=min(ids),
+        max_id=max(ids),
+        data=encode_chunk([_to_millis(record.date_record, None) for record in records], ids,
+                          [float(record.current_value) for record in records]),
+    ))
+
+
+# Empaquetar las horas anteriores a `before` de cada dispositivo. Las filas de una hora que ya tiene
+# bloque (registros que llegaron tarde) se mezclan con él. Un commit por dispositivo (y por partición
+# con RECORD_PARTITIONS=1; una hora nunca cruza el límite de un mes).
+# Pack each device's hours before `before`. Rows of an hour that already has a chunk (records that
+# arrived late) are merged into it. One commit per device (and per partition with RECORD_PARTITIONS=1;
+# an hour never crosses a month boundary).
+def compress(db: Session, before: datetime) -> dict:
+    cutoff = date_record_bound(before.replace(minute=0, second=0, microsecond=0))
+    all_devices = set()
+    chunks = records = 0
+    for model in partitions.record_models(db, until=before):
+        devices = db.execute(
+            select(model.id_device).where(model.date_record < cutoff).distinct()
+        ).scalars().all()
+        for id_device in devices:
+            id_device = int(id_device)
+            all_devices.add(id_device)
+            # Las filas se leen por lotes y se empaquetan hora por hora; solo se guardan sus id_record
+            # Rows are read in batches and packed hour by hour; only their id_record values are kept
+            rows = db.execute(_records_columns(model).where(
+                model.id_device == id_device, model.date_record < cutoff,
+            ).order_by(model.date_record, model.id_record), execution_options={"yield_per": 10_000})
+            ids = array("q")
+            for chunk_start, hour_rows in groupby(rows, key=lambda row: _hour_start(_to_millis(row.date_record, None))):
+                hour_rows = list(hour_rows)
+                ids.extend(row.id_record for row in hour_rows)
+                existing = db.get(DevicesRecordsChunkDB, (id_device, chunk_start))
+                if existing is not None:
+                    hour_rows = sorted(chain(chunk_records(existing), hour_rows), key=_time_key)
+                _write_chunk(db, id_device, chunk_start, hour_rows)
+                chunks += 1
+            # Se borran exactamente las filas empaquetadas, no todo el rango: una fila vieja insertada
+            # mientras tanto se queda en DevicesRecords hasta la próxima ejecución.
+            # Exactly the packed rows are deleted, not the whole range: an old row inserted meanwhile stays
+            # in DevicesRecords until the next run.
+            for start in range(0, len(ids), _DELETE_BATCH_SIZE):
+                db.execute(delete(model).where(
+                    model.id_record.in_(ids[start:start + _DELETE_BATCH_SIZE].tolist())
+                ))
+            db.commit()
+            records += len(ids)
+    return {"devices": len(all_devices), "chunks": chunks, "records": records}
+
+
+# Devolver las lecturas de un bloque a DevicesRecords (o a la partición de su mes) y borrar el bloque
+# Move a chunk's readings back into DevicesRecords (or into its month's partition) and delete the chunk
+def _unpack(db: Session, chunk):
+    for model, rows in partitions.group_by_model(db, [record._asdict() for record in chunk_records(chunk)]):
+        db.execute(insert(model), rows)
+    db.delete(chunk)
+    db.flush()
+
+
+# Retención: borrar los bloques de las horas anteriores a `before` (ver partitions.drop_before)
+# Retention: delete the chunks of the hours before `before` (see partitions.drop_before)
+def drop_before(db: Session, before: datetime) -> int:
+    return db.execute(delete(DevicesRecordsChunkDB).where(
+        DevicesRecordsChunkDB.chunk_start <= _to_millis(before, None) - CHUNK_MS,
+    )).rowcount
+
+
+# Borrado por rango (crud.delete_devices_records_range): se borran enteros los bloques que caen dentro
+# de [since, until] y se desempaquetan los que lo cruzan, para que el DELETE de filas borre su parte.
+# Con rollups también se desempaquetan los días de los bordes, que se recalculan desde las filas crudas.
+# Devuelve cuántos registros archivados se borraron.
+# Range delete (crud.delete_devices_records_range): the chunks that fall inside [since, until] are
+# deleted whole and the ones crossing it are unpacked, so the row DELETE removes their part. With
+# rollups the edge days are unpacked too, since they are recomputed from the raw rows.
+# Returns how many archived records were deleted.
+def delete_range(db: Session, id_device: Optional[int], since: Optional[datetime], until: Optional[datetime]) -> int:
+    if not CHUNKED_STORAGE_ENABLED:
+        return 0
+    chunk = DevicesRecordsChunkDB
+    low, high = (_to_millis(date_record_bound(value), None) for value in (since, until))
+    device_filter = [chunk.id_device == id_device] if id_device is not None else []
+    inside = list(device_filter)
+    if low is not None:
+        inside.append(chunk.chunk_start >= low)
+    if high is not None:
+        inside.append(chunk.chunk_start <= high - CHUNK_MS + 1)
+    deleted = db.execute(select(func.coalesce(func.sum(chunk.count), 0)).where(*inside)).scalar()
+    db.execute(delete(chunk).where(*inside))
+    if rollups.ROLLUPS_ENABLED:
+        day_ms = 24 * CHUNK_MS
+        low = low - low % day_ms if low is not None else None
+        high = high - high % day_ms + day_ms - 1 if high is not None else None
+    overlapping = list(device_filter)
+    if low is not None:
+        overlapping.append(chunk.chunk_start > low - CHUNK_MS)
+    if high is not None:
+        overlapping.append(chunk.chunk_start <= high)
+    for partial in db.execute(select(chunk).where(*overlapping)).scalars().all():
+        _unpack(db, partial)
+    return deleted
+
+
+# Desempaquetar todos los bloques (antes de desactivar CHUNKED_STORAGE)
+# Unpack every chunk (before turning CHUNKED_STORAGE off)
+def unpack_all(db: Session) -> int:
+    unpacked = 0
+    for chunk in db.execute(select(DevicesRecordsChunkDB)).scalars().all():
+        _unpack(db, chunk)
+        unpacked += chunk.count
+    db.commit()
+    return unpacked
+
+
+# Bloques que pueden contener un id_record
+# Chunks that may contain an id_record
+def _chunks_with_id(db: Session, id_record: int):
+    return db.execute(select(DevicesRecordsChunkDB).where(
+        DevicesRecordsChunkDB.min_id <= id_record, DevicesRecordsChunkDB.max_id >= id_record,
+    )).scalars()
+
+
+# Buscar un registro archivado por id_record (None si no está en ningún bloque)
+# Look up an archived record by id_record (None if it is in no chunk)
+def find_record(db: Session, id_record: int) -> Optional[ChunkRecord]:
+    if not CHUNKED_STORAGE_ENABLED:
+        return None
+    for chunk in _chunks_with_id(db, id_record):
+        for record in chunk_records(chunk):
+            if record.id_record == id_record:
+                return record
+    return None
+
+
+# Desempaquetar el bloque que contiene un registro, para poder actualizarlo o borrarlo como fila normal
+# Unpack the chunk that holds a record, so it can be updated or deleted as a regular row
+def unpack_record(db: Session, id_record: int) -> bool:
+    if not CHUNKED_STORAGE_ENABLED:
+        return False
+    for chunk in _chunks_with_id(db, id_record):
+        if any(record.id_record == id_record for record in chunk_records(chunk)):
+            _unpack(db, chunk)
+            return True
+    return False
+
+
+# Los rollups recalculan un intervalo desde las filas crudas, así que antes se desempaquetan los bloques
+# del día de cada clave; la próxima compresión los vuelve a empaquetar.
+# Rollups recompute a bucket from the raw rows, so the chunks of each key's day are unpacked first;
+# the next compression packs them again.
+def unpack_for_rollups(db: Session, keys: list[tuple]):
+    if not CHUNKED_STORAGE_ENABLED or not rollups.ROLLUPS_ENABLED:
+        return
+    for id_device, date_record in set((int(id_device), rollups.bucket_prefix(d, "1d")) for id_device, d in keys):
+        day_start = _to_millis(rollups.bucket_start(date_record), None)
+        for chunk in db.execute(select(DevicesRecordsChunkDB).where(
+            DevicesRecordsChunkDB.id_device == id_device,
+            DevicesRecordsChunkDB.chunk_start >= day_start,
+            DevicesRecordsChunkDB.chunk_start < day_start + 24 * CHUNK_MS,
+        )).scalars().all():
+            _unpack(db, chunk)
+
+
+# Registros archivados de un dispositivo en orden (date_record, id_record), con los mismos filtros de
+# rango y cursor que crud.get_devices_records_by_device_id. Solo se decodifican los bloques que se
+# solapan con el rango, y de forma perezosa.
+# A device's archived records in (date_record, id_record) order, with the same range and cursor filters
+# as crud.get_devices_records_by_device_id. Only the chunks overlapping the range are decoded, lazily.
+def iter_device_records(db: Session, id_device: int, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None, after: Optional[tuple] = None):
+    since, until = date_record_bound(since), date_record_bound(until)
+    query = select(DevicesRecordsChunkDB).where(DevicesRecordsChunkDB.id_device == id_device)
+    lower = max([_to_millis(value, None) for value in (since, after and after[0]) if value is not None], default=None)
+    if lower is not None:
+        query = query.where(DevicesRecordsChunkDB.chunk_start > lower - CHUNK_MS)
+    if until is not None:
+        query = query.where(DevicesRecordsChunkDB.chunk_start <= _to_millis(until, None))
+    for chunk in db.execute(query.order_by(DevicesRecordsChunkDB.chunk_start)).scalars().all():
+        for record in chunk_records(chunk):
+            if since is not None and record.date_record < since:
+                continue
+            if until is not None and record.date_record > until:
+                break
+            if after is not None and (record.date_record, record.id_record) <= after:
+                continue
+            yield record
+
+
+# Combinar las filas de DevicesRecords de un dispositivo (ya ordenadas por fecha) con las archivadas
+# Merge a device's DevicesRecords rows (already ordered by date) with the archived ones
+def merge_device_records(db: Session, rows, id_device: int, since: Optional[datetime] = None,
+                         until: Optional[datetime] = None, after: Optional[tuple] = None,
+                         limit: Optional[int] = None) -> list:
+    if not CHUNKED_STORAGE_ENABLED:
+        return rows
+    merged = heapq.merge(rows, iter_device_records(db, id_device, since, until, after), key=_time_key)
+    return list(islice(merged, limit))
+
+
+# Todos los registros archivados, bloque por bloque (dispositivo y hora)
+# Every archived record, chunk by chunk (device and hour)
+def iter_all_records(db: Session):
+    if not CHUNKED_STORAGE_ENABLED:
+        return
+    query = select(DevicesRecordsChunkDB).order_by(DevicesRecordsChunkDB.id_device, DevicesRecordsChunkDB.chunk_start)
+    for chunk in db.execute(query).scalars().yield_per(100):
+        yield from chunk_records(chunk)
+
+
+# Los `count` registros archivados más recientes de un dispositivo en [since, until], en orden de fecha.
+# Los bloques se leen del más nuevo al más viejo hasta juntar `count` registros.
+# A device's `count` newest archived records in [since, until], in date order.
+# Chunks are read from newest to oldest until `count` records are gathered.
+def newest_records(db: Session, id_device: int, count: int, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> list:
+    if not CHUNKED_STORAGE_ENABLED:
+        return []
+    since, until = date_record_bound(since), date_record_bound(until)
+    query = select(DevicesRecordsChunkDB).where(DevicesRecordsChunkDB.id_device == id_device)
+    if since is not None:
+        query = query.where(DevicesRecordsChunkDB.chunk_start > _to_millis(since, None) - CHUNK_MS)
+    if until is not None:
+        query = query.where(DevicesRecordsChunkDB.chunk_start <= _to_millis(until, None))
+    records = []
+    for chunk in db.execute(query.order_by(DevicesRecordsChunkDB.chunk_start.desc())).scalars().yield_per(10):
+        records.extend(
+            record for record in chunk_records(chunk)
+            if (since is None or record.date_record >= since) and (until is None or record.date_record <= until)
+        )
+        if len(records) >= count:
+            break
+    return sorted(records, key=_time_key)[-count:]
+
+
+# Combinar los registros más recientes de DevicesRecords (ya ordenados por fecha) con los archivados
+# Merge the newest DevicesRecords rows (already ordered by date) with the archived ones
+def merge_newest_records(db: Session, rows: list, id_device: int, count: int, since: Optional[datetime] = None,
+                         until: Optional[datetime] = None) -> list:
+    if not CHUNKED_STORAGE_ENABLED:
+        return rows
+    return list(heapq.merge(rows, newest_records(db, id_device, count, since, until), key=_time_key))[-count:]
+
+
+# Registro archivado más reciente de un dispositivo (o None)
+# A device's newest archived record (or None)
+def latest_record(db: Session, id_device: int) -> Optional[ChunkRecord]:
+    records = newest_records(db, id_device, 1)
+    return records[-1] if records else None
+
+
+# Dispositivos con registros archivados
+# Devices with archived records
+def device_ids(db: Session) -> list[int]:
+    if not CHUNKED_STORAGE_ENABLED:
+        return []
+    return db.execute(select(DevicesRecordsChunkDB.id_device).distinct()).scalars().all()
+
+
+# Combinar todas las filas de DevicesRecords (objetos ORM o tuplas) con las archivadas, por id_record.
+# Con `fields` las filas son tuplas de models.record_row_fields(fields) y los registros archivados se
+# recortan a esas mismas columnas; id_record es la primera en ambos.
+# Merge every DevicesRecords row (ORM objects or tuples) with the archived ones, by id_record.
+# With `fields` the rows are tuples of models.record_row_fields(fields) and the archived records are
+# cut down to those same columns; id_record is the first one in both.
+def merge_all_records(db: Session, rows, fields: Optional[tuple] = None) -> list:
+    if not CHUNKED_STORAGE_ENABLED:
+        return rows
+    if fields is None:
+        return sorted(chain(rows, iter_all_records(db)), key=_id_key)
+    positions = [ChunkRecord._fields.index(name) for name in record_row_fields(fields)]
+    archived = (tuple(record[position] for position in positions) for record in iter_all_records(db))
+    return sorted(chain(rows, archived), key=itemgetter(0))
+
+
+# Registros archivados en lotes de `batch_size`, con los filtros de la exportación
+# Archived records in batches of `batch_size`, with the export filters
+def iter_record_batches(db: Session, batch_size: int, id_device: Optional[int] = None,
+                        since: Optional[datetime] = None, until: Optional[datetime] = None):
+    if not CHUNKED_STORAGE_ENABLED:
+        return
+    if id_device is not None:
+        records = iter_device_records(db, id_device, since, until)
+    else:
+        since, until = date_record_bound(since), date_record_bound(until)
+        records = (
+            record for record in iter_all_records(db)
+            if (since is None or record.date_record >= since) and (until is None or record.date_record <= until)
+        )
+    while batch := list(islice(records, batch_size)):
+        yield batch
+
+
+# Agregados por intervalo calculados en Python sobre registros ya ordenados por fecha (filas y archivados)
+# Per-bucket aggregates computed in Python over records already ordered by date (rows and archived)
+def aggregate_records(records, bucket: str) -> list:
+    result = []
+    for prefix, bucket_records in groupby(records, key=lambda record: rollups.bucket_prefix(record.date_record, bucket)):
+        values = [float(record.current_value) for record in bucket_records]
+        result.append({
+            "bucket_start": rollups.bucket_start(prefix),
+            "min": min(values),
+            "max": max(values),
+            "avg": sum(values) / len(values),
+            "count": len(values),
+            "last": values[-1],
+        })
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacenamiento comprimido por bloques / Chunked compressed storage")
+    parser.add_argument("command", choices=["compress", "unpack"])
+    parser.add_argument("--older-than-hours", type=int, default=1,
+                        help="Solo horas cerradas hace al menos N horas / Only hours closed at least N hours ago")
+    args = parser.parse_args()
+
+    if args.command == "compress" and not CHUNKED_STORAGE_ENABLED:
+        # Sin CHUNKED_STORAGE=1 la API no lee los bloques y los registros comprimidos desaparecerían
+        # Without CHUNKED_STORAGE=1 the API does not read chunks and the compressed records would vanish
+        parser.error("compress requiere / requires CHUNKED_STORAGE=1")
+
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        if args.command == "compress":
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            stats = compress(session, now - timedelta(hours=args.older_than_hours))
+            print(f"Comprimidos / Compressed: {stats['records']} registros / records en / in "
+                  f"{stats['chunks']} bloques / chunks ({stats['devices']} dispositivos / devices)")
+        else:
+            print(f"Desempaquetados / Unpacked: {unpack_all(session)} registros / records")
+    finally:
+        session.close()
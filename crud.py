@@ -1,7 +1,105 @@
+from sqlalchemy import Float, bindparam, delete, func, insert, select, tuple_, type_coerce, update
 from sqlalchemy.orm import Session
 import models
+import change_log
+import chunk_store
+import latest_state
+import partitions
+import rollups
+from record_stream import record_broker
+from recent_cache import recent_cache
+from metadata_cache import metadata_cache
+from response_cache import table_versions
+from database import RETURNING_WRITES_ENABLED
+from projection import field_columns
 from models import DevicesInfo, DevicesInfoDB, DevicesRecords, DevicesRecordsDB, TomaDecisiones, TomaDecisionesDB, Luces, LucesDB, ControladorVoltaje, ControladorVoltajeDB
+from models import DevicesInfoResponse, LucesResponse, ControladorVoltajeResponse, LucesCommand, ControladorVoltajeCommand, DeviceGroup, RECORD_FIELDS, date_record_bound, record_row_fields
 from datetime import datetime
+from functools import lru_cache
+from itertools import chain
+from typing import Optional
+
+
+# Convertir una fila ORM (o None) al modelo de respuesta, para guardarla en caché sin la sesión
+# Convert an ORM row (or None) into the response model, so it can be cached without the session
+def _to_response(response_model, row):
+    return response_model.model_validate(row) if row is not None else None
+
+# Consulta de toda la tabla o, con ?fields=, solo de esas columnas (filas en lugar de objetos ORM).
+# Se ordena por clave primaria: sin ORDER BY, SQLite puede leer un índice que cubre las columnas
+# pedidas y devolver otro orden que el del listado completo.
+# Query of the whole table or, with ?fields=, of those columns only (rows instead of ORM objects).
+# It is ordered by primary key: without ORDER BY, SQLite may read an index covering the requested
+# columns and return a different order than the full list.
+def _query_fields(db: Session, model, fields: Optional[tuple] = None):
+    if fields is None:
+        return db.query(model)
+    return db.query(*field_columns(model, fields)).order_by(*model.__table__.primary_key.columns)
+
+# Leer varias filas por clave primaria con un solo IN (...) para los IDs que no están en la caché de
+# metadatos; devuelve {id: modelo de respuesta o None} en el orden de `ids`
+# Read several rows by primary key with a single IN (...) for the IDs not in the metadata cache;
+# returns {id: response model or None} in the order of `ids`
+def _get_many_responses(db: Session, model, column, ids: list[int], response_model) -> dict:
+    def cargar(keys):
+        rows = db.query(model).filter(column.in_([value for _, value in keys])).all()
+        return {(model.__tablename__, getattr(row, column.key)): response_model.model_validate(row) for row in rows}
+    values = metadata_cache.get_many_or_load([(model.__tablename__, value) for value in ids], cargar)
+    return {value: values[(model.__tablename__, value)] for value in ids}
+
+# Actualizar una fila por clave primaria con `values`; None si no existe. Con RETURNING_WRITES=1 es un
+# solo UPDATE ... RETURNING y se devuelve la fila nueva (con las columnas como atributos, igual que el
+# objeto ORM para response_model); si no, se carga, se modifica, se confirma y se refresca.
+# Update a row by primary key with `values`; None if it does not exist. With RETURNING_WRITES=1 it is a
+# single UPDATE ... RETURNING and the new row is returned (with the columns as attributes, just like the
+# ORM object for response_model); otherwise it is loaded, changed, committed and refreshed.
+def _update_by_pk(db: Session, model, column, value, values: dict):
+    if RETURNING_WRITES_ENABLED:
+        row = db.execute(update_returning(model, column.key, tuple(values)), {"pk_value": value, **values}).first()
+        if row is not None:
+            change_log.rows_changed(db, model, [value])
+            db.commit()
+        return row
+    row = db.query(model).filter(column == value).first()
+    if row:
+        for name, new_value in values.items():
+            setattr(row, name, new_value)
+        change_log.rows_changed(db, model, [value])
+        db.commit()
+        db.refresh(row)
+    return row
+
+# Sentencias UPDATE/DELETE ... RETURNING por clave primaria con parámetros (pk_value y uno por columna),
+# armadas una sola vez por tabla y columnas: construirlas en cada llamada cuesta más que ejecutarlas
+# UPDATE/DELETE ... RETURNING statements by primary key with parameters (pk_value and one per column),
+# built once per table and columns: building them on every call costs more than running them
+@lru_cache(maxsize=None)
+def update_returning(model, key: str, names: tuple):
+    return (update(model).where(getattr(model, key) == bindparam("pk_value"))
+            .values({name: bindparam(name) for name in names})
+            .returning(*model.__table__.columns).execution_options(synchronize_session=False))
+
+@lru_cache(maxsize=None)
+def delete_returning(model, key: str):
+    return (delete(model).where(getattr(model, key) == bindparam("pk_value"))
+            .returning(getattr(model, key)).execution_options(synchronize_session=False))
+
+# Eliminar una fila por clave primaria; False si no existe. Con RETURNING_WRITES=1 es un solo
+# DELETE ... RETURNING; si no, se carga y se borra con la sesión.
+# Delete a row by primary key; False if it does not exist. With RETURNING_WRITES=1 it is a single
+# DELETE ... RETURNING; otherwise it is loaded and deleted through the session.
+def _delete_by_pk(db: Session, model, column, value) -> bool:
+    if RETURNING_WRITES_ENABLED:
+        deleted = db.execute(delete_returning(model, column.key), {"pk_value": value}).first() is not None
+    else:
+        row = db.query(model).filter(column == value).first()
+        deleted = row is not None
+        if deleted:
+            db.delete(row)
+    if deleted:
+        change_log.rows_changed(db, model, [value], "delete")
+        db.commit()
+    return deleted
 
 
 # Operaciones CRUD para Test
@@ -29,12 +127,7 @@ def get_test_by_id(db: Session, id: int):
 # Eliminar un test
 # Delete a test
 def delete_test(db: Session, id: int):
-    task = db.query(models.Test).filter(models.Test.id == id).first()
-    if task:
-        db.delete(task)
-        db.commit()
-        return True
-    return False
+    return _delete_by_pk(db, models.Test, models.Test.id, id)
 
 
 # Operaciones CRUD para DevicesInfo (Información de Dispositivos)
@@ -42,21 +135,36 @@ def delete_test(db: Session, id: int):
 
 # Obtener información de todos los dispositivos
 # Get all devices info
-def get_all_devices_info(db: Session, id_device:int):
-    return db.query(models.DevicesInfoDB).all()
+def get_all_devices_info(db: Session, id_device:int, fields: Optional[tuple] = None):
+    return _query_fields(db, DevicesInfoDB, fields).all()
 
-# Obtener información de un dispositivo por ID
-# Get device info by ID
+# Obtener información de un dispositivo por ID (pasa por la caché de metadatos)
+# Get device info by ID (goes through the metadata cache)
 def get_devices_info_by_id(db: Session, id_device:int):
-    return db.query(models.DevicesInfoDB).filter(models.DevicesInfoDB.id_device == id_device).all()
+    return metadata_cache.get_or_load((DevicesInfoDB.__tablename__, id_device), lambda: [
+        DevicesInfoResponse.model_validate(device_info)
+        for device_info in db.query(models.DevicesInfoDB).filter(models.DevicesInfoDB.id_device == id_device).all()
+    ])
+
+# Obtener información de varios dispositivos con una sola consulta: {id_device: [info]}, con la
+# misma forma (y las mismas entradas de caché) que get_devices_info_by_id
+# Get the info of several devices with a single query: {id_device: [info]}, with the same shape
+# (and the same cache entries) as get_devices_info_by_id
+def get_devices_info_by_ids(db: Session, ids: list[int]) -> dict:
+    def cargar(keys):
+        values = {key: [] for key in keys}
+        for device_info in db.query(DevicesInfoDB).filter(DevicesInfoDB.id_device.in_([value for _, value in keys])):
+            values[(DevicesInfoDB.__tablename__, device_info.id_device)].append(DevicesInfoResponse.model_validate(device_info))
+        return values
+    values = metadata_cache.get_many_or_load([(DevicesInfoDB.__tablename__, value) for value in ids], cargar)
+    return {value: values[(DevicesInfoDB.__tablename__, value)] for value in ids}
 
 # Eliminar información de un dispositivo
 # Delete device info
 def delete_device_info(db: Session, id_device:int):
-    device = db.query(models.DevicesInfoDB).filter(models.DevicesInfoDB.id_device == id_device).first()
-    if device:
-        db.delete(device)
-        db.commit()
+    if _delete_by_pk(db, DevicesInfoDB, DevicesInfoDB.id_device, id_device):
+        table_versions.bump(DevicesInfoDB.__tablename__)
+        metadata_cache.invalidate((DevicesInfoDB.__tablename__, id_device))
         return True
     return False
 
@@ -71,21 +179,25 @@ def create_device_info(db: Session, device_info: DevicesInfo):
         vendor=device_info.vendor,
     )
     db.add(db_device_info)
+    change_log.rows_changed(db, DevicesInfoDB, [db_device_info.id_device])
     db.commit()
+    table_versions.bump(DevicesInfoDB.__tablename__)
     db.refresh(db_device_info)
+    metadata_cache.invalidate((DevicesInfoDB.__tablename__, db_device_info.id_device))
     return db_device_info
 
 # Actualizar información de un dispositivo
 # Update device info
 def update_device_info(db: Session, id_device: int, device_info: DevicesInfo):
-    db_device_info = db.query(DevicesInfoDB).filter(DevicesInfoDB.id_device == id_device).first()
+    db_device_info = _update_by_pk(db, DevicesInfoDB, DevicesInfoDB.id_device, id_device, {
+        "id_type": device_info.id_type,
+        "id_signal_type": device_info.id_signal_type,
+        "nombre": device_info.nombre,
+        "vendor": device_info.vendor,
+    })
     if db_device_info:
-        db_device_info.id_type = device_info.id_type
-        db_device_info.id_signal_type = device_info.id_signal_type
-        db_device_info.nombre = device_info.nombre
-        db_device_info.vendor = device_info.vendor
-        db.commit()
-        db.refresh(db_device_info)
+        table_versions.bump(DevicesInfoDB.__tablename__)
+        metadata_cache.invalidate((DevicesInfoDB.__tablename__, id_device))
         return db_device_info
     return None
 
@@ -95,41 +207,301 @@ def update_device_info(db: Session, id_device: int, device_info: DevicesInfo):
 # Obtener todos los registros de dispositivos
 # Get all device records
 def get_all_devices_records(db: Session):
-    return db.query(DevicesRecordsDB).all()
+    records = partitions.merge_by_id([db.query(model).all() for model in partitions.record_models(db)])
+    return chunk_store.merge_all_records(db, records)
+
+# Obtener todos los registros como tuplas de columnas (sin objetos ORM), con current_value como float.
+# Se ejecuta sobre la conexión para saltar también la capa de resultados del ORM. Con `fields` solo
+# se leen esas columnas (ver _devices_records_columns).
+# Get all device records as column tuples (no ORM objects), with current_value as a float.
+# It runs on the connection to also skip the ORM result layer. With `fields` only those columns
+# are read (see _devices_records_columns).
+def get_all_devices_records_rows(db: Session, fields: Optional[tuple] = None):
+    connection = db.connection()
+    rows = partitions.merge_by_id([
+        connection.execute(_devices_records_columns(model, fields).order_by(model.id_record)).all()
+        for model in partitions.record_models(db)
+    ])
+    return chunk_store.merge_all_records(db, rows, fields)
+
+# Iterar todos los registros de dispositivos en lotes de tamaño fijo (para streaming)
+# (con CHUNKED_STORAGE=1, primero los registros archivados en bloques; con particiones, mes por mes)
+# Iterate all device records in fixed-size batches (for streaming)
+# (with CHUNKED_STORAGE=1, the records archived in chunks come first; with partitions, month by month)
+def iter_all_devices_records(db: Session, batch_size: int):
+    return chain(chunk_store.iter_all_records(db), *(
+        db.query(model).order_by(model.id_record).yield_per(batch_size) for model in partitions.record_models(db)
+    ))
+
+# SELECT de las columnas de DevicesRecords (o de una partición); current_value se lee como float y no como Decimal.
+# Con `fields` solo esas columnas más id_record, que ordena y combina particiones y bloques.
+# SELECT of the DevicesRecords (or partition) columns; current_value is read as a float rather than a Decimal.
+# With `fields` only those columns plus id_record, which orders and merges partitions and chunks.
+def _devices_records_columns(model=DevicesRecordsDB, fields: Optional[tuple] = None):
+    columns = {
+        "id_record": model.id_record,
+        "id_device": model.id_device,
+        "current_value": type_coerce(model.current_value, Float).label("current_value"),
+        "date_record": model.date_record,
+    }
+    return select(*(columns[name] for name in (RECORD_FIELDS if fields is None else record_row_fields(fields))))
+
+# Columnas de registros para ?fields= en las lecturas por dispositivo: las pedidas más id_record y
+# date_record, que ordenan, paginan y combinan con los bloques archivados
+# Record columns for ?fields= in per-device reads: the requested ones plus id_record and
+# date_record, which order, paginate and merge with the archived chunks
+def _device_record_columns(model, fields: tuple) -> list:
+    return [getattr(model, name) for name in RECORD_FIELDS if name in fields or name in ("id_record", "date_record")]
+
+# Recorrer registros como tuplas de columnas (sin objetos ORM), en lotes de `batch_size` filas,
+# con filtros opcionales por dispositivo y rango de fechas. Usado por la exportación columnar.
+# Iterate records as column tuples (no ORM objects), in batches of `batch_size` rows,
+# with optional device and date range filters. Used by the columnar export.
+def iter_devices_records_batches(db: Session, batch_size: int, id_device: Optional[int] = None,
+                                 since: Optional[datetime] = None, until: Optional[datetime] = None):
+    yield from chunk_store.iter_record_batches(db, batch_size, id_device, since, until)
+    for model in partitions.record_models(db, since, until):
+        query = _devices_records_columns(model)
+        if id_device is not None:
+            query = query.where(model.id_device == id_device)
+        if since is not None:
+            query = query.where(model.date_record >= date_record_bound(since))
+        if until is not None:
+            query = query.where(model.date_record <= date_record_bound(until))
+        if id_device is not None:
+            query = query.order_by(model.date_record, model.id_record)
+        else:
+            query = query.order_by(model.id_record)
+        result = db.execute(query, execution_options={"yield_per": batch_size})
+        for batch in result.partitions():
+            yield batch
+
+# Buscar un registro por ID en DevicesRecords o, con particiones, en cada mes (del más reciente al más viejo)
+# Find a record by ID in DevicesRecords or, with partitions, in every month (newest to oldest)
+def _find_device_record(db: Session, id_record: int):
+    for model in reversed(partitions.record_models(db)):
+        device_record = db.query(model).filter(model.id_record == id_record).first()
+        if device_record is not None:
+            return device_record
+    return None
 
 # Obtener un registro de dispositivo por ID
 # Get device record by ID
 def get_devices_records_by_id(db: Session, id_record: int):
-    return db.query(DevicesRecordsDB).filter(DevicesRecordsDB.id_record == id_record).first()
-
-# Obtener registros de dispositivo por ID de dispositivo
-# Get device records by device ID
-def get_devices_records_by_device_id(db: Session, id_device: int):
-    return db.query(DevicesRecordsDB).filter(DevicesRecordsDB.id_device == id_device).all()
+    device_record = _find_device_record(db, id_record)
+    if device_record is None:
+        return chunk_store.find_record(db, id_record)
+    return device_record
+
+# Registros de un dispositivo en una tabla (DevicesRecords o una partición), con filtro de tiempo opcional
+# A device's records in one table (DevicesRecords or a partition), with optional time filter
+def _device_records_query(db: Session, model, id_device: int, since: Optional[datetime], until: Optional[datetime],
+                          fields: Optional[tuple] = None):
+    query = db.query(model) if fields is None else db.query(*_device_record_columns(model, fields))
+    query = query.filter(model.id_device == id_device)
+    # Con la columna Date los límites se comparan por día; en modo compacto, con fecha y hora
+    # With the Date column the bounds are compared by day; in compact mode, by date and time
+    if since is not None:
+        query = query.filter(model.date_record >= date_record_bound(since))
+    if until is not None:
+        query = query.filter(model.date_record <= date_record_bound(until))
+    return query
+
+# Obtener registros de dispositivo por ID de dispositivo, con filtro de tiempo opcional
+# y paginación por keyset sobre (date_record, id_record), o solo los `last` más recientes
+# Get device records by device ID, with optional time filter
+# and keyset pagination over (date_record, id_record), or only the `last` newest ones
+def get_devices_records_by_device_id(db: Session, id_device: int, since: Optional[datetime] = None,
+                                     until: Optional[datetime] = None, limit: Optional[int] = None,
+                                     after_id: Optional[int] = None, last: Optional[int] = None,
+                                     fields: Optional[tuple] = None):
+    # Con RECENT_CACHE=1 las ventanas recientes se responden desde memoria
+    # With RECENT_CACHE=1 recent windows are answered from memory
+    cached = recent_cache.read(id_device, lambda: get_newest_devices_records(db, id_device, recent_cache.depth,
+                                                                              fields=RECORD_FIELDS),
+                               since, until, after_id, limit, last)
+    if cached is not None:
+        return cached
+    if last is not None:
+        return get_newest_devices_records(db, id_device, last, since, until, fields)
+    after = None
+    if after_id is not None:
+        # El cursor es el último registro de la página anterior; se busca su fecha por clave primaria
+        # The cursor is the last record of the previous page; its date is looked up by primary key
+        after_record = get_devices_records_by_id(db, after_id)
+        if after_record is None:
+            return []
+        after = (after_record.date_record, after_id)
+    device_records = []
+    # Las particiones no se solapan en el tiempo, así que leerlas en orden ya da el orden por fecha
+    # Partitions do not overlap in time, so reading them in order already yields date order
+    for model in partitions.record_models(db, since, until):
+        query = _device_records_query(db, model, id_device, since, until, fields)
+        if after is not None:
+            query = query.filter(
+                tuple_(model.date_record, model.id_record)
+                > tuple_(*after, types=(model.date_record.type, model.id_record.type))
+            )
+        query = query.order_by(model.date_record, model.id_record)
+        if limit is not None:
+            query = query.limit(limit - len(device_records))
+        device_records.extend(query.all())
+        if limit is not None and len(device_records) >= limit:
+            break
+    return chunk_store.merge_device_records(db, device_records, id_device, since, until, after, limit)
+
+# Los `count` registros más recientes de un dispositivo en [since, until], en orden de fecha
+# (búsqueda hacia atrás por el índice, de la partición más nueva a la más vieja). Con `fields`
+# se leen filas de esas columnas en lugar de objetos ORM (la caché de registros recientes pide todas).
+# A device's `count` newest records in [since, until], in date order
+# (backward index scan, from the newest partition to the oldest). With `fields` rows of those
+# columns are read instead of ORM objects (the recent record cache asks for all of them).
+def get_newest_devices_records(db: Session, id_device: int, count: int, since: Optional[datetime] = None,
+                               until: Optional[datetime] = None, fields: Optional[tuple] = None):
+    device_records = []
+    for model in reversed(partitions.record_models(db, since, until)):
+        query = _device_records_query(db, model, id_device, since, until, fields)
+        query = query.order_by(model.date_record.desc(), model.id_record.desc()).limit(count - len(device_records))
+        device_records[:0] = reversed(query.all())
+        if len(device_records) >= count:
+            break
+    return chunk_store.merge_newest_records(db, device_records, id_device, count, since, until)
+
+# Agregar los registros de un dispositivo por intervalo de tiempo (min/max/avg/count/last) en SQL
+# Aggregate a device's records per time bucket (min/max/avg/count/last) in SQL
+def get_devices_records_aggregate(db: Session, id_device: int, bucket: str, since: Optional[datetime] = None,
+                                  until: Optional[datetime] = None):
+    # Con RECORD_ROLLUPS=1 se leen las tablas de resumen en lugar de los registros crudos
+    # With RECORD_ROLLUPS=1 the summary tables are read instead of the raw records
+    if rollups.ROLLUPS_ENABLED:
+        return rollups.get_aggregate(db, id_device, bucket, since, until)
+    # Los bloques comprimidos no se pueden agrupar en SQL; se agregan en Python junto con las filas
+    # Compressed chunks cannot be grouped in SQL; they are aggregated in Python along with the rows
+    if chunk_store.CHUNKED_STORAGE_ENABLED:
+        return chunk_store.aggregate_records(get_devices_records_by_device_id(db, id_device, since, until), bucket)
+    # Un intervalo (como mucho un día) nunca cruza el límite de una partición mensual
+    # A bucket (at most one day) never crosses a monthly partition boundary
+    aggregates = []
+    for model in partitions.record_models(db, since, until):
+        bucket_prefix = rollups.bucket_expression(bucket, model)
+        grouped = select(
+            bucket_prefix.label("bucket"),
+            func.min(model.current_value).label("min"),
+            func.max(model.current_value).label("max"),
+            func.avg(model.current_value).label("avg"),
+            func.count().label("count"),
+            func.max(model.date_record).label("last_date"),
+        ).where(model.id_device == id_device)
+        if since is not None:
+            grouped = grouped.where(model.date_record >= date_record_bound(since))
+        if until is not None:
+            grouped = grouped.where(model.date_record <= date_record_bound(until))
+        grouped = grouped.group_by(bucket_prefix).subquery()
+        # "last" sale de una búsqueda por índice al registro más reciente de cada intervalo
+        # "last" comes from an index seek to the newest record of each bucket
+        last_value = select(model.current_value).where(
+            model.id_device == id_device,
+            model.date_record == grouped.c.last_date,
+        ).order_by(model.id_record.desc()).limit(1).scalar_subquery()
+        query = select(
+            grouped.c.bucket, grouped.c.min, grouped.c.max, grouped.c.avg, grouped.c.count, last_value.label("last"),
+        ).order_by(grouped.c.bucket)
+        aggregates.extend(
+            {
+                "bucket_start": rollups.bucket_start(row.bucket),
+                "min": row.min,
+                "max": row.max,
+                "avg": row.avg,
+                "count": row.count,
+                "last": row.last,
+            }
+            for row in db.execute(query)
+        )
+    return aggregates
+
+# Último registro de un dispositivo (ver latest_state.py)
+# A device's newest record (see latest_state.py)
+def get_device_latest(db: Session, id_device: int):
+    latest = latest_state.get_latest(db, {id_device})
+    return latest[0] if latest else None
+
+# Último registro de varios dispositivos (todos si `ids` es None) en una sola lectura
+# Newest record of several devices (all of them if `ids` is None) in a single read
+def get_devices_latest(db: Session, ids: Optional[set[int]] = None):
+    return latest_state.get_latest(db, ids)
 
 # Crear un nuevo registro de dispositivo
 # Create a new device record
 def create_device_record(db: Session, device_record: DevicesRecords):
-    db_device_record = DevicesRecordsDB(
+    model = partitions.model_for(db, device_record.date_record)
+    db_device_record = model(
         id_record=device_record.id_record,
         id_device=device_record.id_device,
         current_value=device_record.current_value,
         date_record=device_record.date_record
     )
     db.add(db_device_record)
+    rollups.records_inserted(db, [device_record.model_dump()])
+    latest_state.records_inserted(db, [device_record.model_dump()])
     db.commit()
     db.refresh(db_device_record)
+    record_broker.publish([db_device_record])
+    recent_cache.records_written([db_device_record])
     return db_device_record
 
+# Crear registros de dispositivo en lote con un solo INSERT (executemany) y un solo commit
+# (con particiones, un INSERT por mes)
+# Create device records in batch with a single INSERT (executemany) and a single commit
+# (with partitions, one INSERT per month)
+def create_device_records_batch(db: Session, device_records: list[DevicesRecords]):
+    if not device_records:
+        return {"count": 0, "first_id": None, "last_id": None}
+    rows = [
+        {
+            "id_record": device_record.id_record,
+            "id_device": device_record.id_device,
+            "current_value": device_record.current_value,
+            "date_record": device_record.date_record,
+        }
+        for device_record in device_records
+    ]
+    for model, model_rows in partitions.group_by_model(db, rows):
+        db.execute(insert(model), model_rows)
+    rollups.records_inserted(db, rows)
+    latest_state.records_inserted(db, rows)
+    db.commit()
+    record_broker.publish(device_records)
+    recent_cache.records_written(device_records)
+    # No se vuelven a leer las filas, solo se reporta el rango de IDs insertados
+    # Rows are not re-read, only the inserted ID range is reported
+    ids = [row["id_record"] for row in rows]
+    return {"count": len(rows), "first_id": min(ids), "last_id": max(ids)}
+
 # Actualizar un registro de dispositivo
 # Update a device record
 def update_device_record(db: Session, id_record: int, device_record: DevicesRecords):
-    db_device_record = db.query(DevicesRecordsDB).filter(DevicesRecordsDB.id_record == id_record).first()
+    db_device_record = _find_device_record(db, id_record)
+    # Un registro archivado se vuelve a DevicesRecords antes de modificarlo
+    # An archived record is moved back into DevicesRecords before changing it
+    if db_device_record is None and chunk_store.unpack_record(db, id_record):
+        db_device_record = _find_device_record(db, id_record)
     if db_device_record:
+        keys = [(db_device_record.id_device, db_device_record.date_record), (device_record.id_device, device_record.date_record)]
+        chunk_store.unpack_for_rollups(db, keys)
+        model = partitions.model_for(db, device_record.date_record)
+        # Si la nueva fecha cae en otro mes, el registro se mueve a esa partición
+        # If the new date falls in another month, the record moves to that partition
+        if type(db_device_record) is not model:
+            db.delete(db_device_record)
+            db_device_record = model(id_record=id_record)
+            db.add(db_device_record)
         db_device_record.id_device = device_record.id_device
         db_device_record.current_value = device_record.current_value
         db_device_record.date_record = device_record.date_record
+        rollups.records_changed(db, keys)
+        latest_state.records_changed(db, keys)
         db.commit()
+        recent_cache.invalidate(id_device for id_device, _ in keys)
         db.refresh(db_device_record)
         return db_device_record
     return None
@@ -137,20 +509,150 @@ def update_device_record(db: Session, id_record: int, device_record: DevicesReco
 # Eliminar un registro de dispositivo
 # Delete a device record
 def delete_device_record(db: Session, id_record: int):
-    device_record = db.query(DevicesRecordsDB).filter(DevicesRecordsDB.id_record == id_record).first()
-    if device_record:
+    keys = _remove_device_record(db, id_record)
+    if keys is None and chunk_store.unpack_record(db, id_record):
+        keys = _remove_device_record(db, id_record)
+    if keys is None:
+        return False
+    chunk_store.unpack_for_rollups(db, keys)
+    rollups.records_changed(db, keys)
+    latest_state.records_changed(db, keys)
+    db.commit()
+    recent_cache.invalidate(id_device for id_device, _ in keys)
+    return True
+
+# Borrar un registro de la partición que lo tenga y devolver su clave [(id_device, date_record)], o None
+# si no está en las tablas. Con RETURNING_WRITES=1 es un DELETE ... RETURNING por partición.
+# Delete a record from the partition holding it and return its key [(id_device, date_record)], or None
+# if it is not in the tables. With RETURNING_WRITES=1 it is one DELETE ... RETURNING per partition.
+def _remove_device_record(db: Session, id_record: int) -> Optional[list[tuple]]:
+    if not RETURNING_WRITES_ENABLED:
+        device_record = _find_device_record(db, id_record)
+        if device_record is None:
+            return None
         db.delete(device_record)
+        return [(device_record.id_device, device_record.date_record)]
+    for model in reversed(partitions.record_models(db)):
+        row = db.execute(delete(model).where(model.id_record == id_record)
+                         .returning(model.id_device, model.date_record)
+                         .execution_options(synchronize_session=False)).first()
+        if row is not None:
+            return [tuple(row)]
+    return None
+
+# Borrar los registros de un rango (de un dispositivo, de un intervalo de tiempo o ambos) con un DELETE
+# por tabla en lugar de uno por registro. Con batch_size cada DELETE borra como mucho esa cantidad de
+# filas y se confirma por separado, para no retener el bloqueo de escritura durante todo el borrado; cada
+# lote recalcula rollups y estado más reciente de su propio intervalo en la misma transacción, así que
+# un fallo a mitad de camino no los deja desfasados. Devuelve cuántos registros se borraron.
+# Delete the records of a range (of one device, one time interval or both) with one DELETE per table
+# instead of one per record. With batch_size each DELETE removes at most that many rows and is committed
+# on its own, so the write lock is not held for the whole purge; each batch recomputes the rollups and
+# latest state of its own interval in the same transaction, so a failure halfway does not leave them
+# out of date. Returns how many records were deleted.
+def delete_devices_records_range(db: Session, id_device: Optional[int], since: Optional[datetime],
+                                 until: Optional[datetime], batch_size: Optional[int] = None) -> int:
+    deleted = chunk_store.delete_range(db, id_device, since, until)
+    if batch_size is None:
+        for model in partitions.record_models(db, since, until):
+            deleted += db.execute(range_delete(model, id_device, since, until),
+                                  execution_options={"synchronize_session": False}).rowcount
+        range_state_changed(db, device_list(id_device), since, until)
         db.commit()
-        return True
-    return False
+        range_deleted(id_device)
+        return deleted
+    # Los bloques borrados se confirman junto con el recálculo de todo el rango
+    # The deleted chunks are committed together with the recompute of the whole range
+    if deleted:
+        range_state_changed(db, device_list(id_device), since, until)
+    db.commit()
+    range_deleted(id_device)
+    tracked = range_state_enabled()
+    for model in partitions.record_models(db, since, until):
+        statement = range_delete(model, id_device, since, until, batch_size)
+        if tracked:
+            statement = statement.returning(model.id_device, model.date_record)
+        while True:
+            result = db.execute(statement, execution_options={"synchronize_session": False})
+            if tracked:
+                rows = result.all()
+                count = len(rows)
+                batch_state_changed(db, rows)
+            else:
+                count = result.rowcount
+            db.commit()
+            range_deleted(id_device)
+            deleted += count
+            if count < batch_size:
+                break
+    return deleted
+
+# DELETE de los registros de una tabla dentro del rango; con batch_size, solo los primeros batch_size
+# DELETE of a table's records inside the range; with batch_size, only the first batch_size of them
+def range_delete(model, id_device: Optional[int], since: Optional[datetime], until: Optional[datetime],
+                 batch_size: Optional[int] = None):
+    filters = []
+    if id_device is not None:
+        filters.append(model.id_device == id_device)
+    if since is not None:
+        filters.append(model.date_record >= date_record_bound(since))
+    if until is not None:
+        filters.append(model.date_record <= date_record_bound(until))
+    if batch_size is None:
+        return delete(model).where(*filters)
+    return delete(model).where(model.id_record.in_(
+        select(model.id_record).where(*filters).limit(batch_size).scalar_subquery()
+    ))
+
+# Solo hace falta saber qué fechas borró cada lote (RETURNING) si hay estado derivado que recalcular
+# Knowing which dates each batch deleted (RETURNING) is only needed if there is derived state to recompute
+def range_state_enabled() -> bool:
+    return rollups.ROLLUPS_ENABLED or latest_state.LATEST_STATE_ENABLED
+
+# Recalcular el estado derivado de las filas (id_device, date_record) que borró un lote: el de sus
+# dispositivos entre su primera y su última fecha. Filtrar por los dispositivos (IN) deja que las
+# consultas usen los índices que empiezan por id_device.
+# Recompute the derived state of the (id_device, date_record) rows a batch deleted: that of their devices
+# between their first and last date. Filtering by the devices (IN) lets the queries use the indexes
+# starting with id_device.
+def batch_state_changed(db: Session, rows: list):
+    if rows:
+        dates = [date_record for _, date_record in rows]
+        range_state_changed(db, sorted({int(id_device) for id_device, _ in rows}), min(dates), max(dates))
+
+# Recalcular rollups y estado más reciente de un rango (de los dispositivos `id_devices` o, con None, de
+# todos) después de borrar registros, antes del commit
+# Recompute the rollups and latest state of a range (of the `id_devices` devices or, with None, of all of
+# them) after deleting records, before the commit
+def range_state_changed(db: Session, id_devices: Optional[list[int]], since, until):
+    rollups.range_changed(db, id_devices, since, until)
+    latest_state.range_changed(db, id_devices, since, until)
+
+# Filtro de dispositivos de range_state_changed para un borrado de un dispositivo o de todos (None)
+# Device filter of range_state_changed for a delete of one device or of all of them (None)
+def device_list(id_device: Optional[int]) -> Optional[list[int]]:
+    return [id_device] if id_device is not None else None
+
+# Descartar las ventanas en caché que un borrado por rango pudo tocar
+# Discard the cached windows a range delete may have touched
+def range_deleted(id_device: Optional[int]):
+    if id_device is None:
+        recent_cache.clear()
+    else:
+        recent_cache.invalidate([id_device])
 
 # Operaciones CRUD para TomaDecisiones (Toma de Decisiones)
 # CRUD operations for TomaDecisiones
 
 # Obtener todas las decisiones
 # Get all decisions
-def get_all_toma_decisiones(db: Session):
-    return db.query(TomaDecisionesDB).all()
+def get_all_toma_decisiones(db: Session, fields: Optional[tuple] = None):
+    return _query_fields(db, TomaDecisionesDB, fields).all()
+
+# Iterar todas las decisiones en lotes de tamaño fijo (para streaming)
+# Iterate all decisions in fixed-size batches (for streaming)
+def iter_all_toma_decisiones(db: Session, batch_size: int, fields: Optional[tuple] = None):
+    return _query_fields(db, TomaDecisionesDB, fields).order_by(TomaDecisionesDB.id_decision).yield_per(batch_size)
 
 # Obtener una decisión por ID
 # Get a decision by ID
@@ -167,30 +669,30 @@ def create_toma_decisiones(db: Session, toma_decisiones: TomaDecisiones):
         date_record=toma_decisiones.date_record
     )
     db.add(db_toma_decisiones)
+    change_log.rows_changed(db, TomaDecisionesDB, [db_toma_decisiones.id_decision])
     db.commit()
+    table_versions.bump(TomaDecisionesDB.__tablename__)
     db.refresh(db_toma_decisiones)
     return db_toma_decisiones
 
 # Actualizar una decisión
 # Update a decision
 def update_toma_decisiones(db: Session, id_decision: int, toma_decisiones: TomaDecisiones):
-    db_toma_decisiones = db.query(TomaDecisionesDB).filter(TomaDecisionesDB.id_decision == id_decision).first()
+    db_toma_decisiones = _update_by_pk(db, TomaDecisionesDB, TomaDecisionesDB.id_decision, id_decision, {
+        "velocidad": toma_decisiones.velocidad,
+        "decision": toma_decisiones.decision,
+        "date_record": toma_decisiones.date_record,
+    })
     if db_toma_decisiones:
-        db_toma_decisiones.velocidad = toma_decisiones.velocidad
-        db_toma_decisiones.decision = toma_decisiones.decision
-        db_toma_decisiones.date_record = toma_decisiones.date_record
-        db.commit()
-        db.refresh(db_toma_decisiones)
+        table_versions.bump(TomaDecisionesDB.__tablename__)
         return db_toma_decisiones
     return None
 
 # Eliminar una decisión
 # Delete a decision
 def delete_toma_decisiones(db: Session, id_decision: int):
-    toma_decisiones = db.query(TomaDecisionesDB).filter(TomaDecisionesDB.id_decision == id_decision).first()
-    if toma_decisiones:
-        db.delete(toma_decisiones)
-        db.commit()
+    if _delete_by_pk(db, TomaDecisionesDB, TomaDecisionesDB.id_decision, id_decision):
+        table_versions.bump(TomaDecisionesDB.__tablename__)
         return True
     return False
 
@@ -199,13 +701,24 @@ def delete_toma_decisiones(db: Session, id_decision: int):
 
 # Obtener todas las luces
 # Get all lights
-def get_all_luces(db: Session):
-    return db.query(LucesDB).all()
+def get_all_luces(db: Session, fields: Optional[tuple] = None):
+    return _query_fields(db, LucesDB, fields).all()
 
-# Obtener una luz por ID
-# Get a light by ID
+# Iterar todas las luces en lotes de tamaño fijo (para streaming)
+# Iterate all lights in fixed-size batches (for streaming)
+def iter_all_luces(db: Session, batch_size: int, fields: Optional[tuple] = None):
+    return _query_fields(db, LucesDB, fields).order_by(LucesDB.id_device).yield_per(batch_size)
+
+# Obtener una luz por ID (pasa por la caché de metadatos)
+# Get a light by ID (goes through the metadata cache)
 def get_luces_by_id(db: Session, id_device: int):
-    return db.query(LucesDB).filter(LucesDB.id_device == id_device).first()
+    return metadata_cache.get_or_load((LucesDB.__tablename__, id_device), lambda: _to_response(
+        LucesResponse, db.query(LucesDB).filter(LucesDB.id_device == id_device).first()))
+
+# Obtener varias luces por ID con una sola consulta: {id_device: luz o None}
+# Get several lights by ID with a single query: {id_device: light or None}
+def get_luces_by_ids(db: Session, ids: list[int]) -> dict:
+    return _get_many_responses(db, LucesDB, LucesDB.id_device, ids, LucesResponse)
 
 # Crear una nueva luz
 # Create a new light
@@ -217,45 +730,69 @@ def create_luces(db: Session, luces: Luces):
         vendor=luces.vendor
     )
     db.add(db_luces)
+    change_log.rows_changed(db, LucesDB, [db_luces.id_device])
     db.commit()
+    table_versions.bump(LucesDB.__tablename__)
     db.refresh(db_luces)
+    metadata_cache.invalidate((LucesDB.__tablename__, db_luces.id_device))
     return db_luces
 
 # Actualizar una luz
 # Update a light
 def update_luces(db: Session, id_device: int, luces: Luces):
-    db_luces = db.query(LucesDB).filter(LucesDB.id_device == id_device).first()
+    db_luces = _update_by_pk(db, LucesDB, LucesDB.id_device, id_device, {
+        "lumens": luces.lumens,
+        "nombre": luces.nombre,
+        "vendor": luces.vendor,
+    })
     if db_luces:
-        db_luces.lumens = luces.lumens
-        db_luces.nombre = luces.nombre
-        db_luces.vendor = luces.vendor
-        db.commit()
-        db.refresh(db_luces)
+        table_versions.bump(LucesDB.__tablename__)
+        metadata_cache.invalidate((LucesDB.__tablename__, id_device))
         return db_luces
     return None
 
 # Eliminar una luz
 # Delete a light
 def delete_luces(db: Session, id_device: int):
-    luces = db.query(LucesDB).filter(LucesDB.id_device == id_device).first()
-    if luces:
-        db.delete(luces)
-        db.commit()
+    if _delete_by_pk(db, LucesDB, LucesDB.id_device, id_device):
+        table_versions.bump(LucesDB.__tablename__)
+        metadata_cache.invalidate((LucesDB.__tablename__, id_device))
         return True
     return False
 
+# Aplicar un comando a un grupo de luces con un solo UPDATE; devuelve cuántas cambió
+# Apply a command to a group of lights with a single UPDATE; returns how many changed
+def command_luces(db: Session, command: LucesCommand) -> int:
+    result = db.execute(group_update(LucesDB, command, {"lumens": command.lumens}))
+    change_log.group_changed(db, LucesDB, group_filters(LucesDB, command))
+    db.commit()
+    group_changed(LucesDB, command)
+    return result.rowcount
+
 # Operaciones CRUD para ControladorVoltaje
 # CRUD operations for ControladorVoltaje
 
 # Obtener todos los controladores de voltaje
 # Get all voltage controllers
-def get_all_controlador_voltaje(db: Session):
-    return db.query(ControladorVoltajeDB).all()
+def get_all_controlador_voltaje(db: Session, fields: Optional[tuple] = None):
+    return _query_fields(db, ControladorVoltajeDB, fields).all()
 
-# Obtener un controlador de voltaje por ID
-# Get a voltage controller by ID
+# Iterar todos los controladores de voltaje en lotes de tamaño fijo (para streaming)
+# Iterate all voltage controllers in fixed-size batches (for streaming)
+def iter_all_controlador_voltaje(db: Session, batch_size: int, fields: Optional[tuple] = None):
+    return _query_fields(db, ControladorVoltajeDB, fields).order_by(ControladorVoltajeDB.id_device).yield_per(batch_size)
+
+# Obtener un controlador de voltaje por ID (pasa por la caché de metadatos)
+# Get a voltage controller by ID (goes through the metadata cache)
 def get_controlador_voltaje_by_id(db: Session, id_device: int):
-    return db.query(ControladorVoltajeDB).filter(ControladorVoltajeDB.id_device == id_device).first()
+    return metadata_cache.get_or_load((ControladorVoltajeDB.__tablename__, id_device), lambda: _to_response(
+        ControladorVoltajeResponse,
+        db.query(ControladorVoltajeDB).filter(ControladorVoltajeDB.id_device == id_device).first()))
+
+# Obtener varios controladores de voltaje por ID con una sola consulta: {id_device: controlador o None}
+# Get several voltage controllers by ID with a single query: {id_device: controller or None}
+def get_controlador_voltaje_by_ids(db: Session, ids: list[int]) -> dict:
+    return _get_many_responses(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, ids, ControladorVoltajeResponse)
 
 # Crear un nuevo controlador de voltaje
 # Create a new voltage controller
@@ -268,30 +805,86 @@ def create_controlador_voltaje(db: Session, controlador_voltaje: ControladorVolt
         vendor=controlador_voltaje.vendor
     )
     db.add(db_controlador_voltaje)
+    change_log.rows_changed(db, ControladorVoltajeDB, [db_controlador_voltaje.id_device])
     db.commit()
+    table_versions.bump(ControladorVoltajeDB.__tablename__)
     db.refresh(db_controlador_voltaje)
+    metadata_cache.invalidate((ControladorVoltajeDB.__tablename__, db_controlador_voltaje.id_device))
     return db_controlador_voltaje
 
 # Actualizar un controlador de voltaje
 # Update a voltage controller
 def update_controlador_voltaje(db: Session, id_device: int, controlador_voltaje: ControladorVoltaje):
-    db_controlador_voltaje = db.query(ControladorVoltajeDB).filter(ControladorVoltajeDB.id_device == id_device).first()
+    db_controlador_voltaje = _update_by_pk(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, id_device, {
+        "encendido": 1 if controlador_voltaje.encendido else 0,  # Convertir booleano a entero / Convert boolean to integer
+        "voltaje": controlador_voltaje.voltaje,
+        "nombre": controlador_voltaje.nombre,
+        "vendor": controlador_voltaje.vendor,
+    })
     if db_controlador_voltaje:
-        db_controlador_voltaje.encendido = 1 if controlador_voltaje.encendido else 0  # Convertir booleano a entero / Convert boolean to integer
-        db_controlador_voltaje.voltaje = controlador_voltaje.voltaje
-        db_controlador_voltaje.nombre = controlador_voltaje.nombre
-        db_controlador_voltaje.vendor = controlador_voltaje.vendor
-        db.commit()
-        db.refresh(db_controlador_voltaje)
+        table_versions.bump(ControladorVoltajeDB.__tablename__)
+        metadata_cache.invalidate((ControladorVoltajeDB.__tablename__, id_device))
         return db_controlador_voltaje
     return None
 
 # Eliminar un controlador de voltaje
 # Delete a voltage controller
 def delete_controlador_voltaje(db: Session, id_device: int):
-    controlador_voltaje = db.query(ControladorVoltajeDB).filter(ControladorVoltajeDB.id_device == id_device).first()
-    if controlador_voltaje:
-        db.delete(controlador_voltaje)
-        db.commit()
+    if _delete_by_pk(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, id_device):
+        table_versions.bump(ControladorVoltajeDB.__tablename__)
+        metadata_cache.invalidate((ControladorVoltajeDB.__tablename__, id_device))
         return True
     return False
+
+# Aplicar un comando (encendido y/o voltaje) a un grupo de controladores con un solo UPDATE;
+# devuelve cuántos cambió
+# Apply a command (encendido and/or voltaje) to a group of controllers with a single UPDATE;
+# returns how many changed
+def command_controlador_voltaje(db: Session, command: ControladorVoltajeCommand) -> int:
+    result = db.execute(group_update(ControladorVoltajeDB, command, controlador_voltaje_changes(command)))
+    change_log.group_changed(db, ControladorVoltajeDB, group_filters(ControladorVoltajeDB, command))
+    db.commit()
+    group_changed(ControladorVoltajeDB, command)
+    return result.rowcount
+
+# Columnas que cambia un comando de controladores
+# Columns changed by a controller command
+def controlador_voltaje_changes(command: ControladorVoltajeCommand) -> dict:
+    values = {}
+    if command.encendido is not None:
+        values["encendido"] = 1 if command.encendido else 0  # Convertir booleano a entero / Convert boolean to integer
+    if command.voltaje is not None:
+        values["voltaje"] = command.voltaje
+    return values
+
+# UPDATE de `values` sobre los dispositivos del grupo, sin cargar filas en la sesión. El prefijo de
+# nombre se compara como rango (nombre >= p AND nombre < p + U+10FFFF), que usa el índice de nombre
+# y distingue mayúsculas, a diferencia de LIKE en SQLite.
+# UPDATE of `values` over the group's devices, without loading rows into the session. The name
+# prefix is compared as a range (nombre >= p AND nombre < p + U+10FFFF), which uses the nombre index
+# and is case-sensitive, unlike LIKE on SQLite.
+def group_update(model, group: DeviceGroup, values: dict):
+    return (update(model).where(*group_filters(model, group)).values(**values)
+            .execution_options(synchronize_session=False))
+
+# Condiciones WHERE que seleccionan los dispositivos del grupo
+# WHERE conditions that select the group's devices
+def group_filters(model, group: DeviceGroup) -> list:
+    filters = []
+    if group.ids is not None:
+        filters.append(model.id_device.in_(group.ids))
+    if group.vendor is not None:
+        filters.append(model.vendor == group.vendor)
+    if group.nombre_prefix is not None:
+        filters.extend([model.nombre >= group.nombre_prefix, model.nombre < group.nombre_prefix + "\U0010ffff"])
+    return filters
+
+# Invalidar lo que un comando en lote pudo cambiar: las claves de sus IDs o, sin IDs, toda la tabla
+# Invalidate what a bulk command may have changed: the keys of its IDs or, without IDs, the whole table
+def group_changed(model, group: DeviceGroup):
+    table_versions.bump(model.__tablename__)
+    if group.ids is None:
+        metadata_cache.invalidate_table(model.__tablename__)
+    else:
+        for id_device in group.ids:
+            metadata_cache.invalidate((model.__tablename__, id_device))
@@ -0,0 +1,613 @@
+from sqlalchemy import Float, delete, insert, select, tuple_, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import DevicesInfo, DevicesInfoDB, DevicesRecords, DevicesRecordsDB, TomaDecisiones, TomaDecisionesDB, Luces, LucesDB, ControladorVoltaje, ControladorVoltajeDB
+from models import DevicesInfoResponse, LucesResponse, ControladorVoltajeResponse, LucesCommand, ControladorVoltajeCommand, RECORD_FIELDS, date_record_bound, record_row_fields
+from datetime import datetime
+from typing import Optional
+
+import change_log
+import chunk_store
+import latest_state
+import partitions
+import rollups
+from record_stream import record_broker
+from recent_cache import recent_cache
+from metadata_cache import metadata_cache
+from response_cache import table_versions
+from database import RETURNING_WRITES_ENABLED
+from projection import field_columns
+from crud import group_changed, controlador_voltaje_changes, group_filters, group_update, delete_returning, update_returning
+from crud import batch_state_changed, device_list, range_delete, range_deleted, range_state_changed, range_state_enabled
+from crud import _device_record_columns
+
+
+# Versiones asíncronas de las operaciones de crud.py (usadas cuando ASYNC_DB=1)
+# Async versions of the crud.py operations (used when ASYNC_DB=1)
+
+# Todas las filas de una tabla o, con ?fields=, solo esas columnas (ver crud._query_fields)
+# Every row of a table or, with ?fields=, those columns only (see crud._query_fields)
+async def _all_rows(db: AsyncSession, model, fields: Optional[tuple] = None):
+    if fields is None:
+        return (await db.execute(select(model))).scalars().all()
+    query = select(*field_columns(model, fields)).order_by(*model.__table__.primary_key.columns)
+    return (await db.execute(query)).all()
+
+# Obtener la primera fila de una tabla por su clave primaria
+# Get the first row of a table by its primary key
+async def _get_by_pk(db: AsyncSession, model, column, value):
+    result = await db.execute(select(model).where(column == value))
+    return result.scalars().first()
+
+# Obtener una fila por su clave primaria como modelo de respuesta (o None), para la caché de metadatos
+# Get a row by its primary key as a response model (or None), for the metadata cache
+async def _get_response_by_pk(db: AsyncSession, model, column, value, response_model):
+    row = await _get_by_pk(db, model, column, value)
+    return response_model.model_validate(row) if row is not None else None
+
+# Leer varias filas por clave primaria con un solo IN (...) (ver crud._get_many_responses)
+# Read several rows by primary key with a single IN (...) (see crud._get_many_responses)
+async def _get_many_responses(db: AsyncSession, model, column, ids: list[int], response_model) -> dict:
+    async def cargar(keys):
+        result = await db.execute(select(model).where(column.in_([value for _, value in keys])))
+        return {(model.__tablename__, getattr(row, column.key)): response_model.model_validate(row)
+                for row in result.scalars().all()}
+    values = await metadata_cache.get_many_or_load_async([(model.__tablename__, value) for value in ids], cargar)
+    return {value: values[(model.__tablename__, value)] for value in ids}
+
+# Actualizar una fila por su clave primaria con `values` (ver crud._update_by_pk)
+# Update a row by its primary key with `values` (see crud._update_by_pk)
+async def _update_by_pk(db: AsyncSession, model, column, value, values: dict):
+    if RETURNING_WRITES_ENABLED:
+        row = (await db.execute(update_returning(model, column.key, tuple(values)), {"pk_value": value, **values})).first()
+        if row is not None:
+            await db.run_sync(change_log.rows_changed, model, [value])
+            await db.commit()
+        return row
+    row = await _get_by_pk(db, model, column, value)
+    if row:
+        for name, new_value in values.items():
+            setattr(row, name, new_value)
+        await db.run_sync(change_log.rows_changed, model, [value])
+        await db.commit()
+        await db.refresh(row)
+    return row
+
+# Eliminar una fila por su clave primaria (con RETURNING_WRITES=1, un solo DELETE ... RETURNING)
+# Delete a row by its primary key (with RETURNING_WRITES=1, a single DELETE ... RETURNING)
+async def _delete_by_pk(db: AsyncSession, model, column, value):
+    if RETURNING_WRITES_ENABLED:
+        row = (await db.execute(delete_returning(model, column.key), {"pk_value": value})).first()
+    else:
+        row = await _get_by_pk(db, model, column, value)
+        if row:
+            await db.delete(row)
+    if row:
+        await db.run_sync(change_log.rows_changed, model, [value], "delete")
+        await db.commit()
+        table_versions.bump(model.__tablename__)
+        metadata_cache.invalidate((model.__tablename__, value))
+        return True
+    return False
+
+# Agregar una fila nueva, confirmar y refrescar
+# Add a new row, commit and refresh
+async def _add(db: AsyncSession, row):
+    db.add(row)
+    await db.run_sync(change_log.row_added, row)
+    await db.commit()
+    table_versions.bump(row.__tablename__)
+    await db.refresh(row)
+    return row
+
+
+# Operaciones CRUD para DevicesInfo (Información de Dispositivos)
+# CRUD operations for DevicesInfo
+
+# Obtener información de todos los dispositivos
+# Get all devices info
+async def get_all_devices_info(db: AsyncSession, id_device: int, fields: Optional[tuple] = None):
+    return await _all_rows(db, DevicesInfoDB, fields)
+
+# Obtener información de un dispositivo por ID
+# Get device info by ID
+async def get_devices_info_by_id(db: AsyncSession, id_device: int):
+    async def cargar():
+        result = await db.execute(select(DevicesInfoDB).where(DevicesInfoDB.id_device == id_device))
+        return [DevicesInfoResponse.model_validate(device_info) for device_info in result.scalars().all()]
+    return await metadata_cache.get_or_load_async((DevicesInfoDB.__tablename__, id_device), cargar)
+
+# Obtener información de varios dispositivos con una sola consulta (ver crud.get_devices_info_by_ids)
+# Get the info of several devices with a single query (see crud.get_devices_info_by_ids)
+async def get_devices_info_by_ids(db: AsyncSession, ids: list[int]) -> dict:
+    async def cargar(keys):
+        values = {key: [] for key in keys}
+        result = await db.execute(select(DevicesInfoDB).where(DevicesInfoDB.id_device.in_([value for _, value in keys])))
+        for device_info in result.scalars().all():
+            values[(DevicesInfoDB.__tablename__, device_info.id_device)].append(DevicesInfoResponse.model_validate(device_info))
+        return values
+    values = await metadata_cache.get_many_or_load_async([(DevicesInfoDB.__tablename__, value) for value in ids], cargar)
+    return {value: values[(DevicesInfoDB.__tablename__, value)] for value in ids}
+
+# Eliminar información de un dispositivo
+# Delete device info
+async def delete_device_info(db: AsyncSession, id_device: int):
+    return await _delete_by_pk(db, DevicesInfoDB, DevicesInfoDB.id_device, id_device)
+
+# Crear información de un nuevo dispositivo
+# Create new device info
+async def create_device_info(db: AsyncSession, device_info: DevicesInfo):
+    db_device_info = await _add(db, DevicesInfoDB(
+        id_device=device_info.id_device,
+        id_type=device_info.id_type,
+        id_signal_type=device_info.id_signal_type,
+        nombre=device_info.nombre,
+        vendor=device_info.vendor,
+    ))
+    metadata_cache.invalidate((DevicesInfoDB.__tablename__, db_device_info.id_device))
+    return db_device_info
+
+# Actualizar información de un dispositivo
+# Update device info
+async def update_device_info(db: AsyncSession, id_device: int, device_info: DevicesInfo):
+    db_device_info = await _update_by_pk(db, DevicesInfoDB, DevicesInfoDB.id_device, id_device, {
+        "id_type": device_info.id_type,
+        "id_signal_type": device_info.id_signal_type,
+        "nombre": device_info.nombre,
+        "vendor": device_info.vendor,
+    })
+    if db_device_info:
+        table_versions.bump(DevicesInfoDB.__tablename__)
+        metadata_cache.invalidate((DevicesInfoDB.__tablename__, id_device))
+        return db_device_info
+    return None
+
+# Operaciones CRUD para DevicesRecords (Registros de Dispositivos)
+# CRUD operations for DevicesRecords
+
+# Modelos de registros del rango (ver partitions.record_models); sin particiones no hace falta run_sync
+# Record models for the range (see partitions.record_models); without partitions no run_sync is needed
+async def _record_models(db: AsyncSession, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    if not partitions.RECORD_PARTITIONS_ENABLED:
+        return [DevicesRecordsDB]
+    return await db.run_sync(partitions.record_models, since, until)
+
+# Modelo en el que se escribe un registro (ver partitions.model_for)
+# Model a record is written to (see partitions.model_for)
+async def _model_for(db: AsyncSession, date_record):
+    if not partitions.RECORD_PARTITIONS_ENABLED:
+        return DevicesRecordsDB
+    return await db.run_sync(partitions.model_for, date_record)
+
+# Buscar un registro por ID en DevicesRecords o en cada partición (ver crud._find_device_record)
+# Find a record by ID in DevicesRecords or in every partition (see crud._find_device_record)
+async def _find_device_record(db: AsyncSession, id_record: int):
+    for model in reversed(await _record_models(db)):
+        device_record = await _get_by_pk(db, model, model.id_record, id_record)
+        if device_record is not None:
+            return device_record
+    return None
+
+# Obtener todos los registros de dispositivos
+# Get all device records
+async def get_all_devices_records(db: AsyncSession):
+    records = partitions.merge_by_id([
+        (await db.execute(select(model))).scalars().all() for model in await _record_models(db)
+    ])
+    if chunk_store.CHUNKED_STORAGE_ENABLED:
+        return await db.run_sync(chunk_store.merge_all_records, records)
+    return records
+
+# Obtener todos los registros como tuplas de columnas (ver crud.get_all_devices_records_rows)
+# Get all device records as column tuples (see crud.get_all_devices_records_rows)
+async def get_all_devices_records_rows(db: AsyncSession, fields: Optional[tuple] = None):
+    connection = await db.connection()
+    results = []
+    for model in await _record_models(db):
+        columns = {
+            "id_record": model.id_record,
+            "id_device": model.id_device,
+            "current_value": type_coerce(model.current_value, Float).label("current_value"),
+            "date_record": model.date_record,
+        }
+        names = RECORD_FIELDS if fields is None else record_row_fields(fields)
+        result = await connection.execute(select(*(columns[name] for name in names)).order_by(model.id_record))
+        results.append(result.all())
+    rows = partitions.merge_by_id(results)
+    if chunk_store.CHUNKED_STORAGE_ENABLED:
+        return await db.run_sync(chunk_store.merge_all_records, rows, fields)
+    return rows
+
+# Obtener un registro de dispositivo por ID
+# Get device record by ID
+async def get_devices_records_by_id(db: AsyncSession, id_record: int):
+    device_record = await _find_device_record(db, id_record)
+    if device_record is None and chunk_store.CHUNKED_STORAGE_ENABLED:
+        return await db.run_sync(chunk_store.find_record, id_record)
+    return device_record
+
+# Filtro opcional de tiempo sobre los registros de un dispositivo en una tabla
+# Optional time filter over a device's records in one table
+def _device_records_query(model, id_device: int, since: Optional[datetime], until: Optional[datetime],
+                          fields: Optional[tuple] = None):
+    query = select(model) if fields is None else select(*_device_record_columns(model, fields))
+    query = query.where(model.id_device == id_device)
+    if since is not None:
+        query = query.where(model.date_record >= date_record_bound(since))
+    if until is not None:
+        query = query.where(model.date_record <= date_record_bound(until))
+    return query
+
+# Obtener registros de dispositivo por ID de dispositivo (ver crud.get_devices_records_by_device_id)
+# Get device records by device ID (see crud.get_devices_records_by_device_id)
+async def get_devices_records_by_device_id(db: AsyncSession, id_device: int, since: Optional[datetime] = None,
+                                           until: Optional[datetime] = None, limit: Optional[int] = None,
+                                           after_id: Optional[int] = None, last: Optional[int] = None,
+                                           fields: Optional[tuple] = None):
+    cached = await recent_cache.read_async(id_device,
+                                           lambda: get_newest_devices_records(db, id_device, recent_cache.depth,
+                                                                              fields=RECORD_FIELDS),
+                                           since, until, after_id, limit, last)
+    if cached is not None:
+        return cached
+    if last is not None:
+        return await get_newest_devices_records(db, id_device, last, since, until, fields)
+    after = None
+    if after_id is not None:
+        after_record = await get_devices_records_by_id(db, after_id)
+        if after_record is None:
+            return []
+        after = (after_record.date_record, after_id)
+    device_records = []
+    for model in await _record_models(db, since, until):
+        query = _device_records_query(model, id_device, since, until, fields)
+        if after is not None:
+            query = query.where(
+                tuple_(model.date_record, model.id_record)
+                > tuple_(*after, types=(model.date_record.type, model.id_record.type))
+            )
+        query = query.order_by(model.date_record, model.id_record)
+        if limit is not None:
+            query = query.limit(limit - len(device_records))
+        result = await db.execute(query)
+        device_records.extend(result.scalars().all() if fields is None else result.all())
+        if limit is not None and len(device_records) >= limit:
+            break
+    if chunk_store.CHUNKED_STORAGE_ENABLED:
+        return await db.run_sync(chunk_store.merge_device_records, device_records, id_device, since, until,
+                                 after, limit)
+    return device_records
+
+# Los `count` registros más recientes de un dispositivo (ver crud.get_newest_devices_records)
+# A device's `count` newest records (see crud.get_newest_devices_records)
+async def get_newest_devices_records(db: AsyncSession, id_device: int, count: int, since: Optional[datetime] = None,
+                                     until: Optional[datetime] = None, fields: Optional[tuple] = None):
+    device_records = []
+    for model in reversed(await _record_models(db, since, until)):
+        query = _device_records_query(model, id_device, since, until, fields)
+        query = query.order_by(model.date_record.desc(), model.id_record.desc()).limit(count - len(device_records))
+        result = await db.execute(query)
+        device_records[:0] = reversed(result.scalars().all() if fields is None else result.all())
+        if len(device_records) >= count:
+            break
+    if chunk_store.CHUNKED_STORAGE_ENABLED:
+        return await db.run_sync(chunk_store.merge_newest_records, device_records, id_device, count, since, until)
+    return device_records
+
+# Último registro de un dispositivo (ver crud.get_device_latest)
+# A device's newest record (see crud.get_device_latest)
+async def get_device_latest(db: AsyncSession, id_device: int):
+    latest = await db.run_sync(latest_state.get_latest, {id_device})
+    return latest[0] if latest else None
+
+# Último registro de varios dispositivos (ver crud.get_devices_latest)
+# Newest record of several devices (see crud.get_devices_latest)
+async def get_devices_latest(db: AsyncSession, ids: Optional[set[int]] = None):
+    return await db.run_sync(latest_state.get_latest, ids)
+
+# Crear un nuevo registro de dispositivo
+# Create a new device record
+async def create_device_record(db: AsyncSession, device_record: DevicesRecords):
+    model = await _model_for(db, device_record.date_record)
+    await db.run_sync(rollups.records_inserted, [device_record.model_dump()])
+    await db.run_sync(latest_state.records_inserted, [device_record.model_dump()])
+    db_device_record = await _add(db, model(
+        id_record=device_record.id_record,
+        id_device=device_record.id_device,
+        current_value=device_record.current_value,
+        date_record=device_record.date_record
+    ))
+    record_broker.publish([db_device_record])
+    recent_cache.records_written([db_device_record])
+    return db_device_record
+
+# Crear registros de dispositivo en lote con un solo INSERT (executemany) y un solo commit
+# (con particiones, un INSERT por mes)
+# Create device records in batch with a single INSERT (executemany) and a single commit
+# (with partitions, one INSERT per month)
+async def create_device_records_batch(db: AsyncSession, device_records: list[DevicesRecords]):
+    if not device_records:
+        return {"count": 0, "first_id": None, "last_id": None}
+    rows = [
+        {
+            "id_record": device_record.id_record,
+            "id_device": device_record.id_device,
+            "current_value": device_record.current_value,
+            "date_record": device_record.date_record,
+        }
+        for device_record in device_records
+    ]
+    if partitions.RECORD_PARTITIONS_ENABLED:
+        for model, model_rows in await db.run_sync(partitions.group_by_model, rows):
+            await db.execute(insert(model), model_rows)
+    else:
+        await db.execute(insert(DevicesRecordsDB), rows)
+    await db.run_sync(rollups.records_inserted, rows)
+    await db.run_sync(latest_state.records_inserted, rows)
+    await db.commit()
+    record_broker.publish(device_records)
+    recent_cache.records_written(device_records)
+    ids = [row["id_record"] for row in rows]
+    return {"count": len(rows), "first_id": min(ids), "last_id": max(ids)}
+
+# Actualizar un registro de dispositivo
+# Update a device record
+async def update_device_record(db: AsyncSession, id_record: int, device_record: DevicesRecords):
+    db_device_record = await _find_device_record(db, id_record)
+    if db_device_record is None and await db.run_sync(chunk_store.unpack_record, id_record):
+        db_device_record = await _find_device_record(db, id_record)
+    if db_device_record:
+        keys = [(db_device_record.id_device, db_device_record.date_record), (device_record.id_device, device_record.date_record)]
+        await db.run_sync(chunk_store.unpack_for_rollups, keys)
+        model = await _model_for(db, device_record.date_record)
+        # Si la nueva fecha cae en otro mes, el registro se mueve a esa partición
+        # If the new date falls in another month, the record moves to that partition
+        if type(db_device_record) is not model:
+            await db.delete(db_device_record)
+            db_device_record = model(id_record=id_record)
+            db.add(db_device_record)
+        db_device_record.id_device = device_record.id_device
+        db_device_record.current_value = device_record.current_value
+        db_device_record.date_record = device_record.date_record
+        await db.run_sync(rollups.records_changed, keys)
+        await db.run_sync(latest_state.records_changed, keys)
+        await db.commit()
+        recent_cache.invalidate(id_device for id_device, _ in keys)
+        await db.refresh(db_device_record)
+        return db_device_record
+    return None
+
+# Eliminar un registro de dispositivo
+# Delete a device record
+async def delete_device_record(db: AsyncSession, id_record: int):
+    keys = await _remove_device_record(db, id_record)
+    if keys is None and await db.run_sync(chunk_store.unpack_record, id_record):
+        keys = await _remove_device_record(db, id_record)
+    if keys is None:
+        return False
+    await db.run_sync(chunk_store.unpack_for_rollups, keys)
+    await db.run_sync(rollups.records_changed, keys)
+    await db.run_sync(latest_state.records_changed, keys)
+    await db.commit()
+    recent_cache.invalidate(id_device for id_device, _ in keys)
+    return True
+
+# Borrar un registro de la partición que lo tenga y devolver su clave (ver crud._remove_device_record)
+# Delete a record from the partition holding it and return its key (see crud._remove_device_record)
+async def _remove_device_record(db: AsyncSession, id_record: int) -> Optional[list[tuple]]:
+    if not RETURNING_WRITES_ENABLED:
+        device_record = await _find_device_record(db, id_record)
+        if device_record is None:
+            return None
+        await db.delete(device_record)
+        return [(device_record.id_device, device_record.date_record)]
+    for model in reversed(await _record_models(db)):
+        result = await db.execute(delete(model).where(model.id_record == id_record)
+                                  .returning(model.id_device, model.date_record)
+                                  .execution_options(synchronize_session=False))
+        row = result.first()
+        if row is not None:
+            return [tuple(row)]
+    return None
+
+# Borrar los registros de un rango, opcionalmente por lotes (ver crud.delete_devices_records_range)
+# Delete the records of a range, optionally in batches (see crud.delete_devices_records_range)
+async def delete_devices_records_range(db: AsyncSession, id_device: Optional[int], since: Optional[datetime],
+                                       until: Optional[datetime], batch_size: Optional[int] = None) -> int:
+    deleted = await db.run_sync(chunk_store.delete_range, id_device, since, until)
+    if batch_size is None:
+        for model in await _record_models(db, since, until):
+            result = await db.execute(range_delete(model, id_device, since, until),
+                                      execution_options={"synchronize_session": False})
+            deleted += result.rowcount
+        await db.run_sync(range_state_changed, device_list(id_device), since, until)
+        await db.commit()
+        range_deleted(id_device)
+        return deleted
+    if deleted:
+        await db.run_sync(range_state_changed, device_list(id_device), since, until)
+    await db.commit()
+    range_deleted(id_device)
+    tracked = range_state_enabled()
+    for model in await _record_models(db, since, until):
+        statement = range_delete(model, id_device, since, until, batch_size)
+        if tracked:
+            statement = statement.returning(model.id_device, model.date_record)
+        while True:
+            result = await db.execute(statement, execution_options={"synchronize_session": False})
+            if tracked:
+                rows = result.all()
+                count = len(rows)
+                await db.run_sync(batch_state_changed, rows)
+            else:
+                count = result.rowcount
+            await db.commit()
+            range_deleted(id_device)
+            deleted += count
+            if count < batch_size:
+                break
+    return deleted
+
+# Operaciones CRUD para TomaDecisiones (Toma de Decisiones)
+# CRUD operations for TomaDecisiones
+
+# Obtener todas las decisiones
+# Get all decisions
+async def get_all_toma_decisiones(db: AsyncSession, fields: Optional[tuple] = None):
+    return await _all_rows(db, TomaDecisionesDB, fields)
+
+# Obtener una decisión por ID
+# Get a decision by ID
+async def get_toma_decisiones_by_id(db: AsyncSession, id_decision: int):
+    return await _get_by_pk(db, TomaDecisionesDB, TomaDecisionesDB.id_decision, id_decision)
+
+# Crear una nueva decisión
+# Create a new decision
+async def create_toma_decisiones(db: AsyncSession, toma_decisiones: TomaDecisiones):
+    return await _add(db, TomaDecisionesDB(
+        id_decision=toma_decisiones.id_decision,
+        velocidad=toma_decisiones.velocidad,
+        decision=toma_decisiones.decision,
+        date_record=toma_decisiones.date_record
+    ))
+
+# Actualizar una decisión
+# Update a decision
+async def update_toma_decisiones(db: AsyncSession, id_decision: int, toma_decisiones: TomaDecisiones):
+    db_toma_decisiones = await _update_by_pk(db, TomaDecisionesDB, TomaDecisionesDB.id_decision, id_decision, {
+        "velocidad": toma_decisiones.velocidad,
+        "decision": toma_decisiones.decision,
+        "date_record": toma_decisiones.date_record,
+    })
+    if db_toma_decisiones:
+        table_versions.bump(TomaDecisionesDB.__tablename__)
+        return db_toma_decisiones
+    return None
+
+# Eliminar una decisión
+# Delete a decision
+async def delete_toma_decisiones(db: AsyncSession, id_decision: int):
+    return await _delete_by_pk(db, TomaDecisionesDB, TomaDecisionesDB.id_decision, id_decision)
+
+# Operaciones CRUD para Luces
+# CRUD operations for Luces
+
+# Obtener todas las luces
+# Get all lights
+async def get_all_luces(db: AsyncSession, fields: Optional[tuple] = None):
+    return await _all_rows(db, LucesDB, fields)
+
+# Obtener una luz por ID
+# Get a light by ID
+async def get_luces_by_id(db: AsyncSession, id_device: int):
+    return await metadata_cache.get_or_load_async(
+        (LucesDB.__tablename__, id_device),
+        lambda: _get_response_by_pk(db, LucesDB, LucesDB.id_device, id_device, LucesResponse))
+
+# Obtener varias luces por ID con una sola consulta
+# Get several lights by ID with a single query
+async def get_luces_by_ids(db: AsyncSession, ids: list[int]) -> dict:
+    return await _get_many_responses(db, LucesDB, LucesDB.id_device, ids, LucesResponse)
+
+# Crear una nueva luz
+# Create a new light
+async def create_luces(db: AsyncSession, luces: Luces):
+    db_luces = await _add(db, LucesDB(
+        id_device=luces.id_device,
+        lumens=luces.lumens,
+        nombre=luces.nombre,
+        vendor=luces.vendor
+    ))
+    metadata_cache.invalidate((LucesDB.__tablename__, db_luces.id_device))
+    return db_luces
+
+# Actualizar una luz
+# Update a light
+async def update_luces(db: AsyncSession, id_device: int, luces: Luces):
+    db_luces = await _update_by_pk(db, LucesDB, LucesDB.id_device, id_device, {
+        "lumens": luces.lumens,
+        "nombre": luces.nombre,
+        "vendor": luces.vendor,
+    })
+    if db_luces:
+        table_versions.bump(LucesDB.__tablename__)
+        metadata_cache.invalidate((LucesDB.__tablename__, id_device))
+        return db_luces
+    return None
+
+# Eliminar una luz
+# Delete a light
+async def delete_luces(db: AsyncSession, id_device: int):
+    return await _delete_by_pk(db, LucesDB, LucesDB.id_device, id_device)
+
+# Aplicar un comando a un grupo de luces con un solo UPDATE (ver crud.command_luces)
+# Apply a command to a group of lights with a single UPDATE (see crud.command_luces)
+async def command_luces(db: AsyncSession, command: LucesCommand) -> int:
+    result = await db.execute(group_update(LucesDB, command, {"lumens": command.lumens}))
+    await db.run_sync(change_log.group_changed, LucesDB, group_filters(LucesDB, command))
+    await db.commit()
+    group_changed(LucesDB, command)
+    return result.rowcount
+
+# Operaciones CRUD para ControladorVoltaje
+# CRUD operations for ControladorVoltaje
+
+# Obtener todos los controladores de voltaje
+# Get all voltage controllers
+async def get_all_controlador_voltaje(db: AsyncSession, fields: Optional[tuple] = None):
+    return await _all_rows(db, ControladorVoltajeDB, fields)
+
+# Obtener un controlador de voltaje por ID
+# Get a voltage controller by ID
+async def get_controlador_voltaje_by_id(db: AsyncSession, id_device: int):
+    return await metadata_cache.get_or_load_async(
+        (ControladorVoltajeDB.__tablename__, id_device),
+        lambda: _get_response_by_pk(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, id_device,
+                                    ControladorVoltajeResponse))
+
+# Obtener varios controladores de voltaje por ID con una sola consulta
+# Get several voltage controllers by ID with a single query
+async def get_controlador_voltaje_by_ids(db: AsyncSession, ids: list[int]) -> dict:
+    return await _get_many_responses(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, ids,
+                                     ControladorVoltajeResponse)
+
+# Crear un nuevo controlador de voltaje
+# Create a new voltage controller
+async def create_controlador_voltaje(db: AsyncSession, controlador_voltaje: ControladorVoltaje):
+    db_controlador_voltaje = await _add(db, ControladorVoltajeDB(
+        id_device=controlador_voltaje.id_device,
+        encendido=1 if controlador_voltaje.encendido else 0,  # Convertir booleano a entero / Convert boolean to integer
+        voltaje=controlador_voltaje.voltaje,
+        nombre=controlador_voltaje.nombre,
+        vendor=controlador_voltaje.vendor
+    ))
+    metadata_cache.invalidate((ControladorVoltajeDB.__tablename__, db_controlador_voltaje.id_device))
+    return db_controlador_voltaje
+
+# Actualizar un controlador de voltaje
+# Update a voltage controller
+async def update_controlador_voltaje(db: AsyncSession, id_device: int, controlador_voltaje: ControladorVoltaje):
+    db_controlador_voltaje = await _update_by_pk(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, id_device, {
+        "encendido": 1 if controlador_voltaje.encendido else 0,  # Convertir booleano a entero / Convert boolean to integer
+        "voltaje": controlador_voltaje.voltaje,
+        "nombre": controlador_voltaje.nombre,
+        "vendor": controlador_voltaje.vendor,
+    })
+    if db_controlador_voltaje:
+        table_versions.bump(ControladorVoltajeDB.__tablename__)
+        metadata_cache.invalidate((ControladorVoltajeDB.__tablename__, id_device))
+        return db_controlador_voltaje
+    return None
+
+# Eliminar un controlador de voltaje
+# Delete a voltage controller
+async def delete_controlador_voltaje(db: AsyncSession, id_device: int):
+    return await _delete_by_pk(db, ControladorVoltajeDB, ControladorVoltajeDB.id_device, id_device)
+
+# Aplicar un comando a un grupo de controladores con un solo UPDATE (ver crud.command_controlador_voltaje)
+# Apply a command to a group of controllers with a single UPDATE (see crud.command_controlador_voltaje)
+async def command_controlador_voltaje(db: AsyncSession, command: ControladorVoltajeCommand) -> int:
+    result = await db.execute(group_update(ControladorVoltajeDB, command, controlador_voltaje_changes(command)))
+    await db.run_sync(change_log.group_changed, ControladorVoltajeDB, group_filters(ControladorVoltajeDB, command))
+    await db.commit()
+    group_changed(ControladorVoltajeDB, command)
+    return result.rowcount
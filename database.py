@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker,declarative_base
 import os
 from dotenv import load_dotenv
@@ -10,15 +10,107 @@ load_dotenv()
 # Get database URL from environment variables
 SQL_ALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Perfil de rendimiento opcional (DB_PERFORMANCE_PROFILE=1). Cada valor se puede ajustar con su
+# propia variable de entorno; una variable vacía desactiva ese ajuste.
+# Optional performance profile (DB_PERFORMANCE_PROFILE=1). Each value can be tuned through its
+# own environment variable; an empty variable disables that setting.
+DB_PERFORMANCE_PROFILE = os.getenv("DB_PERFORMANCE_PROFILE", "0").lower() in ("1", "true", "yes")
+
+
+# Leer una variable de entorno; el valor por defecto solo aplica con el perfil de rendimiento activo
+# Read an environment variable; the default only applies when the performance profile is on
+def _profile_setting(name: str, default: str):
+    value = os.getenv(name, default if DB_PERFORMANCE_PROFILE else "")
+    return value or None
+
+
+# PRAGMAs de SQLite que se aplican a cada conexión nueva
+# SQLite PRAGMAs applied to every new connection
+SQLITE_PRAGMAS = {
+    "journal_mode": _profile_setting("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": _profile_setting("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": _profile_setting("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size": _profile_setting("SQLITE_CACHE_SIZE", str(-64 * 1024)),  # Negativo = KiB / Negative = KiB
+    "busy_timeout": _profile_setting("SQLITE_BUSY_TIMEOUT", "5000"),  # Milisegundos / Milliseconds
+}
+
+# Pool de conexiones. Con el perfil activo mantiene 40 conexiones (una por hilo del threadpool de
+# FastAPI) y no limita el desborde: una sesión retiene su conexión hasta que la respuesta se
+# serializa, y un pool lleno bloquearía a los hilos que esa serialización necesita.
+# Connection pool. With the profile on it keeps 40 connections (one per FastAPI threadpool
+# worker) and does not cap overflow: a session holds its connection until the response is
+# serialized, and a full pool would block the very threads that serialization needs.
+DB_POOL_SETTINGS = {
+    "pool_size": _profile_setting("DB_POOL_SIZE", "40"),
+    "max_overflow": _profile_setting("DB_MAX_OVERFLOW", "-1"),
+    "pool_timeout": _profile_setting("DB_POOL_TIMEOUT", "30"),
+}
+ENGINE_OPTIONS = {name: int(value) for name, value in DB_POOL_SETTINGS.items() if value is not None}
+
+
+# Aplicar los PRAGMAs configurados al abrir cada conexión SQLite
+# Apply the configured PRAGMAs when each SQLite connection is opened
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            if value is not None:
+                cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+
+# Registrar los PRAGMAs en un motor síncrono (o en el sync_engine de uno asíncrono)
+# Register the PRAGMAs on a sync engine (or on the sync_engine of an async one)
+def configure_sqlite_engine(sync_engine):
+    if sync_engine.dialect.name == "sqlite" and any(value is not None for value in SQLITE_PRAGMAS.values()):
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+
+
 # Crear el motor de SQLAlchemy
 # Create SQLAlchemy engine
 engine = create_engine(
-    SQL_ALCHEMY_DATABASE_URL
+    SQL_ALCHEMY_DATABASE_URL,
+    **ENGINE_OPTIONS
 )
+configure_sqlite_engine(engine)
 # Crear una fábrica de sesiones locales
 # Create a local session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Modo asíncrono opcional (ASYNC_DB=1). Requiere un driver asíncrono como aiosqlite.
+# Optional async mode (ASYNC_DB=1). Requires an async driver such as aiosqlite.
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB", "0").lower() in ("1", "true", "yes")
+ASYNC_SQL_ALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    SQL_ALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1) if SQL_ALCHEMY_DATABASE_URL else None
+)
+
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DB_ENABLED:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    # Crear el motor y la fábrica de sesiones asíncronas
+    # Create the async engine and session factory
+    async_engine = create_async_engine(ASYNC_SQL_ALCHEMY_DATABASE_URL, **ENGINE_OPTIONS)
+    configure_sqlite_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Almacenamiento compacto (COMPACT_STORAGE=1): DevicesRecords y TomaDecisiones usan columnas REAL/INTEGER
+# y date_record en milisegundos epoch (UTC). Una base existente se convierte con `python migrate_compact.py`.
+# Compact storage (COMPACT_STORAGE=1): DevicesRecords and TomaDecisiones use REAL/INTEGER columns and
+# date_record in epoch milliseconds (UTC). An existing database is converted with `python migrate_compact.py`.
+COMPACT_STORAGE_ENABLED = os.getenv("COMPACT_STORAGE", "0").lower() in ("1", "true", "yes")
+
+# Escrituras directas (RETURNING_WRITES=1): los update_*/delete_* de crud.py usan una sola sentencia
+# UPDATE/DELETE ... RETURNING en vez de cargar, modificar, confirmar y refrescar la fila. Solo si el
+# motor lo admite (SQLite >= 3.35); si no, se sigue por el camino ORM.
+# Direct writes (RETURNING_WRITES=1): the update_*/delete_* functions in crud.py use a single
+# UPDATE/DELETE ... RETURNING statement instead of loading, changing, committing and refreshing the
+# row. Only when the engine supports it (SQLite >= 3.35); otherwise the ORM path is kept.
+RETURNING_WRITES_ENABLED = (os.getenv("RETURNING_WRITES", "0").lower() in ("1", "true", "yes")
+                            and engine.dialect.update_returning and engine.dialect.delete_returning)
 
 # Clase base declarativa para los modelos
 # Declarative base class for models
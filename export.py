@@ -0,0 +1,110 @@
+import io
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi.responses import StreamingResponse
+
+import crud
+from database import COMPACT_STORAGE_ENABLED, SessionLocal
+
+# Filas leídas por lote en la exportación columnar; cada lote es un row group de Parquet
+# o un record batch de Arrow, así que conviene que sea más grande que STREAM_BATCH_SIZE.
+# Rows read per batch in the columnar export; each batch becomes a Parquet row group
+# or an Arrow record batch, so it should be larger than STREAM_BATCH_SIZE.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "50000"))
+
+# Formatos soportados: tipo de contenido y extensión del archivo
+# Supported formats: content type and file extension
+EXPORT_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+# Archivo de solo escritura que guarda lo escrito hasta que el generador lo entrega al cliente
+# Write-only file that keeps what was written until the generator hands it to the client
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Esquema de polars de las tuplas (id_record, id_device, current_value, date_record)
+# polars schema of the (id_record, id_device, current_value, date_record) tuples
+def _records_schema() -> dict:
+    import polars as pl
+
+    # En modo compacto date_record conserva la hora (milisegundos), si no es solo la fecha
+    # In compact mode date_record keeps the time of day (milliseconds), otherwise it is just the date
+    date_type = pl.Datetime("ms") if COMPACT_STORAGE_ENABLED else pl.Date
+    return {"id_record": pl.Int64, "id_device": pl.Int64, "current_value": pl.Float64, "date_record": date_type}
+
+
+# Escribir lotes de tuplas de registros en un archivo Parquet (usado al archivar particiones)
+# Write batches of record tuples into a Parquet file (used when archiving partitions)
+def write_parquet_file(batches, path: str):
+    import polars as pl
+    import pyarrow.parquet
+
+    schema = _records_schema()
+    writer = pyarrow.parquet.ParquetWriter(path, pl.DataFrame(schema=schema).to_arrow().schema)
+    try:
+        for batch in batches:
+            writer.write_table(pl.DataFrame(batch, schema=schema, orient="row").to_arrow())
+    finally:
+        writer.close()
+
+
+# Exportar DevicesRecords como Parquet o Arrow IPC (stream). Las filas se leen como tuplas por lotes,
+# se convierten a un DataFrame de polars y se escriben de inmediato, así la memoria depende del tamaño
+# del lote y no del total exportado. Usa su propia sesión, igual que stream_ndjson.
+# Export DevicesRecords as Parquet or Arrow IPC (stream). Rows are read as tuples in batches,
+# turned into a polars DataFrame and written right away, so memory depends on the batch size
+# rather than on the total exported. It uses its own session, like stream_ndjson.
+def stream_records_export(export_format: str, id_device: Optional[int] = None, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None):
+    import polars as pl
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    schema = _records_schema()
+    arrow_schema = pl.DataFrame(schema=schema).to_arrow().schema
+
+    def generar():
+        sink = _ChunkSink()
+        if export_format == "parquet":
+            writer = pyarrow.parquet.ParquetWriter(sink, arrow_schema)
+        else:
+            writer = pyarrow.ipc.new_stream(sink, arrow_schema)
+        db = SessionLocal()
+        try:
+            for batch in crud.iter_devices_records_batches(db, EXPORT_BATCH_SIZE, id_device, since, until):
+                frame = pl.DataFrame(batch, schema=schema, orient="row")
+                writer.write_table(frame.to_arrow())
+                yield sink.take()
+            writer.close()
+            yield sink.take()
+        finally:
+            db.close()
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"devices_records.{extension}"
+    return StreamingResponse(generar(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
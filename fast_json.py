@@ -0,0 +1,109 @@
+import json
+import os
+from datetime import datetime
+from operator import itemgetter
+
+from fastapi import Response
+
+from database import COMPACT_STORAGE_ENABLED
+from models import record_row_fields
+from wire_format import packb, response_msgpack_type
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional / orjson is optional
+    orjson = None
+
+# FAST_JSON=0 vuelve a serializar /devices/records/ con response_model (validación Pydantic por fila)
+# FAST_JSON=0 goes back to serializing /devices/records/ through response_model (per-row Pydantic validation)
+FAST_JSON_ENABLED = os.getenv("FAST_JSON", "1").lower() in ("1", "true", "yes")
+
+
+# Codificar a bytes JSON con orjson si está instalado, o con json de la biblioteca estándar
+# Encode to JSON bytes with orjson when installed, or with the standard library json
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+# Respuesta con la lista de registros: MessagePack si la solicitud lo negoció (wire_format), si no JSON
+# Response with the list of records: MessagePack if the request negotiated it (wire_format), JSON otherwise
+def _records_response(records: list) -> Response:
+    msgpack_type = response_msgpack_type.get()
+    if msgpack_type is not None:
+        return Response(content=packb(records), media_type=msgpack_type)
+    return Response(content=dumps(records), media_type="application/json")
+
+
+# Respuesta JSON de registros a partir de tuplas (id_record, id_device, current_value, date_record).
+# Son datos que salen de la propia base, así que no se validan fila por fila; el formato es el mismo
+# que produce DevicesRecordsResponse (id_device como float, date_record como fecha/hora ISO).
+# JSON response of records built from (id_record, id_device, current_value, date_record) tuples.
+# The data comes from our own database, so it is not validated row by row; the format is the same
+# DevicesRecordsResponse produces (id_device as float, date_record as an ISO date-time).
+def device_records_response(rows, fields=None) -> Response:
+    if fields is not None:
+        return _projected_records_response(rows, fields)
+    if COMPACT_STORAGE_ENABLED:
+        # REAL y milisegundos epoch: el valor ya es un float y la fecha un datetime con hora
+        # REAL and epoch milliseconds: the value is already a float and the date a datetime with time
+        return _records_response([
+            {
+                "id_record": id_record,
+                "id_device": float(id_device),
+                "current_value": current_value,
+                "date_record": date_record.isoformat(),
+            }
+            for id_record, id_device, current_value, date_record in rows
+        ])
+    return _records_response([
+        {
+            "id_record": id_record,
+            "id_device": float(id_device),
+            # Igual que Numeric (Decimal con 10 decimales) al pasar por Pydantic
+            # Same as Numeric (a Decimal with 10 decimal places) once through Pydantic
+            "current_value": round(float(current_value), 10),
+            "date_record": f"{date_record.isoformat()}T00:00:00",
+        }
+        for id_record, id_device, current_value, date_record in rows
+    ])
+
+
+# Conversión de cada campo de un registro al formato de device_records_response (None = tal cual)
+# Conversion of each record field to the device_records_response format (None = as is)
+def _legacy_date(value) -> str:
+    return value.isoformat() if isinstance(value, datetime) else f"{value.isoformat()}T00:00:00"
+
+
+_RECORD_FORMATS = {
+    "id_record": None,
+    "id_device": float,
+    "current_value": None if COMPACT_STORAGE_ENABLED else (lambda value: round(float(value), 10)),
+    # orjson escribe un datetime sin zona igual que isoformat()
+    # orjson writes a naive datetime just like isoformat()
+    "date_record": (None if orjson is not None else datetime.isoformat) if COMPACT_STORAGE_ENABLED else _legacy_date,
+}
+
+
+# Solo los campos pedidos con ?fields=, a partir de tuplas de models.record_row_fields(fields);
+# se leen por posición y solo se convierten los campos que lo necesitan
+# Only the fields requested with ?fields=, from models.record_row_fields(fields) tuples;
+# they are read by position and only the fields that need it are converted
+def _projected_records_response(rows, fields) -> Response:
+    layout = record_row_fields(fields)
+    pick = itemgetter(*(layout.index(name) for name in fields))
+    conversions = [(index, _RECORD_FORMATS[name]) for index, name in enumerate(fields) if _RECORD_FORMATS[name]]
+    if len(fields) == 1:
+        name, = fields
+        convert = _RECORD_FORMATS[name] or (lambda value: value)
+        return _records_response([{name: convert(pick(row))} for row in rows])
+    if not conversions:
+        return _records_response([dict(zip(fields, pick(row))) for row in rows])
+    records = []
+    for row in rows:
+        values = list(pick(row))
+        for index, convert in conversions:
+            values[index] = convert(values[index])
+        records.append(dict(zip(fields, values)))
+    return _records_response(records)
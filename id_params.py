@@ -0,0 +1,28 @@
+from typing import Optional
+
+
+# Interpretar "1,2,3" como un conjunto de IDs de dispositivo (None = todos)
+# Parse "1,2,3" as a set of device IDs (None = all of them)
+def parse_device_ids(ids: Optional[str]) -> Optional[set[int]]:
+    if not ids:
+        return None
+    return {int(value) for value in ids.split(",") if value.strip()}
+
+
+# Máximo de IDs por lectura en lote (/luces/batch, /controladores/batch, /devices/info/batch)
+# Maximum IDs per batch read (/luces/batch, /controladores/batch, /devices/info/batch)
+MAX_BATCH_IDS = 1000
+
+
+# IDs de una lectura en lote, ordenados; ValueError si faltan, no son enteros o son demasiados
+# IDs of a batch read, sorted; ValueError if missing, not integers or too many
+def parse_batch_ids(ids: str) -> list[int]:
+    try:
+        device_ids = parse_device_ids(ids)
+    except ValueError:
+        raise ValueError("ids must be a comma-separated list of integers")
+    if not device_ids:
+        raise ValueError("ids must list at least one ID")
+    if len(device_ids) > MAX_BATCH_IDS:
+        raise ValueError(f"at most {MAX_BATCH_IDS} ids per request")
+    return sorted(device_ids)
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+from collections import deque
+
+from fastapi import HTTPException, Response, status
+
+import crud
+from database import SessionLocal
+from models import DevicesRecords
+
+logger = logging.getLogger(__name__)
+
+# Configuración del buffer de ingesta (INGEST_BUFFER=1 lo activa detrás de POST /devices/records/)
+# Ingestion buffer settings (INGEST_BUFFER=1 enables it behind POST /devices/records/)
+INGEST_BUFFER_ENABLED = os.getenv("INGEST_BUFFER", "0").lower() in ("1", "true", "yes")
+INGEST_BUFFER_CAPACITY = int(os.getenv("INGEST_BUFFER_CAPACITY", "100000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+INGEST_FLUSH_INTERVAL_MS = int(os.getenv("INGEST_FLUSH_INTERVAL_MS", "200"))
+
+
+# Cola acotada en memoria para registros de dispositivos (write-behind). Los endpoints encolan
+# lecturas individuales y un hilo en segundo plano las escribe en DevicesRecordsDB por lotes, cuando
+# se juntan `batch_size` registros o pasan `flush_interval` segundos, lo que ocurra primero.
+# Bounded in-memory queue for device records (write-behind). Endpoints enqueue single readings
+# and a background thread writes them to DevicesRecordsDB in batches, whenever `batch_size`
+# records pile up or `flush_interval` seconds pass, whichever comes first.
+class IngestBuffer:
+    def __init__(self, session_factory=SessionLocal, capacity: int = INGEST_BUFFER_CAPACITY,
+                 batch_size: int = INGEST_BATCH_SIZE, flush_interval: float = INGEST_FLUSH_INTERVAL_MS / 1000):
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    # Encola un registro. Devuelve False si el buffer está lleno (el llamador responde 429).
+    # Enqueues a record. Returns False when the buffer is full (the caller answers 429).
+    def put(self, device_record: DevicesRecords) -> bool:
+        with self._cond:
+            if len(self._pending) >= self.capacity:
+                self.rejected += 1
+                return False
+            self._pending.append(device_record)
+            self.accepted += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    # Inicia el hilo que vacía el buffer.
+    # Starts the thread that drains the buffer.
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="ingest-buffer", daemon=True)
+        self._thread.start()
+
+    # Detiene el hilo y escribe todo lo pendiente, para no perder registros aceptados.
+    # Stops the thread and writes everything pending, so no accepted record is lost.
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    # Escribe de inmediato todos los registros pendientes.
+    # Writes all pending records right away.
+    def flush(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    # Contadores para monitoreo
+    # Counters for monitoring
+    def stats(self) -> dict:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "capacity": self.capacity,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }
+
+    def _take_batch(self) -> list[DevicesRecords]:
+        with self._cond:
+            count = min(len(self._pending), self.batch_size)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: list[DevicesRecords]):
+        db = self.session_factory()
+        try:
+            try:
+                crud.create_device_records_batch(db, batch)
+                self.flushed += len(batch)
+                return
+            except Exception:
+                db.rollback()
+                logger.exception("Falló la escritura en lote; reintentando fila por fila / Batch write failed; retrying row by row")
+            # Aislar las filas inválidas (p. ej. id_record duplicado) sin perder el resto del lote
+            # Isolate invalid rows (e.g. duplicate id_record) without losing the rest of the batch
+            for device_record in batch:
+                try:
+                    crud.create_device_record(db, device_record)
+                    self.flushed += 1
+                except Exception:
+                    db.rollback()
+                    self.dropped += 1
+                    logger.exception("Registro descartado / Record dropped: id_record=%s", device_record.id_record)
+        finally:
+            db.close()
+
+
+# Instancia global usada por los endpoints cuando INGEST_BUFFER=1
+# Global instance used by the endpoints when INGEST_BUFFER=1
+ingest_buffer = IngestBuffer() if INGEST_BUFFER_ENABLED else None
+
+
+# Encolar un registro desde un endpoint: 202 si se acepta, 429 si el buffer está lleno
+# Enqueue a record from an endpoint: 202 when accepted, 429 when the buffer is full
+def enqueue_device_record(device_record: DevicesRecords, response: Response):
+    if not ingest_buffer.put(device_record):
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Ingestion buffer full",
+                            headers={"Retry-After": "1"})
+    response.status_code = status.HTTP_202_ACCEPTED
+    return device_record
@@ -0,0 +1,170 @@
+import argparse
+import os
+from typing import Optional
+
+from sqlalchemy import Float, case, delete, select, tuple_, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import chunk_store
+import partitions
+from models import DeviceLatestStateDB, date_record_bound, stored_date_value
+
+# Último registro de cada dispositivo en la tabla DeviceLatestState, mantenida en cada escritura de
+# crud.py (LATEST_STATE=1). "Valor actual del dispositivo X" pasa a ser una lectura por clave primaria
+# en lugar de recorrer sus registros. En una base existente hay que llenarla una vez con
+# `python latest_state.py rebuild`. Sin LATEST_STATE se busca el último registro por índice en cada consulta.
+# Each device's newest record in the DeviceLatestState table, maintained on every write in crud.py
+# (LATEST_STATE=1). "Current value of device X" becomes a primary key read instead of walking its
+# records. On an existing database it has to be filled once with `python latest_state.py rebuild`.
+# Without LATEST_STATE the newest record is looked up through the index on every query.
+LATEST_STATE_ENABLED = os.getenv("LATEST_STATE", "0").lower() in ("1", "true", "yes")
+
+
+# Registro más reciente de un dispositivo según (date_record, id_record), leído de las tablas de
+# registros (la partición más nueva que tenga filas del dispositivo) y de los bloques archivados
+# A device's newest record by (date_record, id_record), read from the record tables (the newest
+# partition holding rows of the device) and from the archived chunks
+def newest_record(db: Session, id_device: int):
+    newest = None
+    for model in reversed(partitions.record_models(db)):
+        newest = db.execute(
+            select(
+                model.id_record,
+                model.id_device,
+                type_coerce(model.current_value, Float).label("current_value"),
+                model.date_record,
+            ).where(model.id_device == id_device).order_by(model.date_record.desc(), model.id_record.desc()).limit(1)
+        ).first()
+        if newest is not None:
+            break
+    archived = chunk_store.latest_record(db, id_device)
+    if archived is not None and (newest is None or (archived.date_record, archived.id_record)
+                                 > (newest.date_record, newest.id_record)):
+        return archived
+    return newest
+
+
+# Dispositivos que tienen algún registro
+# Devices that have any record
+def _device_ids(db: Session) -> list[int]:
+    ids = set(chunk_store.device_ids(db))
+    for model in partitions.record_models(db):
+        ids.update(db.execute(select(model.id_device).distinct()).scalars())
+    return sorted(int(id_device) for id_device in ids)
+
+
+# Guardar los registros recién insertados que son más nuevos que el estado de su dispositivo
+# Store the freshly inserted records that are newer than their device's state
+def records_inserted(db: Session, rows: list[dict]):
+    if not LATEST_STATE_ENABLED or not rows:
+        return
+    # Solo el más nuevo de cada dispositivo en el lote llega al upsert
+    # Only each device's newest record in the batch reaches the upsert
+    newest = {}
+    for row in rows:
+        candidate = {
+            "id_device": int(row["id_device"]),
+            "id_record": row["id_record"],
+            "current_value": float(row["current_value"]),
+            "date_record": stored_date_value(row["date_record"]),
+        }
+        current = newest.get(candidate["id_device"])
+        if current is None or (candidate["date_record"], candidate["id_record"]) >= (current["date_record"], current["id_record"]):
+            newest[candidate["id_device"]] = candidate
+
+    state = DeviceLatestStateDB
+    stmt = sqlite_insert(state)
+    is_newer = tuple_(stmt.excluded.date_record, stmt.excluded.id_record) >= tuple_(state.date_record, state.id_record)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[state.id_device],
+        set_={
+            column: case((is_newer, getattr(stmt.excluded, column)), else_=getattr(state, column))
+            for column in ("id_record", "current_value", "date_record")
+        },
+    )
+    db.execute(stmt, list(newest.values()))
+
+
+# Recalcular el estado de los dispositivos tocados por una actualización o un borrado
+# (el registro cambiado pudo haber sido el más nuevo)
+# Recompute the state of the devices touched by an update or a delete
+# (the changed record may have been the newest one)
+def records_changed(db: Session, keys: list[tuple]):
+    if not LATEST_STATE_ENABLED or not keys:
+        return
+    db.flush()
+    for id_device in set(int(id_device) for id_device, _ in keys):
+        _store(db, id_device, newest_record(db, id_device))
+
+
+# Recalcular el estado de los dispositivos (de `id_devices` o, con None, de todos) cuyo registro más
+# nuevo cae en [since, until], después de un borrado por rango; el de los demás dispositivos no cambia
+# Recompute the state of the devices (of `id_devices` or, with None, of all of them) whose newest record
+# falls in [since, until], after a range delete; the state of every other device does not change
+def range_changed(db: Session, id_devices: Optional[list[int]], since, until):
+    if not LATEST_STATE_ENABLED:
+        return
+    state = DeviceLatestStateDB
+    query = select(state.id_device)
+    if id_devices is not None:
+        query = query.where(state.id_device.in_(id_devices))
+    if since is not None:
+        query = query.where(state.date_record >= date_record_bound(since))
+    if until is not None:
+        query = query.where(state.date_record <= date_record_bound(until))
+    records_changed(db, [(affected, None) for affected in db.execute(query).scalars().all()])
+
+
+# Reemplazar el estado de un dispositivo (o borrarlo si ya no tiene registros)
+# Replace a device's state (or delete it if it has no records left)
+def _store(db: Session, id_device: int, record):
+    db.execute(delete(DeviceLatestStateDB).where(DeviceLatestStateDB.id_device == id_device))
+    if record is not None:
+        db.execute(sqlite_insert(DeviceLatestStateDB).values(
+            id_device=id_device,
+            id_record=record.id_record,
+            current_value=float(record.current_value),
+            date_record=record.date_record,
+        ))
+
+
+# Reconstruir el estado de todos los dispositivos (para backfills o al activarlo)
+# Rebuild every device's state (for backfills or when enabling it)
+def rebuild(db: Session):
+    db.execute(delete(DeviceLatestStateDB))
+    for id_device in _device_ids(db):
+        _store(db, id_device, newest_record(db, id_device))
+    db.commit()
+
+
+# Último registro de los dispositivos pedidos (todos si `ids` es None), en orden de id_device.
+# Los dispositivos sin registros no aparecen.
+# Newest record of the requested devices (all of them if `ids` is None), in id_device order.
+# Devices without records are left out.
+def get_latest(db: Session, ids: Optional[set[int]] = None) -> list:
+    if LATEST_STATE_ENABLED:
+        query = select(DeviceLatestStateDB)
+        if ids is not None:
+            query = query.where(DeviceLatestStateDB.id_device.in_(ids))
+        return db.execute(query.order_by(DeviceLatestStateDB.id_device)).scalars().all()
+    records = (newest_record(db, id_device) for id_device in (sorted(ids) if ids is not None else _device_ids(db)))
+    return [record for record in records if record is not None]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estado más reciente por dispositivo / Latest state per device")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        rebuild(session)
+        total = session.query(DeviceLatestStateDB).count()
+        print(f"Estado reconstruido / State rebuilt: {total} dispositivos / devices")
+    finally:
+        session.close()
@@ -1,30 +1,66 @@
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 import dotenv
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from starlette.responses import RedirectResponse
 
 import models, crud
-from database import SessionLocal, engine
-from typing import List, Optional
+import change_log
+from database import SessionLocal, engine, ASYNC_DB_ENABLED, COMPACT_STORAGE_ENABLED
+from streaming import stream_ndjson
+from export import stream_records_export
+from ingest_buffer import ingest_buffer, enqueue_device_record
+from record_stream import record_broker, serve_websocket, sse_response
+from id_params import parse_batch_ids, parse_device_ids
+from metadata_cache import metadata_cache
+from recent_cache import recent_cache
+from response_cache import cached_list_response
+from fast_json import FAST_JSON_ENABLED, device_records_response
+from projection import fields_model, fields_param, projected_response
+from wire_format import MsgPackMiddleware
+from typing import List, Literal, Optional
 from models import (
     DevicesInfo, DevicesRecords, TomaDecisiones, Luces, ControladorVoltaje,
     DevicesInfoDB, DevicesRecordsDB, TomaDecisionesDB, LucesDB, ControladorVoltajeDB,
     TestModel, DevicesInfoResponse, DevicesRecordsResponse, TomaDecisionesResponse,
-    LucesResponse, ControladorVoltajeResponse
+    LucesResponse, ControladorVoltajeResponse, DevicesRecordsBatchResponse, LucesCommand, ControladorVoltajeCommand,
+    BulkCommandResponse, DevicesRecordsDeleteResponse, DevicesRecordsAggregateResponse, ChangesResponse
 )
 
 # Crear tablas de base de datos
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+# Crear los índices declarados después de que las tablas ya existían
+# Create indexes declared after the tables already existed
+for table in models.Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+# Arranque y apagado de los servicios en segundo plano
+# Startup and shutdown of background services
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ingest_buffer is not None:
+        ingest_buffer.start()
+    yield
+    # Vaciar el buffer de ingesta para no perder registros ya aceptados
+    # Drain the ingestion buffer so no accepted record is lost
+    if ingest_buffer is not None:
+        ingest_buffer.stop()
 
 app = FastAPI(title="API de Dispositivos IoT", 
               description="API para gestionar dispositivos IoT y sus registros",
-              version="1.0.0")
+              version="1.0.0",
+              lifespan=lifespan)
+
+# Cuerpos y respuestas en MessagePack según Content-Type/Accept (ver wire_format.py)
+# MessagePack bodies and responses depending on Content-Type/Accept (see wire_format.py)
+app.add_middleware(MsgPackMiddleware)
 
 # Dependencia para la sesión de base de datos
 # Dependency for DB session
@@ -67,9 +103,24 @@ def delete_test(test_id: int, db: Session = Depends(get_db)):
 # Actualizar los endpoints de DevicesInfo (Información de Dispositivos)
 # Update the DevicesInfo endpoints
 @app.get("/devices/info/", response_model=list[DevicesInfoResponse], tags=["DevicesInfo"])
-def read_devices_info(db: Session = Depends(get_db)):
-    devices_info = crud.get_all_devices_info(db, 0)
-    return devices_info
+def read_devices_info(request: Request, fields: Optional[tuple] = Depends(fields_param(DevicesInfoResponse)),
+                      db: Session = Depends(get_db)):
+    # Bytes en caché por versión de la tabla; 304 si el ETag del cliente sigue vigente.
+    # Con ?fields=id_device,nombre solo se leen y se envían esas columnas.
+    # Bytes cached per table version; 304 when the client's ETag is still current.
+    # With ?fields=id_device,nombre only those columns are read and sent.
+    return cached_list_response(request, DevicesInfoDB.__tablename__, DevicesInfoResponse,
+                                lambda: crud.get_all_devices_info(db, 0, fields), fields)
+
+# Información de varios dispositivos (ids=1,2,3) con una sola consulta, por ID; [] si no existe
+# Info of several devices (ids=1,2,3) with a single query, keyed by ID; [] when it does not exist
+@app.get("/devices/info/batch", response_model=dict[int, list[DevicesInfoResponse]], tags=["DevicesInfo"])
+def read_devices_info_batch(ids: str, db: Session = Depends(get_db)):
+    try:
+        device_ids = parse_batch_ids(ids)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return crud.get_devices_info_by_ids(db, device_ids)
 
 @app.get("/devices/info/{id_device}", response_model=list[DevicesInfoResponse], tags=["DevicesInfo"])
 def read_device_info(id_device: int, db: Session = Depends(get_db)):
@@ -99,10 +150,59 @@ def delete_device_info(id_device: int, db: Session = Depends(get_db)):
 # Operaciones CRUD de DevicesRecords (Registros de Dispositivos)
 # DevicesRecords CRUD operations
 @app.get("/devices/records/", response_model=list[DevicesRecordsResponse], tags=["DevicesRecords"])
-def read_devices_records(db: Session = Depends(get_db)):
+def read_devices_records(stream: bool = False, fields: Optional[tuple] = Depends(fields_param(DevicesRecordsResponse)),
+                         db: Session = Depends(get_db)):
+    if stream:
+        return stream_ndjson(crud.iter_all_devices_records, fields_model(DevicesRecordsResponse, fields))
+    # Camino rápido: tuplas de columnas codificadas directamente, sin validar cada fila con Pydantic
+    # Fast path: column tuples encoded directly, without validating every row through Pydantic
+    if FAST_JSON_ENABLED:
+        return device_records_response(crud.get_all_devices_records_rows(db, fields), fields)
+    if fields is not None:
+        return projected_response(DevicesRecordsResponse, fields, crud.get_all_devices_records_rows(db, fields))
     devices_records = crud.get_all_devices_records(db)
     return devices_records
 
+# Exportar registros en formato columnar (Parquet o Arrow IPC) por lotes, sin modelos ORM ni Pydantic
+# Export records in a columnar format (Parquet or Arrow IPC) in batches, without ORM or Pydantic models
+@app.get("/devices/records/export", tags=["DevicesRecords"],
+         responses={200: {"description": "Archivo Parquet o Arrow IPC / Parquet or Arrow IPC file",
+                          "content": {"application/vnd.apache.parquet": {}, "application/vnd.apache.arrow.stream": {}}}})
+def export_devices_records(format: Literal["parquet", "arrow"] = "parquet", id_device: Optional[int] = None,
+                           from_: Optional[datetime] = Query(None, alias="from"), to: Optional[datetime] = None):
+    return stream_records_export(format, id_device, from_, to)
+
+# Suscripción en vivo a los registros nuevos de uno o varios dispositivos (ids=1,2,3; sin ids = todos)
+# Live subscription to the new records of one or more devices (ids=1,2,3; no ids = all of them)
+@app.websocket("/devices/records/live")
+async def live_device_records_ws(websocket: WebSocket, ids: Optional[str] = None):
+    try:
+        device_ids = parse_device_ids(ids)
+    except ValueError:
+        await websocket.close(code=1008, reason="ids must be a comma-separated list of integers")
+        return
+    await websocket.accept()
+    await serve_websocket(websocket, device_ids)
+
+@app.get("/devices/records/live", tags=["DevicesRecords"],
+         responses={200: {"description": "Server-Sent Events", "content": {"text/event-stream": {}}}})
+async def live_device_records_sse(ids: Optional[str] = None):
+    try:
+        device_ids = parse_device_ids(ids)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be a comma-separated list of integers")
+    return sse_response(device_ids)
+
+@app.get("/devices/records/live/stats", tags=["DevicesRecords"])
+def read_live_stats():
+    return record_broker.stats()
+
+# Contadores de la caché de registros recientes por dispositivo
+# Per-device recent record cache counters
+@app.get("/devices/records/recent/stats", tags=["DevicesRecords"])
+def read_recent_cache_stats():
+    return recent_cache.stats()
+
 @app.get("/devices/records/{id_record}", response_model=DevicesRecordsResponse, tags=["DevicesRecords"])
 def read_device_record(id_record: int, db: Session = Depends(get_db)):
     device_record = crud.get_devices_records_by_id(db, id_record)
@@ -113,16 +213,82 @@ def read_device_record(id_record: int, db: Session = Depends(get_db)):
 # Actualizar endpoint de DevicesRecords que todavía usa DevicesRecordsDB
 # Update DevicesRecords endpoint that still uses DevicesRecordsDB
 @app.get("/devices/records/device/{id_device}", response_model=list[DevicesRecordsResponse], tags=["DevicesRecords"])
-def read_device_records_by_device(id_device: int, db: Session = Depends(get_db)):
-    device_records = crud.get_devices_records_by_device_id(db, id_device)
-    if not device_records:
+def read_device_records_by_device(id_device: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                  limit: Optional[int] = Query(None, ge=1, le=10000), after_id: Optional[int] = None,
+                                  last: Optional[int] = Query(None, ge=1, le=10000),
+                                  fields: Optional[tuple] = Depends(fields_param(DevicesRecordsResponse)),
+                                  db: Session = Depends(get_db)):
+    # `last` pide los N registros más recientes (en orden de fecha); no se combina con la paginación
+    # `last` asks for the N newest records (in date order); it is not combined with pagination
+    if last is not None and (limit is not None or after_id is not None):
+        raise HTTPException(status_code=422, detail="last cannot be combined with limit or after_id")
+    device_records = crud.get_devices_records_by_device_id(db, id_device, since, until, limit, after_id, last, fields)
+    # Una página vacía después de un cursor marca el final, no un error
+    # An empty page after a cursor marks the end, not an error
+    if not device_records and after_id is None:
         raise HTTPException(status_code=404, detail="No se encontraron registros para este dispositivo")
+    # Con ?fields= solo se envían esos campos
+    # With ?fields= only those fields are sent
+    if fields is not None:
+        return projected_response(DevicesRecordsResponse, fields, device_records)
     return device_records
 
-@app.post("/devices/records/", response_model=DevicesRecordsResponse, status_code=status.HTTP_201_CREATED, tags=["DevicesRecords"])
-def create_device_record(device_record: DevicesRecords, db: Session = Depends(get_db)):
+# Agregados por intervalo (1m, 1h, 1d) calculados en SQL, para no enviar los registros crudos.
+# La columna Date por defecto solo guarda el día, así que 1m y 1h requieren COMPACT_STORAGE=1;
+# sin él el intervalo por defecto es 1d y los menores se rechazan con 422.
+# Per-bucket aggregates (1m, 1h, 1d) computed in SQL, so raw records are not sent.
+# The default Date column only stores the day, so 1m and 1h require COMPACT_STORAGE=1;
+# without it the default bucket is 1d and smaller ones are rejected with 422.
+@app.get("/devices/records/device/{id_device}/aggregate", response_model=list[DevicesRecordsAggregateResponse], tags=["DevicesRecords"])
+def read_device_records_aggregate(id_device: int,
+                                  bucket: Literal["1m", "1h", "1d"] = "1h" if COMPACT_STORAGE_ENABLED else "1d",
+                                  from_: Optional[datetime] = Query(None, alias="from"),
+                                  to: Optional[datetime] = None, db: Session = Depends(get_db)):
+    if bucket != "1d" and not COMPACT_STORAGE_ENABLED:
+        raise HTTPException(status_code=422, detail="bucket must be 1d unless COMPACT_STORAGE is enabled")
+    return crud.get_devices_records_aggregate(db, id_device, bucket, from_, to)
+
+# Último registro de un dispositivo, para lazos de control que solo necesitan el valor actual
+# A device's newest record, for control loops that only need the current value
+@app.get("/devices/{id_device}/latest", response_model=DevicesRecordsResponse, tags=["DevicesRecords"])
+def read_device_latest(id_device: int, db: Session = Depends(get_db)):
+    latest = crud.get_device_latest(db, id_device)
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No se encontraron registros para este dispositivo")
+    return latest
+
+# Último registro de varios dispositivos (ids=1,2,3; sin ids = toda la flota) en una sola lectura
+# Newest record of several devices (ids=1,2,3; no ids = the whole fleet) in a single read
+@app.get("/devices/latest", response_model=list[DevicesRecordsResponse], tags=["DevicesRecords"])
+def read_devices_latest(ids: Optional[str] = None, db: Session = Depends(get_db)):
+    try:
+        device_ids = parse_device_ids(ids)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be a comma-separated list of integers")
+    return crud.get_devices_latest(db, device_ids)
+
+@app.post("/devices/records/", response_model=DevicesRecordsResponse, status_code=status.HTTP_201_CREATED, tags=["DevicesRecords"],
+          responses={202: {"description": "Encolado en el buffer de ingesta / Queued in the ingestion buffer"},
+                     429: {"description": "Buffer de ingesta lleno / Ingestion buffer full"}})
+def create_device_record(device_record: DevicesRecords, response: Response, db: Session = Depends(get_db)):
+    if ingest_buffer is not None:
+        return enqueue_device_record(device_record, response)
     return crud.create_device_record(db, device_record)
 
+# Estado del buffer de ingesta
+# Ingestion buffer status
+@app.get("/devices/records/ingest/stats", tags=["DevicesRecords"])
+def read_ingest_stats():
+    if ingest_buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **ingest_buffer.stats()}
+
+# Inserción en lote de registros en una sola transacción
+# Batch insertion of records in a single transaction
+@app.post("/devices/records/batch", response_model=DevicesRecordsBatchResponse, status_code=status.HTTP_201_CREATED, tags=["DevicesRecords"])
+def create_device_records_batch(device_records: List[DevicesRecords], db: Session = Depends(get_db)):
+    return crud.create_device_records_batch(db, device_records)
+
 @app.put("/devices/records/{id_record}", response_model=DevicesRecordsResponse, tags=["DevicesRecords"])
 def update_device_record(id_record: int, device_record: DevicesRecords, db: Session = Depends(get_db)):
     updated_record = crud.update_device_record(db, id_record, device_record)
@@ -137,12 +303,32 @@ def delete_device_record(id_record: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Device record not found")
     return {"message": "Device record deleted successfully"}
 
+# Borrar todos los registros de un dispositivo y/o de un intervalo de tiempo [from, to] con un DELETE por
+# tabla (o por lotes de batch_size filas, cada uno en su propia transacción); devuelve cuántos se borraron
+# Delete every record of a device and/or of a time interval [from, to] with one DELETE per table
+# (or in batches of batch_size rows, each in its own transaction); returns how many were deleted
+@app.delete("/devices/records", response_model=DevicesRecordsDeleteResponse, tags=["DevicesRecords"])
+def delete_devices_records_range(id_device: Optional[int] = None,
+                                 from_: Optional[datetime] = Query(None, alias="from"),
+                                 to: Optional[datetime] = None,
+                                 batch_size: Optional[int] = Query(None, ge=1, le=100_000),
+                                 db: Session = Depends(get_db)):
+    # Sin ningún filtro se borraría la tabla entera
+    # Without any filter the whole table would be deleted
+    if id_device is None and from_ is None and to is None:
+        raise HTTPException(status_code=422, detail="at least one of id_device, from or to is required")
+    return {"deleted": crud.delete_devices_records_range(db, id_device, from_, to, batch_size)}
+
 # Actualizar endpoints de TomaDecisiones (Toma de Decisiones)
 # Update TomaDecisiones endpoints
 @app.get("/decisiones/", response_model=list[TomaDecisionesResponse], tags=["TomaDecisiones"])
-def read_toma_decisiones(db: Session = Depends(get_db)):
-    decisiones = crud.get_all_toma_decisiones(db)
-    return decisiones
+def read_toma_decisiones(request: Request, stream: bool = False,
+                         fields: Optional[tuple] = Depends(fields_param(TomaDecisionesResponse)), db: Session = Depends(get_db)):
+    if stream:
+        return stream_ndjson(lambda session, size: crud.iter_all_toma_decisiones(session, size, fields),
+                             fields_model(TomaDecisionesResponse, fields))
+    return cached_list_response(request, TomaDecisionesDB.__tablename__, TomaDecisionesResponse,
+                                lambda: crud.get_all_toma_decisiones(db, fields), fields)
 
 @app.get("/decisiones/{id_decision}", response_model=TomaDecisionesResponse, tags=["TomaDecisiones"])
 def read_toma_decision(id_decision: int, db: Session = Depends(get_db)):
@@ -169,12 +355,31 @@ def delete_toma_decision(id_decision: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Decision not found")
     return {"message": "Decision deleted successfully"}
 
+# Contadores de la caché de metadatos (DevicesInfo, Luces, ControladorVoltaje)
+# Metadata cache counters (DevicesInfo, Luces, ControladorVoltaje)
+@app.get("/cache/stats", tags=["Cache"])
+def read_cache_stats():
+    return metadata_cache.stats()
+
 # Actualizar endpoints de Luces
 # Update Luces endpoints
 @app.get("/luces/", response_model=list[LucesResponse], tags=["Luces"])
-def read_luces(db: Session = Depends(get_db)):
-    luces = crud.get_all_luces(db)
-    return luces
+def read_luces(request: Request, stream: bool = False, fields: Optional[tuple] = Depends(fields_param(LucesResponse)),
+               db: Session = Depends(get_db)):
+    if stream:
+        return stream_ndjson(lambda session, size: crud.iter_all_luces(session, size, fields),
+                             fields_model(LucesResponse, fields))
+    return cached_list_response(request, LucesDB.__tablename__, LucesResponse, lambda: crud.get_all_luces(db, fields), fields)
+
+# Varias luces (ids=1,2,3) con una sola consulta, por ID; null si no existe
+# Several lights (ids=1,2,3) with a single query, keyed by ID; null when it does not exist
+@app.get("/luces/batch", response_model=dict[int, Optional[LucesResponse]], tags=["Luces"])
+def read_luces_batch(ids: str, db: Session = Depends(get_db)):
+    try:
+        device_ids = parse_batch_ids(ids)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return crud.get_luces_by_ids(db, device_ids)
 
 @app.get("/luces/{id_device}", response_model=LucesResponse, tags=["Luces"])
 def read_luz(id_device: int, db: Session = Depends(get_db)):
@@ -201,12 +406,35 @@ def delete_luz(id_device: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Luz not found")
     return {"message": "Luz deleted successfully"}
 
+# Comando en lote: nuevos lúmenes para un grupo de luces (ids, vendor y/o nombre_prefix) en un solo UPDATE
+# Bulk command: new lumens for a group of lights (ids, vendor and/or nombre_prefix) in a single UPDATE
+@app.post("/luces/command", response_model=BulkCommandResponse, tags=["Luces"])
+def command_luces(command: LucesCommand, db: Session = Depends(get_db)):
+    error = command.command_error()
+    if error is not None:
+        raise HTTPException(status_code=422, detail=error)
+    return {"updated": crud.command_luces(db, command)}
+
 # Actualizar endpoints de ControladorVoltaje
 # Update ControladorVoltaje endpoints
 @app.get("/controladores/", response_model=list[ControladorVoltajeResponse], tags=["ControladorVoltaje"])
-def read_controladores(db: Session = Depends(get_db)):
-    controladores = crud.get_all_controlador_voltaje(db)
-    return controladores
+def read_controladores(request: Request, stream: bool = False,
+                       fields: Optional[tuple] = Depends(fields_param(ControladorVoltajeResponse)), db: Session = Depends(get_db)):
+    if stream:
+        return stream_ndjson(lambda session, size: crud.iter_all_controlador_voltaje(session, size, fields),
+                             fields_model(ControladorVoltajeResponse, fields))
+    return cached_list_response(request, ControladorVoltajeDB.__tablename__, ControladorVoltajeResponse,
+                                lambda: crud.get_all_controlador_voltaje(db, fields), fields)
+
+# Varios controladores (ids=1,2,3) con una sola consulta, por ID; null si no existe
+# Several controllers (ids=1,2,3) with a single query, keyed by ID; null when it does not exist
+@app.get("/controladores/batch", response_model=dict[int, Optional[ControladorVoltajeResponse]], tags=["ControladorVoltaje"])
+def read_controladores_batch(ids: str, db: Session = Depends(get_db)):
+    try:
+        device_ids = parse_batch_ids(ids)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return crud.get_controlador_voltaje_by_ids(db, device_ids)
 
 @app.get("/controladores/{id_device}", response_model=ControladorVoltajeResponse, tags=["ControladorVoltaje"])
 def read_controlador(id_device: int, db: Session = Depends(get_db)):
@@ -232,3 +460,32 @@ def delete_controlador(id_device: int, db: Session = Depends(get_db)):
     if not success:
         raise HTTPException(status_code=404, detail="Controlador not found")
     return {"message": "Controlador deleted successfully"}
+
+# Comando en lote: encender/apagar y/o fijar el voltaje de un grupo de controladores en un solo UPDATE
+# Bulk command: switch on/off and/or set the voltage of a group of controllers in a single UPDATE
+@app.post("/controladores/command", response_model=BulkCommandResponse, tags=["ControladorVoltaje"])
+def command_controladores(command: ControladorVoltajeCommand, db: Session = Depends(get_db)):
+    error = command.command_error()
+    if error is not None:
+        raise HTTPException(status_code=422, detail=error)
+    return {"updated": crud.command_controlador_voltaje(db, command)}
+
+# Registro de cambios de luces, controladores, información de dispositivos y decisiones desde un cursor
+# (CHANGE_LOG=1). Empezar con since=0 y seguir con el `cursor` de cada respuesta; 410 si el cursor es
+# anterior a bajas ya compactadas (hay que volver a empezar desde 0).
+# Change log of lights, controllers, device info and decisions since a cursor (CHANGE_LOG=1). Start with
+# since=0 and continue with each response's `cursor`; 410 if the cursor is older than already compacted
+# deletes (start over from 0).
+@app.get("/changes", response_model=ChangesResponse, tags=["Changes"])
+def read_changes(since: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000), db: Session = Depends(get_db)):
+    if not change_log.CHANGE_LOG_ENABLED:
+        raise HTTPException(status_code=404, detail="Change log disabled (CHANGE_LOG=0)")
+    if change_log.cursor_expired(db, since):
+        raise HTTPException(status_code=410, detail="Cursor expired, resync from since=0")
+    return change_log.get_changes(db, since, limit)
+
+# Con ASYNC_DB=1 los endpoints anteriores se sustituyen por sus versiones asíncronas (main_async.py)
+# With ASYNC_DB=1 the endpoints above are replaced by their async versions (main_async.py)
+if ASYNC_DB_ENABLED:
+    from main_async import install_async_routes
+    install_async_routes(app)
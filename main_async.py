@@ -0,0 +1,346 @@
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import change_log
+import crud, crud_async
+from database import AsyncSessionLocal
+from streaming import stream_ndjson
+from ingest_buffer import ingest_buffer, enqueue_device_record
+from response_cache import cached_list_response_async
+from id_params import parse_batch_ids, parse_device_ids
+from fast_json import FAST_JSON_ENABLED, device_records_response
+from projection import fields_model, fields_param, projected_response
+from models import (
+    DevicesInfo, DevicesRecords, TomaDecisiones, Luces, ControladorVoltaje,
+    DevicesInfoDB, TomaDecisionesDB, LucesDB, ControladorVoltajeDB,
+    DevicesInfoResponse, DevicesRecordsResponse, TomaDecisionesResponse,
+    LucesResponse, ControladorVoltajeResponse, DevicesRecordsBatchResponse, LucesCommand, ControladorVoltajeCommand,
+    BulkCommandResponse, DevicesRecordsDeleteResponse, ChangesResponse
+)
+
+# Endpoints asíncronos que reemplazan a los de main.py cuando ASYNC_DB=1.
+# Así una consulta lenta no acapara el threadpool y no bloquea al resto de las solicitudes.
+# Async endpoints that replace the ones in main.py when ASYNC_DB=1.
+# This way a slow query does not hold the threadpool and does not block other requests.
+router = APIRouter()
+
+# Dependencia para la sesión asíncrona de base de datos
+# Dependency for the async DB session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Reemplazar en su lugar las rutas síncronas de la app que tengan una versión asíncrona
+# Replace in place the app's sync routes that have an async version
+def install_async_routes(app):
+    async_routes = {
+        (route.path, frozenset(route.methods)): route
+        for route in router.routes if isinstance(route, APIRoute)
+    }
+    app.router.routes = [
+        async_routes.get((route.path, frozenset(route.methods)), route) if isinstance(route, APIRoute) else route
+        for route in app.router.routes
+    ]
+    app.openapi_schema = None
+
+# Endpoints asíncronos de DevicesInfo (Información de Dispositivos)
+# Async DevicesInfo endpoints
+@router.get("/devices/info/", response_model=list[DevicesInfoResponse], tags=["DevicesInfo"])
+async def read_devices_info(request: Request, fields: Optional[tuple] = Depends(fields_param(DevicesInfoResponse)),
+                            db: AsyncSession = Depends(get_async_db)):
+    return await cached_list_response_async(request, DevicesInfoDB.__tablename__, DevicesInfoResponse,
+                                            lambda: crud_async.get_all_devices_info(db, 0, fields), fields)
+
+# Información de varios dispositivos (ids=1,2,3) con una sola consulta, por ID; [] si no existe
+# Info of several devices (ids=1,2,3) with a single query, keyed by ID; [] when it does not exist
+@router.get("/devices/info/batch", response_model=dict[int, list[DevicesInfoResponse]], tags=["DevicesInfo"])
+async def read_devices_info_batch(ids: str, db: AsyncSession = Depends(get_async_db)):
+    try:
+        device_ids = parse_batch_ids(ids)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return await crud_async.get_devices_info_by_ids(db, device_ids)
+
+@router.get("/devices/info/{id_device}", response_model=list[DevicesInfoResponse], tags=["DevicesInfo"])
+async def read_device_info(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    device_info = await crud_async.get_devices_info_by_id(db, id_device)
+    if not device_info:
+        raise HTTPException(status_code=404, detail="Device info not found")
+    return device_info
+
+@router.post("/devices/info/", response_model=DevicesInfoResponse, status_code=status.HTTP_201_CREATED, tags=["DevicesInfo"])
+async def create_device_info(device_info: DevicesInfo, db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.create_device_info(db, device_info)
+
+@router.put("/devices/info/{id_device}", response_model=DevicesInfoResponse, tags=["DevicesInfo"])
+async def update_device_info(id_device: int, device_info: DevicesInfo, db: AsyncSession = Depends(get_async_db)):
+    updated_device = await crud_async.update_device_info(db, id_device, device_info)
+    if updated_device is None:
+        raise HTTPException(status_code=404, detail="Device info not found")
+    return updated_device
+
+@router.delete("/devices/info/{id_device}", status_code=status.HTTP_204_NO_CONTENT, tags=["DevicesInfo"])
+async def delete_device_info(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    success = await crud_async.delete_device_info(db, id_device)
+    if not success:
+        raise HTTPException(status_code=404, detail="Device info not found")
+    return {"message": "Device info deleted successfully"}
+
+# Endpoints asíncronos de DevicesRecords (Registros de Dispositivos)
+# Async DevicesRecords endpoints
+@router.get("/devices/records/", response_model=list[DevicesRecordsResponse], tags=["DevicesRecords"])
+async def read_devices_records(stream: bool = False, fields: Optional[tuple] = Depends(fields_param(DevicesRecordsResponse)),
+                               db: AsyncSession = Depends(get_async_db)):
+    if stream:
+        return stream_ndjson(crud.iter_all_devices_records, fields_model(DevicesRecordsResponse, fields))
+    if FAST_JSON_ENABLED:
+        return device_records_response(await crud_async.get_all_devices_records_rows(db, fields), fields)
+    if fields is not None:
+        return projected_response(DevicesRecordsResponse, fields, await crud_async.get_all_devices_records_rows(db, fields))
+    devices_records = await crud_async.get_all_devices_records(db)
+    return devices_records
+
+@router.get("/devices/records/{id_record}", response_model=DevicesRecordsResponse, tags=["DevicesRecords"])
+async def read_device_record(id_record: int, db: AsyncSession = Depends(get_async_db)):
+    device_record = await crud_async.get_devices_records_by_id(db, id_record)
+    if device_record is None:
+        raise HTTPException(status_code=404, detail="Device record not found")
+    return device_record
+
+@router.get("/devices/records/device/{id_device}", response_model=list[DevicesRecordsResponse], tags=["DevicesRecords"])
+async def read_device_records_by_device(id_device: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                  limit: Optional[int] = Query(None, ge=1, le=10000), after_id: Optional[int] = None,
+                                  last: Optional[int] = Query(None, ge=1, le=10000),
+                                  fields: Optional[tuple] = Depends(fields_param(DevicesRecordsResponse)),
+                                  db: AsyncSession = Depends(get_async_db)):
+    # `last` pide los N registros más recientes (en orden de fecha); no se combina con la paginación
+    # `last` asks for the N newest records (in date order); it is not combined with pagination
+    if last is not None and (limit is not None or after_id is not None):
+        raise HTTPException(status_code=422, detail="last cannot be combined with limit or after_id")
+    device_records = await crud_async.get_devices_records_by_device_id(db, id_device, since, until, limit, after_id,
+                                                                       last, fields)
+    # Una página vacía después de un cursor marca el final, no un error
+    # An empty page after a cursor marks the end, not an error
+    if not device_records and after_id is None:
+        raise HTTPException(status_code=404, detail="No se encontraron registros para este dispositivo")
+    if fields is not None:
+        return projected_response(DevicesRecordsResponse, fields, device_records)
+    return device_records
+
+@router.get("/devices/{id_device}/latest", response_model=DevicesRecordsResponse, tags=["DevicesRecords"])
+async def read_device_latest(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    latest = await crud_async.get_device_latest(db, id_device)
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No se encontraron registros para este dispositivo")
+    return latest
+
+@router.get("/devices/latest", response_model=list[DevicesRecordsResponse], tags=["DevicesRecords"])
+async def read_devices_latest(ids: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    try:
+        device_ids = parse_device_ids(ids)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be a comma-separated list of integers")
+    return await crud_async.get_devices_latest(db, device_ids)
+
+@router.post("/devices/records/", response_model=DevicesRecordsResponse, status_code=status.HTTP_201_CREATED, tags=["DevicesRecords"],
+             responses={202: {"description": "Encolado en el buffer de ingesta / Queued in the ingestion buffer"},
+                        429: {"description": "Buffer de ingesta lleno / Ingestion buffer full"}})
+async def create_device_record(device_record: DevicesRecords, response: Response, db: AsyncSession = Depends(get_async_db)):
+    if ingest_buffer is not None:
+        return enqueue_device_record(device_record, response)
+    return await crud_async.create_device_record(db, device_record)
+
+# Inserción en lote de registros en una sola transacción
+# Batch insertion of records in a single transaction
+@router.post("/devices/records/batch", response_model=DevicesRecordsBatchResponse, status_code=status.HTTP_201_CREATED, tags=["DevicesRecords"])
+async def create_device_records_batch(device_records: List[DevicesRecords], db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.create_device_records_batch(db, device_records)
+
+@router.put("/devices/records/{id_record}", response_model=DevicesRecordsResponse, tags=["DevicesRecords"])
+async def update_device_record(id_record: int, device_record: DevicesRecords, db: AsyncSession = Depends(get_async_db)):
+    updated_record = await crud_async.update_device_record(db, id_record, device_record)
+    if updated_record is None:
+        raise HTTPException(status_code=404, detail="Device record not found")
+    return updated_record
+
+@router.delete("/devices/records/{id_record}", status_code=status.HTTP_204_NO_CONTENT, tags=["DevicesRecords"])
+async def delete_device_record(id_record: int, db: AsyncSession = Depends(get_async_db)):
+    success = await crud_async.delete_device_record(db, id_record)
+    if not success:
+        raise HTTPException(status_code=404, detail="Device record not found")
+    return {"message": "Device record deleted successfully"}
+
+# Borrar los registros de un dispositivo y/o de un intervalo de tiempo (ver main.delete_devices_records_range)
+# Delete the records of a device and/or of a time interval (see main.delete_devices_records_range)
+@router.delete("/devices/records", response_model=DevicesRecordsDeleteResponse, tags=["DevicesRecords"])
+async def delete_devices_records_range(id_device: Optional[int] = None,
+                                       from_: Optional[datetime] = Query(None, alias="from"),
+                                       to: Optional[datetime] = None,
+                                       batch_size: Optional[int] = Query(None, ge=1, le=100_000),
+                                       db: AsyncSession = Depends(get_async_db)):
+    if id_device is None and from_ is None and to is None:
+        raise HTTPException(status_code=422, detail="at least one of id_device, from or to is required")
+    return {"deleted": await crud_async.delete_devices_records_range(db, id_device, from_, to, batch_size)}
+
+# Endpoints asíncronos de TomaDecisiones (Toma de Decisiones)
+# Async TomaDecisiones endpoints
+@router.get("/decisiones/", response_model=list[TomaDecisionesResponse], tags=["TomaDecisiones"])
+async def read_toma_decisiones(request: Request, stream: bool = False,
+                               fields: Optional[tuple] = Depends(fields_param(TomaDecisionesResponse)),
+                               db: AsyncSession = Depends(get_async_db)):
+    if stream:
+        return stream_ndjson(lambda session, size: crud.iter_all_toma_decisiones(session, size, fields),
+                             fields_model(TomaDecisionesResponse, fields))
+    return await cached_list_response_async(request, TomaDecisionesDB.__tablename__, TomaDecisionesResponse,
+                                            lambda: crud_async.get_all_toma_decisiones(db, fields), fields)
+
+@router.get("/decisiones/{id_decision}", response_model=TomaDecisionesResponse, tags=["TomaDecisiones"])
+async def read_toma_decision(id_decision: int, db: AsyncSession = Depends(get_async_db)):
+    decision = await crud_async.get_toma_decisiones_by_id(db, id_decision)
+    if decision is None:
+        raise HTTPException(status_code=404, detail="Decision not found")
+    return decision
+
+@router.post("/decisiones/", response_model=TomaDecisionesResponse, status_code=status.HTTP_201_CREATED, tags=["TomaDecisiones"])
+async def create_toma_decision(toma_decision: TomaDecisiones, db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.create_toma_decisiones(db, toma_decision)
+
+@router.put("/decisiones/{id_decision}", response_model=TomaDecisionesResponse, tags=["TomaDecisiones"])
+async def update_toma_decision(id_decision: int, toma_decision: TomaDecisiones, db: AsyncSession = Depends(get_async_db)):
+    updated_decision = await crud_async.update_toma_decisiones(db, id_decision, toma_decision)
+    if updated_decision is None:
+        raise HTTPException(status_code=404, detail="Decision not found")
+    return updated_decision
+
+@router.delete("/decisiones/{id_decision}", status_code=status.HTTP_204_NO_CONTENT, tags=["TomaDecisiones"])
+async def delete_toma_decision(id_decision: int, db: AsyncSession = Depends(get_async_db)):
+    success = await crud_async.delete_toma_decisiones(db, id_decision)
+    if not success:
+        raise HTTPException(status_code=404, detail="Decision not found")
+    return {"message": "Decision deleted successfully"}
+
+# Endpoints asíncronos de Luces
+# Async Luces endpoints
+@router.get("/luces/", response_model=list[LucesResponse], tags=["Luces"])
+async def read_luces(request: Request, stream: bool = False, fields: Optional[tuple] = Depends(fields_param(LucesResponse)),
+                     db: AsyncSession = Depends(get_async_db)):
+    if stream:
+        return stream_ndjson(lambda session, size: crud.iter_all_luces(session, size, fields),
+                             fields_model(LucesResponse, fields))
+    return await cached_list_response_async(request, LucesDB.__tablename__, LucesResponse,
+                                            lambda: crud_async.get_all_luces(db, fields), fields)
+
+# Varias luces (ids=1,2,3) con una sola consulta, por ID; null si no existe
+# Several lights (ids=1,2,3) with a single query, keyed by ID; null when it does not exist
+@router.get("/luces/batch", response_model=dict[int, Optional[LucesResponse]], tags=["Luces"])
+async def read_luces_batch(ids: str, db: AsyncSession = Depends(get_async_db)):
+    try:
+        device_ids = parse_batch_ids(ids)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return await crud_async.get_luces_by_ids(db, device_ids)
+
+@router.get("/luces/{id_device}", response_model=LucesResponse, tags=["Luces"])
+async def read_luz(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    luz = await crud_async.get_luces_by_id(db, id_device)
+    if luz is None:
+        raise HTTPException(status_code=404, detail="Luz not found")
+    return luz
+
+@router.post("/luces/", response_model=LucesResponse, status_code=status.HTTP_201_CREATED, tags=["Luces"])
+async def create_luz(luz: Luces, db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.create_luces(db, luz)
+
+@router.put("/luces/{id_device}", response_model=LucesResponse, tags=["Luces"])
+async def update_luz(id_device: int, luz: Luces, db: AsyncSession = Depends(get_async_db)):
+    updated_luz = await crud_async.update_luces(db, id_device, luz)
+    if updated_luz is None:
+        raise HTTPException(status_code=404, detail="Luz not found")
+    return updated_luz
+
+@router.delete("/luces/{id_device}", status_code=status.HTTP_204_NO_CONTENT, tags=["Luces"])
+async def delete_luz(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    success = await crud_async.delete_luces(db, id_device)
+    if not success:
+        raise HTTPException(status_code=404, detail="Luz not found")
+    return {"message": "Luz deleted successfully"}
+
+# Comando en lote: nuevos lúmenes para un grupo de luces (ids, vendor y/o nombre_prefix) en un solo UPDATE
+# Bulk command: new lumens for a group of lights (ids, vendor and/or nombre_prefix) in a single UPDATE
+@router.post("/luces/command", response_model=BulkCommandResponse, tags=["Luces"])
+async def command_luces(command: LucesCommand, db: AsyncSession = Depends(get_async_db)):
+    error = command.command_error()
+    if error is not None:
+        raise HTTPException(status_code=422, detail=error)
+    return {"updated": await crud_async.command_luces(db, command)}
+
+# Endpoints asíncronos de ControladorVoltaje
+# Async ControladorVoltaje endpoints
+@router.get("/controladores/", response_model=list[ControladorVoltajeResponse], tags=["ControladorVoltaje"])
+async def read_controladores(request: Request, stream: bool = False,
+                             fields: Optional[tuple] = Depends(fields_param(ControladorVoltajeResponse)),
+                             db: AsyncSession = Depends(get_async_db)):
+    if stream:
+        return stream_ndjson(lambda session, size: crud.iter_all_controlador_voltaje(session, size, fields),
+                             fields_model(ControladorVoltajeResponse, fields))
+    return await cached_list_response_async(request, ControladorVoltajeDB.__tablename__, ControladorVoltajeResponse,
+                                            lambda: crud_async.get_all_controlador_voltaje(db, fields), fields)
+
+# Varios controladores (ids=1,2,3) con una sola consulta, por ID; null si no existe
+# Several controllers (ids=1,2,3) with a single query, keyed by ID; null when it does not exist
+@router.get("/controladores/batch", response_model=dict[int, Optional[ControladorVoltajeResponse]], tags=["ControladorVoltaje"])
+async def read_controladores_batch(ids: str, db: AsyncSession = Depends(get_async_db)):
+    try:
+        device_ids = parse_batch_ids(ids)
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return await crud_async.get_controlador_voltaje_by_ids(db, device_ids)
+
+@router.get("/controladores/{id_device}", response_model=ControladorVoltajeResponse, tags=["ControladorVoltaje"])
+async def read_controlador(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    controlador = await crud_async.get_controlador_voltaje_by_id(db, id_device)
+    if controlador is None:
+        raise HTTPException(status_code=404, detail="Controlador not found")
+    return controlador
+
+@router.post("/controladores/", response_model=ControladorVoltajeResponse, status_code=status.HTTP_201_CREATED, tags=["ControladorVoltaje"])
+async def create_controlador(controlador: ControladorVoltaje, db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.create_controlador_voltaje(db, controlador)
+
+@router.put("/controladores/{id_device}", response_model=ControladorVoltajeResponse, tags=["ControladorVoltaje"])
+async def update_controlador(id_device: int, controlador: ControladorVoltaje, db: AsyncSession = Depends(get_async_db)):
+    updated_controlador = await crud_async.update_controlador_voltaje(db, id_device, controlador)
+    if updated_controlador is None:
+        raise HTTPException(status_code=404, detail="Controlador not found")
+    return updated_controlador
+
+@router.delete("/controladores/{id_device}", status_code=status.HTTP_204_NO_CONTENT, tags=["ControladorVoltaje"])
+async def delete_controlador(id_device: int, db: AsyncSession = Depends(get_async_db)):
+    success = await crud_async.delete_controlador_voltaje(db, id_device)
+    if not success:
+        raise HTTPException(status_code=404, detail="Controlador not found")
+    return {"message": "Controlador deleted successfully"}
+
+# Comando en lote: encender/apagar y/o fijar el voltaje de un grupo de controladores en un solo UPDATE
+# Bulk command: switch on/off and/or set the voltage of a group of controllers in a single UPDATE
+@router.post("/controladores/command", response_model=BulkCommandResponse, tags=["ControladorVoltaje"])
+async def command_controladores(command: ControladorVoltajeCommand, db: AsyncSession = Depends(get_async_db)):
+    error = command.command_error()
+    if error is not None:
+        raise HTTPException(status_code=422, detail=error)
+    return {"updated": await crud_async.command_controlador_voltaje(db, command)}
+
+# Registro de cambios desde un cursor (ver main.read_changes)
+# Change log since a cursor (see main.read_changes)
+@router.get("/changes", response_model=ChangesResponse, tags=["Changes"])
+async def read_changes(since: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000),
+                       db: AsyncSession = Depends(get_async_db)):
+    if not change_log.CHANGE_LOG_ENABLED:
+        raise HTTPException(status_code=404, detail="Change log disabled (CHANGE_LOG=0)")
+    if await db.run_sync(change_log.cursor_expired, since):
+        raise HTTPException(status_code=410, detail="Cursor expired, resync from since=0")
+    return await db.run_sync(change_log.get_changes, since, limit)
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Configuración de la caché de metadatos de dispositivos (METADATA_CACHE=0 la desactiva, p. ej. en pruebas)
+# Device metadata cache settings (METADATA_CACHE=0 turns it off, e.g. in tests)
+METADATA_CACHE_ENABLED = os.getenv("METADATA_CACHE", "1").lower() in ("1", "true", "yes")
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "10000"))
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", "30"))
+
+_MISSING = object()
+
+
+# Caché LRU acotada con vencimiento (TTL) para lecturas por ID de DevicesInfo, Luces y ControladorVoltaje.
+# Guarda modelos Pydantic (no objetos ORM, que quedan atados a su sesión) y también los "no encontrado".
+# Las funciones de escritura de crud.py invalidan la clave; el TTL acota lo que puede quedar viejo
+# cuando otro proceso (otro worker de uvicorn) escribe en la misma base.
+# Bounded LRU cache with expiry (TTL) for by-ID reads of DevicesInfo, Luces and ControladorVoltaje.
+# It stores Pydantic models (not ORM objects, which stay bound to their session) and "not found" too.
+# The write functions in crud.py invalidate the key; the TTL bounds staleness when another process
+# (another uvicorn worker) writes to the same database.
+class MetadataCache:
+    def __init__(self, enabled: bool = METADATA_CACHE_ENABLED, maxsize: int = METADATA_CACHE_SIZE,
+                 ttl: float = METADATA_CACHE_TTL):
+        self.enabled = enabled
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Devuelve el valor en caché o lo carga con `loader` y lo guarda
+    # Returns the cached value or loads it with `loader` and stores it
+    def get_or_load(self, key, loader):
+        if not self.enabled:
+            return loader()
+        value = self._get(key)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        self._put(key, value)
+        return value
+
+    # Versión para los getters asíncronos (crud_async)
+    # Version for the async getters (crud_async)
+    async def get_or_load_async(self, key, loader):
+        if not self.enabled:
+            return await loader()
+        value = self._get(key)
+        if value is not _MISSING:
+            return value
+        value = await loader()
+        self._put(key, value)
+        return value
+
+    # Valores de varias claves: las que no están en caché se cargan juntas con `loader(claves)`, que
+    # devuelve {clave: valor}; las claves que no devuelve se guardan como `default` ("no encontrado")
+    # Values of several keys: the ones not cached are loaded together with `loader(keys)`, which
+    # returns {key: value}; the keys it does not return are stored as `default` ("not found")
+    def get_many_or_load(self, keys, loader, default=None) -> dict:
+        if not self.enabled:
+            return self._complete(keys, loader(list(keys)), default)
+        values, missing = self._get_many(keys)
+        if missing:
+            values.update(self._put_many(self._complete(missing, loader(missing), default)))
+        return values
+
+    # Versión para los getters asíncronos (crud_async)
+    # Version for the async getters (crud_async)
+    async def get_many_or_load_async(self, keys, loader, default=None) -> dict:
+        if not self.enabled:
+            return self._complete(keys, await loader(list(keys)), default)
+        values, missing = self._get_many(keys)
+        if missing:
+            values.update(self._put_many(self._complete(missing, await loader(missing), default)))
+        return values
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Quitar todas las claves (tabla, id) de una tabla, tras un cambio en lote sin IDs conocidos
+    # Drop every (table, id) key of a table, after a bulk change without known IDs
+    def invalidate_table(self, table: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Contadores para monitoreo
+    # Counters for monitoring
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _get_many(self, keys):
+        now = time.monotonic()
+        values, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[0] <= now:
+                    self.misses += 1
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values[key] = entry[1]
+        return values, missing
+
+    @staticmethod
+    def _complete(keys, loaded: dict, default) -> dict:
+        return {key: loaded.get(key, default) for key in keys}
+
+    def _put_many(self, values: dict) -> dict:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return values
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+# Instancia global usada por crud.py y crud_async.py
+# Global instance used by crud.py and crud_async.py
+metadata_cache = MetadataCache()
@@ -0,0 +1,121 @@
+# Migración de una base existente (p. ej. mydb.sqlite) al almacenamiento compacto (COMPACT_STORAGE=1):
+# DevicesRecords (y sus particiones mensuales) y TomaDecisiones se reconstruyen con columnas INTEGER/REAL
+# y date_record en milisegundos epoch; los rollups y el estado más reciente se recalculan.
+# Se puede ejecutar más de una vez: las tablas ya convertidas se saltan.
+# Migration of an existing database (e.g. mydb.sqlite) to compact storage (COMPACT_STORAGE=1):
+# DevicesRecords (and its monthly partitions) and TomaDecisiones are rebuilt with INTEGER/REAL columns
+# and date_record in epoch milliseconds; the rollups and the latest state are recomputed.
+# It can be run more than once: tables already converted are skipped.
+#
+# Uso / Usage:
+#   python migrate_compact.py
+import os
+
+# Los modelos deben cargarse con los tipos compactos para crear las tablas nuevas
+# The models must be loaded with the compact types to create the new tables
+os.environ["COMPACT_STORAGE"] = "1"
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+import latest_state
+import partitions
+import rollups
+from database import engine
+from models import Base, DeviceLatestStateDB, DevicesRecordsDB, DevicesRecordsRollupDB, TomaDecisionesDB
+
+# Texto de fecha (Date o fecha/hora) a milisegundos epoch, conservando la fracción de segundo
+# Date text (Date or date-time) to epoch milliseconds, keeping the fraction of a second
+_EPOCH_MILLIS_SQL = "CAST(round((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)"
+
+# Columnas de cada tabla con la expresión que las convierte
+# Columns of each table with the expression that converts them
+_CONVERSIONS = {
+    DevicesRecordsDB: {
+        "id_record": "id_record",
+        "id_device": "CAST(id_device AS INTEGER)",
+        "current_value": "CAST(current_value AS REAL)",
+        "date_record": _EPOCH_MILLIS_SQL.format(column="date_record"),
+    },
+    TomaDecisionesDB: {
+        "id_decision": "id_decision",
+        "velocidad": "CAST(velocidad AS REAL)",
+        "decision": "CAST(decision AS REAL)",
+        "date_record": _EPOCH_MILLIS_SQL.format(column="date_record"),
+    },
+}
+
+
+# La tabla ya es compacta si su columna de fecha es un entero
+# The table is already compact if its date column is an integer
+def _is_compact(connection, table_name: str, date_column: str = "date_record") -> bool:
+    columns = {column["name"]: column for column in inspect(connection).get_columns(table_name)}
+    return "INT" in str(columns[date_column]["type"]).upper()
+
+
+# Renombrar la tabla vieja, crear la nueva con sus índices y copiar las filas convertidas
+# Rename the old table, create the new one with its indexes and copy the converted rows
+def _convert_table(connection, model, conversions: dict) -> int:
+    table_name = model.__tablename__
+    legacy_name = f"{table_name}_legacy"
+    # Los índices viajan con la tabla renombrada; se borran para que la nueva pueda usar los mismos nombres
+    # Indexes follow the renamed table; they are dropped so the new one can reuse the same names
+    index_names = connection.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"),
+        {"table": table_name},
+    ).scalars().all()
+    for index_name in index_names:
+        connection.execute(text(f'DROP INDEX "{index_name}"'))
+    connection.execute(text(f'ALTER TABLE "{table_name}" RENAME TO "{legacy_name}"'))
+    Base.metadata.create_all(bind=connection, tables=[model.__table__])
+    columns = ", ".join(conversions)
+    expressions = ", ".join(conversions.values())
+    copied = connection.execute(
+        text(f'INSERT INTO "{table_name}" ({columns}) SELECT {expressions} FROM "{legacy_name}"')
+    ).rowcount
+    connection.execute(text(f'DROP TABLE "{legacy_name}"'))
+    return copied
+
+
+def migrate():
+    with engine.begin() as connection:
+        existing = set(inspect(connection).get_table_names())
+        # Las particiones mensuales (RECORD_PARTITIONS=1) tienen las mismas columnas que DevicesRecords
+        # Monthly partitions (RECORD_PARTITIONS=1) have the same columns as DevicesRecords
+        conversions_by_model = dict(_CONVERSIONS)
+        for key in partitions.existing_months(Session(bind=connection, join_transaction_mode="create_savepoint")):
+            conversions_by_model[partitions.partition_model(key)] = _CONVERSIONS[DevicesRecordsDB]
+        for model, conversions in conversions_by_model.items():
+            table_name = model.__tablename__
+            if table_name not in existing:
+                print(f"{table_name}: no existe, se creará al iniciar / does not exist, created on startup")
+            elif _is_compact(connection, table_name):
+                print(f"{table_name}: ya es compacta / already compact")
+            else:
+                copied = _convert_table(connection, model, conversions)
+                print(f"{table_name}: {copied} filas convertidas / rows converted")
+
+        # last_date de los rollups y date_record del estado más reciente también cambian de tipo; se recrean
+        # y se recalculan desde DevicesRecords
+        # The rollups' last_date and the latest state's date_record change type too; they are recreated
+        # and recomputed from DevicesRecords
+        derived = (
+            (DevicesRecordsRollupDB, "last_date", rollups.rebuild),
+            (DeviceLatestStateDB, "date_record", latest_state.rebuild),
+        )
+        for model, date_column, rebuild in derived:
+            table_name = model.__tablename__
+            if table_name in existing and not _is_compact(connection, table_name, date_column):
+                connection.execute(text(f'DROP TABLE "{table_name}"'))
+                Base.metadata.create_all(bind=connection, tables=[model.__table__])
+                rebuild(Session(bind=connection, join_transaction_mode="create_savepoint"))
+                print(f"{table_name}: recalculada / recomputed")
+
+    # Recuperar el espacio de las tablas viejas
+    # Reclaim the space of the old tables
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM"))
+
+
+if __name__ == "__main__":
+    migrate()
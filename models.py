@@ -1,8 +1,70 @@
-from sqlalchemy import Column, Integer, String,Float
+from sqlalchemy import BigInteger, Column, DateTime, Integer, LargeBinary, String,Float, Index, TypeDecorator
+from sqlalchemy.orm import declared_attr
 from sqlalchemy.sql.sqltypes import Float as SQLAlchemyFloat, Date,Numeric
 from pydantic import BaseModel
-from database import  Base
-from datetime import datetime
+from database import  Base, COMPACT_STORAGE_ENABLED
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Literal, Optional
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+# Una fecha/hora con zona horaria pasada a UTC sin zona (como se guarda en modo compacto); el resto, tal cual
+# An aware date-time converted to naive UTC (as it is stored in compact mode); anything else as is
+def naive_utc(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Fecha/hora guardada como milisegundos epoch en un INTEGER. Las fechas sin zona horaria se toman
+# como UTC y se devuelven sin zona horaria, igual que llegan desde los modelos Pydantic.
+# Date-time stored as epoch milliseconds in an INTEGER. Naive date-times are taken as UTC and are
+# returned naive, the same way they arrive from the Pydantic models.
+class EpochMillis(TypeDecorator):
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        return (naive_utc(value) - _EPOCH) // timedelta(milliseconds=1)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return _EPOCH + timedelta(milliseconds=value)
+
+
+# Tipos de columna de DevicesRecords/TomaDecisiones según el modo de almacenamiento
+# Column types of DevicesRecords/TomaDecisiones depending on the storage mode
+if COMPACT_STORAGE_ENABLED:
+    RecordIdType, RecordValueType, RecordTimeType = Integer, Float, EpochMillis
+else:
+    RecordIdType, RecordValueType, RecordTimeType = Numeric, Numeric, Date
+
+
+# Valor con el que se compara date_record en los filtros de rango: en modo compacto la fecha/hora
+# completa; con Date solo la fecha, porque comparar contra una fecha/hora no coincide con el texto guardado.
+# Value date_record is compared against in range filters: the full date-time in compact mode;
+# with Date only the date, because comparing against a date-time does not match the stored text.
+def date_record_bound(value: datetime):
+    if COMPACT_STORAGE_ENABLED or not isinstance(value, datetime):
+        return value
+    return value.date()
+
+
+# Valor de date_record tal como queda guardado: solo la fecha con la columna Date,
+# la fecha/hora completa en UTC sin zona en modo compacto
+# date_record value as it ends up stored: only the date with the Date column,
+# the full date-time as naive UTC in compact mode
+def stored_date_value(value):
+    if COMPACT_STORAGE_ENABLED:
+        return naive_utc(value) if isinstance(value, datetime) else datetime(value.year, value.month, value.day)
+    return value.date() if isinstance(value, datetime) else value
 
 
 # Clase de prueba para testing
@@ -34,23 +96,106 @@ class DevicesInfoDB(Base):
     vendor = Column(String, unique=False, index=True,nullable=False)
 
 
+# Columnas de los registros de dispositivos, compartidas por DevicesRecordsDB y sus particiones
+# mensuales (ver partitions.py)
+# Device record columns, shared by DevicesRecordsDB and its monthly partitions (see partitions.py)
+class DevicesRecordsColumns:
+    id_record = Column(Integer, primary_key=True, index=True,nullable=False,unique=True,autoincrement=True)
+    id_device = Column(RecordIdType, primary_key=False, index=False,nullable=False,unique=False,autoincrement=False)
+    current_value = Column(RecordValueType,index=False,unique=False,nullable=False)
+    date_record = Column(RecordTimeType,index=False,unique=False,nullable=False)
+
+    # Índice compuesto para la paginación por keyset y filtros de rango de tiempo por dispositivo
+    # Composite index for keyset pagination and per-device time-range filters
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (
+            Index(f"ix_{cls.__tablename__}_device_date_record", "id_device", "date_record", "id_record"),
+        )
+
+
 # Modelo SQLAlchemy para registros de dispositivos
 # SQLAlchemy model for device records
-class DevicesRecordsDB(Base):
+class DevicesRecordsDB(DevicesRecordsColumns, Base):
     __tablename__ = "DevicesRecords"
-    id_record = Column(Integer, primary_key=True, index=True,nullable=False,unique=True,autoincrement=True)
-    id_device = Column(Numeric, primary_key=False, index=False,nullable=False,unique=False,autoincrement=False)
-    current_value = Column(Numeric,index=False,unique=False,nullable=False)
-    date_record = Column(Date,index=False,unique=False,nullable=False)
+
+# Modelo SQLAlchemy para los rollups de registros por dispositivo y resolución (1m, 1h, 1d)
+# SQLAlchemy model for per-device record rollups by resolution (1m, 1h, 1d)
+class DevicesRecordsRollupDB(Base):
+    __tablename__ = "DevicesRecordsRollup"
+    id_device = Column(Integer, primary_key=True, nullable=False, autoincrement=False)
+    resolution = Column(String, primary_key=True, nullable=False)
+    bucket = Column(String, primary_key=True, nullable=False)  # Prefijo ISO de date_record / ISO prefix of date_record
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    last_value = Column(Float, nullable=False)
+    last_date = Column(RecordTimeType, nullable=False)
+    last_id = Column(Integer, nullable=False)
+
+# Modelo SQLAlchemy para los bloques comprimidos de registros: una hora de lecturas de un dispositivo
+# por fila (ver chunk_store.py)
+# SQLAlchemy model for compressed record chunks: one hour of a device's readings per row
+# (see chunk_store.py)
+class DevicesRecordsChunkDB(Base):
+    __tablename__ = "DevicesRecordsChunk"
+    id_device = Column(Integer, primary_key=True, nullable=False, autoincrement=False)
+    chunk_start = Column(BigInteger, primary_key=True, nullable=False)  # Milisegundos epoch / Epoch milliseconds
+    count = Column(Integer, nullable=False)
+    min_id = Column(Integer, nullable=False)
+    max_id = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    # Búsqueda de un registro archivado por id_record
+    # Lookup of an archived record by id_record
+    __table_args__ = (
+        Index("ix_DevicesRecordsChunk_ids", "min_id", "max_id"),
+    )
+
+# Modelo SQLAlchemy para el último registro de cada dispositivo (ver latest_state.py)
+# SQLAlchemy model for each device's newest record (see latest_state.py)
+class DeviceLatestStateDB(Base):
+    __tablename__ = "DeviceLatestState"
+    id_device = Column(Integer, primary_key=True, nullable=False, autoincrement=False)
+    id_record = Column(Integer, nullable=False)
+    current_value = Column(Float, nullable=False)
+    date_record = Column(RecordTimeType, nullable=False)
+
+# Modelo SQLAlchemy para el registro de cambios de las tablas de metadatos (ver change_log.py). seq es el
+# cursor de los clientes; AUTOINCREMENT evita que SQLite reutilice el seq de una entrada compactada.
+# SQLAlchemy model for the change log of the metadata tables (see change_log.py). seq is the clients'
+# cursor; AUTOINCREMENT keeps SQLite from reusing the seq of a compacted entry.
+class ChangeLogDB(Base):
+    __tablename__ = "ChangeLog"
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String, nullable=False)
+    key = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "upsert" / "delete"
+    changed_at = Column(DateTime, nullable=False)
+
+    # Compactación: la entrada anterior de una fila se busca por (tabla, clave)
+    # Compaction: a row's previous entry is looked up by (table, key)
+    __table_args__ = (
+        Index("ix_ChangeLog_table_key", "table_name", "key"),
+        {"sqlite_autoincrement": True},
+    )
+
+# Mayor seq de las bajas ya compactadas: un cursor anterior puede haberse perdido bajas (una sola fila)
+# Highest seq of the already compacted deletes: an older cursor may have missed deletes (a single row)
+class ChangeLogStateDB(Base):
+    __tablename__ = "ChangeLogState"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    compacted_seq = Column(Integer, nullable=False)
 
 # Modelo SQLAlchemy para toma de decisiones
 # SQLAlchemy model for decision making
 class TomaDecisionesDB(Base):
     __tablename__ = "TomaDecisiones"
     id_decision = Column(Integer, primary_key=True, index=True,nullable=False,unique=True,autoincrement=True)
-    velocidad = Column(Numeric,index=False,unique=False,nullable=False)
-    decision = Column(Numeric,index=False,unique=False,nullable=False)
-    date_record = Column(Date,index=False,unique=False,nullable=False)
+    velocidad = Column(RecordValueType,index=False,unique=False,nullable=False)
+    decision = Column(RecordValueType,index=False,unique=False,nullable=False)
+    date_record = Column(RecordTimeType,index=COMPACT_STORAGE_ENABLED,unique=False,nullable=False)
 
 
 # Modelo Pydantic para solicitudes de información de dispositivos
@@ -113,6 +258,49 @@ class ControladorVoltaje(BaseModel):
     nombre:str
     vendor:str
 
+# Máximo de IDs en un comando en lote (SQLite admite 32766 parámetros por sentencia)
+# Maximum IDs in a bulk command (SQLite allows 32766 parameters per statement)
+MAX_COMMAND_IDS = 10_000
+
+# Grupo de dispositivos de un comando en lote: por IDs, vendor y/o prefijo de nombre (se combinan con AND)
+# Device group of a bulk command: by IDs, vendor and/or name prefix (combined with AND)
+class DeviceGroup(BaseModel):
+    ids: Optional[list[int]] = None
+    vendor: Optional[str] = None
+    nombre_prefix: Optional[str] = None
+
+    # Mensaje del 422 si el comando no es válido; sin filtro cambiaría todos los dispositivos
+    # 422 message if the command is not valid; without a filter it would change every device
+    def command_error(self) -> Optional[str]:
+        if self.ids is None and self.vendor is None and self.nombre_prefix is None:
+            return "at least one of ids, vendor or nombre_prefix is required"
+        if self.ids is not None and len(self.ids) > MAX_COMMAND_IDS:
+            return f"at most {MAX_COMMAND_IDS} ids per command"
+        if self.nombre_prefix == "":
+            return "nombre_prefix must not be empty"
+        return None
+
+# Comando en lote para luces: nuevos lúmenes para todo el grupo
+# Bulk command for lights: new lumens for the whole group
+class LucesCommand(DeviceGroup):
+    lumens: float
+
+# Comando en lote para controladores: encender/apagar y/o fijar el voltaje de todo el grupo
+# Bulk command for controllers: switch on/off and/or set the voltage of the whole group
+class ControladorVoltajeCommand(DeviceGroup):
+    encendido: Optional[bool] = None
+    voltaje: Optional[float] = None
+
+    def command_error(self) -> Optional[str]:
+        if self.encendido is None and self.voltaje is None:
+            return "at least one of encendido or voltaje is required"
+        return super().command_error()
+
+# Respuesta de un comando en lote: cuántos dispositivos cambió
+# Bulk command response: how many devices it changed
+class BulkCommandResponse(BaseModel):
+    updated: int
+
 # Modelo SQLAlchemy para luces
 # SQLAlchemy model for lights
 class LucesDB(Base):
@@ -143,6 +331,58 @@ class DevicesRecordsResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Campos de un registro, en el orden de las tuplas de columnas (ver crud._devices_records_columns)
+# Record fields, in the order of the column tuples (see crud._devices_records_columns)
+RECORD_FIELDS = tuple(DevicesRecordsResponse.model_fields)
+
+# Columnas que traen las tuplas de registros leídas con ?fields=: las pedidas más id_record, siempre
+# la primera, que ordena y combina particiones y bloques archivados
+# Columns carried by record tuples read with ?fields=: the requested ones plus id_record, always
+# first, which orders and merges partitions and archived chunks
+def record_row_fields(fields: tuple) -> tuple:
+    return tuple(name for name in RECORD_FIELDS if name == "id_record" or name in fields)
+
+# Modelo de respuesta para la inserción en lote de registros
+# Response model for batch insertion of records
+class DevicesRecordsBatchResponse(BaseModel):
+    count: int
+    first_id: Optional[int] = None
+    last_id: Optional[int] = None
+
+# Una entrada del registro de cambios: la fila actual en `data` para "upsert", None para "delete"
+# A change log entry: the current row in `data` for "upsert", None for "delete"
+class ChangeEntry(BaseModel):
+    seq: int
+    table: str
+    id: int
+    op: Literal["upsert", "delete"]
+    data: Optional[dict[str, Any]] = None
+
+# Página del registro de cambios; `cursor` es el `since` de la siguiente y `more` indica si quedan más
+# A page of the change log; `cursor` is the next page's `since` and `more` tells whether more are left
+class ChangesResponse(BaseModel):
+    changes: list[ChangeEntry]
+    cursor: int
+    more: bool
+
+# Modelo de respuesta para el borrado de registros por rango
+# Response model for the range delete of records
+class DevicesRecordsDeleteResponse(BaseModel):
+    deleted: int
+
+# Modelo de respuesta para registros agregados por intervalo de tiempo
+# Response model for records aggregated per time bucket
+class DevicesRecordsAggregateResponse(BaseModel):
+    bucket_start: datetime
+    min: float
+    max: float
+    avg: float
+    count: int
+    last: float
+
+    class Config:
+        from_attributes = True
+
 # Modelo de respuesta para toma de decisiones
 # Response model for decision making
 class TomaDecisionesResponse(BaseModel):
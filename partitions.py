@@ -0,0 +1,258 @@
+import argparse
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from itertools import chain
+from operator import attrgetter
+from typing import Optional
+
+from sqlalchemy import Float, delete, event, func, insert, inspect, select, type_coerce
+from sqlalchemy.orm import Session, declarative_base
+
+from models import Base, DevicesRecordsColumns, DevicesRecordsDB, date_record_bound, stored_date_value
+
+# Particiones mensuales de registros (RECORD_PARTITIONS=1): cada mes vive en su propia tabla
+# DevicesRecords_AAAA_MM con las mismas columnas e índices. Las escrituras de crud.py van a la tabla del
+# mes de date_record y las lecturas solo consultan las particiones que se solapan con el rango pedido.
+# La retención borra o archiva meses completos con DROP TABLE, sin DELETE fila por fila.
+# Las filas de DevicesRecords anteriores se mueven una vez con `python partitions.py migrate`.
+# Monthly record partitions (RECORD_PARTITIONS=1): each month lives in its own DevicesRecords_YYYY_MM
+# table with the same columns and indexes. Writes in crud.py go to the table of the date_record's month
+# and reads only query the partitions overlapping the requested range. Retention drops or archives
+# whole months with DROP TABLE, without row-by-row DELETEs. Existing DevicesRecords rows are moved
+# once with `python partitions.py migrate`.
+RECORD_PARTITIONS_ENABLED = os.getenv("RECORD_PARTITIONS", "0").lower() in ("1", "true", "yes")
+
+_TABLE_PATTERN = re.compile(rf"^{DevicesRecordsDB.__tablename__}_(\d{{4}})_(\d{{2}})$")
+
+# Modelos ORM de cada partición ya definidos en este proceso
+# ORM models of each partition already defined in this process
+_models = {}
+_lock = threading.Lock()
+
+# Meses con partición por motor, junto con el PRAGMA schema_version con el que se leyeron. Cualquier
+# CREATE/DROP TABLE (de este u otro proceso) cambia ese número, así que cada lectura hace un PRAGMA en
+# lugar de reflejar el esquema.
+# Partitioned months per engine, together with the PRAGMA schema_version they were read at. Any
+# CREATE/DROP TABLE (from this or another process) changes that number, so each read runs a PRAGMA
+# instead of reflecting the schema.
+_months = {}
+
+# Clave de Session.info que marca una partición creada en la transacción en curso
+# Session.info key marking a partition created in the current transaction
+_CREATED_IN_TRANSACTION = "partitions_created"
+
+# Las particiones tienen su propio MetaData para que Base.metadata.create_all no vuelva a crear meses borrados
+# Partitions have their own MetaData so Base.metadata.create_all does not re-create dropped months
+PartitionBase = declarative_base()
+
+
+# Mes (AAAA_MM) en el que queda guardado un date_record; una fecha/hora con zona va al mes de su valor UTC
+# Month (YYYY_MM) a date_record is stored in; an aware date-time goes to the month of its UTC value
+def month_key(value) -> str:
+    value = stored_date_value(value)
+    return f"{value.year:04d}_{value.month:02d}"
+
+
+# Inicio del mes y del mes siguiente
+# Start of the month and of the next month
+def month_bounds(key: str) -> tuple[datetime, datetime]:
+    year, month = int(key[:4]), int(key[5:])
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+# Modelo ORM de la partición de un mes (se define la primera vez que se pide)
+# ORM model of a month's partition (defined the first time it is requested)
+def partition_model(key: str):
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                table_name = f"{DevicesRecordsDB.__tablename__}_{key}"
+                model = type(f"DevicesRecordsDB_{key}", (DevicesRecordsColumns, PartitionBase), {"__tablename__": table_name})
+                _models[key] = model
+    return model
+
+
+# Meses con partición en la base, en orden. Lo leído después de crear una partición en una transacción
+# todavía abierta no se guarda: si se deshace, el esquema vuelve a un schema_version ya usado.
+# Months that have a partition in the database, in order. What is read after creating a partition in a
+# still open transaction is not cached: if it is rolled back, the schema returns to a used schema_version.
+def existing_months(db: Session) -> list[str]:
+    connection = db.connection()
+    version = connection.exec_driver_sql("PRAGMA schema_version").scalar()
+    cached = _months.get(connection.engine)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    months = sorted(
+        f"{match.group(1)}_{match.group(2)}"
+        for match in map(_TABLE_PATTERN.match, inspect(connection).get_table_names()) if match
+    )
+    if not db.info.get(_CREATED_IN_TRANSACTION):
+        _months[connection.engine] = (version, months)
+    return months
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _transaction_ended(session: Session):
+    session.info.pop(_CREATED_IN_TRANSACTION, None)
+
+
+# Fecha/hora con la que se compara un límite de rango contra los meses (la del valor tal como se guarda)
+# Date-time a range bound is compared with against the months (the one of the value as stored)
+def _month_bound(value) -> datetime:
+    value = stored_date_value(value)
+    return value if isinstance(value, datetime) else datetime(value.year, value.month, value.day)
+
+
+# Modelos que guardan registros en el rango [since, until], en orden de tiempo. Sin particiones es solo
+# DevicesRecordsDB; con ellas, las particiones cuyo mes se solapa con el rango.
+# Models holding records in the [since, until] range, in time order. Without partitions it is just
+# DevicesRecordsDB; with them, the partitions whose month overlaps the range.
+def record_models(db: Session, since: Optional[datetime] = None, until: Optional[datetime] = None) -> list:
+    if not RECORD_PARTITIONS_ENABLED:
+        return [DevicesRecordsDB]
+    since = _month_bound(since) if since is not None else None
+    until = _month_bound(until) if until is not None else None
+    models = []
+    for key in existing_months(db):
+        start, end = month_bounds(key)
+        if (until is None or start <= until) and (since is None or end > since):
+            models.append(partition_model(key))
+    return models
+
+
+# Modelo en el que se escribe un registro con ese date_record; crea la partición del mes si falta
+# Model a record with that date_record is written to; creates the month's partition if missing
+def model_for(db: Session, date_record):
+    if not RECORD_PARTITIONS_ENABLED:
+        return DevicesRecordsDB
+    key = month_key(date_record)
+    model = partition_model(key)
+    if key not in existing_months(db):
+        model.__table__.create(db.connection(), checkfirst=True)
+        db.info[_CREATED_IN_TRANSACTION] = True
+    return model
+
+
+# Agrupar filas (dicts con date_record) por el modelo en el que se escriben
+# Group rows (dicts with date_record) by the model they are written to
+def group_by_model(db: Session, rows: list[dict]) -> list[tuple]:
+    if not RECORD_PARTITIONS_ENABLED:
+        return [(DevicesRecordsDB, rows)]
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_key(row["date_record"]), []).append(row)
+    return [(model_for(db, month_rows[0]["date_record"]), month_rows) for month_rows in by_month.values()]
+
+
+# Unir en orden de id_record los resultados leídos de cada modelo
+# Merge in id_record order the results read from each model
+def merge_by_id(results: list[list]) -> list:
+    if len(results) == 1:
+        return results[0]
+    return sorted(chain.from_iterable(results), key=attrgetter("id_record"))
+
+
+# Todas las particiones que terminan antes de `before`
+# Every partition that ends before `before`
+def expired_months(db: Session, before: datetime) -> list[str]:
+    return [key for key in existing_months(db) if month_bounds(key)[1] <= _month_bound(before)]
+
+
+# Filas de una partición como tuplas (id_record, id_device, current_value, date_record), por lotes
+# A partition's rows as (id_record, id_device, current_value, date_record) tuples, in batches
+def _iter_batches(db: Session, model, batch_size: int):
+    query = select(
+        model.id_record, model.id_device, type_coerce(model.current_value, Float), model.date_record,
+    ).order_by(model.id_record)
+    yield from db.execute(query, execution_options={"yield_per": batch_size}).partitions()
+
+
+# Retención: archivar (opcional) y borrar las particiones de meses que terminan antes de `before`.
+# Cada mes es un DROP TABLE; los rollups de esos meses se conservan. Con CHUNKED_STORAGE=1 también
+# se borran los bloques comprimidos anteriores a `before`.
+# Retention: archive (optionally) and drop the partitions of months ending before `before`.
+# Each month is one DROP TABLE; the rollups of those months are kept. With CHUNKED_STORAGE=1 the
+# compressed chunks before `before` are deleted too.
+def drop_before(db: Session, before: datetime, archive_dir: Optional[str] = None) -> list[str]:
+    # Importados aquí porque ambos dependen de crud/rollups, que a su vez usan este módulo
+    # Imported here because both depend on crud/rollups, which in turn use this module
+    import chunk_store
+    import export
+
+    dropped = []
+    for key in expired_months(db, before):
+        model = partition_model(key)
+        if archive_dir is not None:
+            export.write_parquet_file(_iter_batches(db, model, export.EXPORT_BATCH_SIZE),
+                                      os.path.join(archive_dir, f"{model.__tablename__}.parquet"))
+        model.__table__.drop(db.connection())
+        dropped.append(key)
+    chunk_store.drop_before(db, before)
+    db.commit()
+    return dropped
+
+
+# Mover las filas de DevicesRecords a sus particiones mensuales (una sola vez, al activar RECORD_PARTITIONS)
+# Move the DevicesRecords rows into their monthly partitions (once, when enabling RECORD_PARTITIONS)
+def migrate(db: Session) -> dict:
+    moved = {}
+    dates = db.execute(select(func.min(DevicesRecordsDB.date_record), func.max(DevicesRecordsDB.date_record))).one()
+    if dates[0] is None:
+        return moved
+    key = month_key(dates[0])
+    while key <= month_key(dates[1]):
+        start, end = month_bounds(key)
+        model = partition_model(key)
+        in_month = (DevicesRecordsDB.date_record >= date_record_bound(start),
+                    DevicesRecordsDB.date_record < date_record_bound(end))
+        if db.scalar(select(func.count()).select_from(DevicesRecordsDB).where(*in_month)):
+            model.__table__.create(db.connection(), checkfirst=True)
+            columns = [column.name for column in DevicesRecordsDB.__table__.columns]
+            moved[key] = db.execute(insert(model).from_select(
+                columns, select(*DevicesRecordsDB.__table__.columns).where(*in_month)
+            )).rowcount
+        key = month_key(end)
+    db.execute(delete(DevicesRecordsDB))
+    db.commit()
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particiones mensuales de registros / Monthly record partitions")
+    parser.add_argument("command", choices=["list", "migrate", "retain"])
+    parser.add_argument("--keep-months", type=int, default=12,
+                        help="Meses completos a conservar además del actual / Full months to keep besides the current one")
+    parser.add_argument("--archive-dir", help="Archivar cada mes como Parquet antes de borrarlo / "
+                                              "Archive each month as Parquet before dropping it")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        if args.command == "list":
+            for key in existing_months(session):
+                count = session.query(partition_model(key)).count()
+                print(f"{partition_model(key).__tablename__}: {count} registros / records")
+        elif args.command == "migrate":
+            for key, count in migrate(session).items():
+                print(f"{partition_model(key).__tablename__}: {count} registros movidos / records moved")
+        else:
+            now = datetime.now(timezone.utc)
+            months = now.year * 12 + now.month - 1 - args.keep_months
+            before = datetime(months // 12, months % 12 + 1, 1)
+            if args.archive_dir:
+                os.makedirs(args.archive_dir, exist_ok=True)
+            dropped = drop_before(session, before, args.archive_dir)
+            print(f"Particiones borradas / Partitions dropped (antes de / before {before:%Y-%m}): "
+                  f"{', '.join(dropped) or '-'}")
+    finally:
+        session.close()
@@ -0,0 +1,79 @@
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException, Query, Response
+from pydantic import ConfigDict, TypeAdapter, create_model
+
+
+# Interpretar ?fields=a,b como los campos del modelo de respuesta a devolver, en el orden del modelo
+# (None = todos). ValueError si la lista está vacía o nombra un campo que el modelo no tiene.
+# Parse ?fields=a,b as the response model fields to return, in the model's order
+# (None = all of them). ValueError if the list is empty or names a field the model does not have.
+def parse_fields(fields: Optional[str], response_model) -> Optional[tuple[str, ...]]:
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    if not requested:
+        raise ValueError("fields must list at least one field")
+    unknown = requested - set(response_model.model_fields)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}; "
+                         f"available: {', '.join(response_model.model_fields)}")
+    return tuple(name for name in response_model.model_fields if name in requested)
+
+
+# Dependencia de FastAPI para el parámetro ?fields= de un endpoint que responde con `response_model`;
+# un campo desconocido es un 422
+# FastAPI dependency for the ?fields= parameter of an endpoint that responds with `response_model`;
+# an unknown field is a 422
+def fields_param(response_model):
+    def dependency(fields: Optional[str] = Query(
+            None, description=f"Campos a devolver / Fields to return: {','.join(response_model.model_fields)}")):
+        try:
+            return parse_fields(fields, response_model)
+        except ValueError as error:
+            raise HTTPException(status_code=422, detail=str(error))
+    return dependency
+
+
+# Modelo de respuesta con solo los campos pedidos (mismos tipos, así la salida es la misma que la del
+# modelo completo); se crea una vez por combinación de campos
+# Response model with only the requested fields (same types, so the output matches the full
+# model's); created once per field combination
+@lru_cache(maxsize=256)
+def projected_model(response_model, fields: tuple[str, ...]):
+    return create_model(
+        f"{response_model.__name__}_{'_'.join(fields)}",
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (response_model.model_fields[name].annotation, ...) for name in fields},
+    )
+
+
+# El modelo completo si no se pidieron campos, o su proyección
+# The full model if no fields were requested, or its projection
+def fields_model(response_model, fields: Optional[tuple[str, ...]]):
+    return response_model if fields is None else projected_model(response_model, fields)
+
+
+@lru_cache(maxsize=256)
+def _list_adapter(model):
+    return TypeAdapter(list[model])
+
+
+# Bytes JSON de una lista de filas (objetos ORM o filas de columnas) con solo los campos pedidos
+# JSON bytes of a list of rows (ORM objects or column rows) with only the requested fields
+def serialize_fields(response_model, fields: tuple[str, ...], rows) -> bytes:
+    adapter = _list_adapter(projected_model(response_model, fields))
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+
+# Respuesta JSON con solo los campos pedidos; reemplaza a response_model, que exigiría todos los campos
+# JSON response with only the requested fields; replaces response_model, which would require every field
+def projected_response(response_model, fields: tuple[str, ...], rows) -> Response:
+    return Response(content=serialize_fields(response_model, fields, rows), media_type="application/json")
+
+
+# Columnas de `model` para los campos pedidos (todos los campos de respuesta son columnas de la tabla)
+# Columns of `model` for the requested fields (every response field is a column of the table)
+def field_columns(model, fields: tuple[str, ...]) -> list:
+    return [getattr(model, name) for name in fields]
@@ -0,0 +1,290 @@
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from typing import Optional
+
+from models import date_record_bound, stored_date_value
+
+# Configuración de la caché de registros recientes por dispositivo (RECENT_CACHE=1 la activa)
+# Per-device recent record cache settings (RECENT_CACHE=1 turns it on)
+RECENT_CACHE_ENABLED = os.getenv("RECENT_CACHE", "0").lower() in ("1", "true", "yes")
+RECENT_CACHE_DEPTH = int(os.getenv("RECENT_CACHE_DEPTH", "1000"))
+RECENT_CACHE_MAX_RECORDS = int(os.getenv("RECENT_CACHE_MAX_RECORDS", "1000000"))
+RECENT_CACHE_TTL = float(os.getenv("RECENT_CACHE_TTL", "30"))
+
+RecentRecord = namedtuple("RecentRecord", ["id_record", "id_device", "current_value", "date_record"])
+
+_INFINITE_ID = float("inf")
+
+
+# Registros más recientes de un dispositivo en orden de (date_record, id_record). Si `complete` es falso
+# la ventana empieza en keys[0]: todo registro del dispositivo con clave >= keys[0] está en la ventana.
+# A device's newest records in (date_record, id_record) order. If `complete` is false the window
+# starts at keys[0]: every record of the device with key >= keys[0] is in the window.
+class _Window:
+    __slots__ = ("records", "keys", "ids", "complete", "expires")
+
+    def __init__(self, records: list, complete: bool, expires: float):
+        self.records = records
+        self.keys = [(record.date_record, record.id_record) for record in records]
+        self.ids = {record.id_record: key for record, key in zip(records, self.keys)}
+        self.complete = complete
+        self.expires = expires
+
+    def add(self, record: RecentRecord, depth: int) -> int:
+        key = (record.date_record, record.id_record)
+        # Un registro más viejo que la ventana no cambia lo que la ventana cubre
+        # A record older than the window does not change what the window covers
+        if not self.complete and key < self.keys[0]:
+            return 0
+        # Una ventana cargada justo después del commit ya puede tener el registro
+        # A window loaded right after the commit may already hold the record
+        if record.id_record in self.ids:
+            return 0
+        position = bisect_left(self.keys, key)
+        self.keys.insert(position, key)
+        self.records.insert(position, record)
+        self.ids[record.id_record] = key
+        return 1 - self.trim(depth)
+
+    def trim(self, depth: int) -> int:
+        excess = len(self.records) - depth
+        if excess <= 0:
+            return 0
+        for record in self.records[:excess]:
+            self.ids.pop(record.id_record, None)
+        del self.records[:excess]
+        del self.keys[:excess]
+        self.complete = False
+        return excess
+
+    # Registros de la ventana que responden a la consulta, o None si la ventana no la cubre
+    # The window's records that answer the query, or None if the window does not cover it
+    def select(self, since, until, after_id: Optional[int], limit: Optional[int], last: Optional[int]):
+        start, end = 0, len(self.keys)
+        # La consulta cubre todo lo que empieza en `lower`; la ventana la cubre si lower >= keys[0]
+        # The query covers everything starting at `lower`; the window covers it if lower >= keys[0]
+        covered = self.complete
+        if since is not None:
+            start = bisect_left(self.keys, (since,))
+            covered = covered or (bool(self.keys) and since > self.keys[0][0])
+        if after_id is not None:
+            after = self.ids.get(after_id)
+            if after is None:
+                return None
+            start = max(start, bisect_right(self.keys, after))
+            covered = covered or after >= self.keys[0]
+        if until is not None:
+            end = bisect_right(self.keys, (until, _INFINITE_ID))
+        matching = self.records[start:end]
+        if last is not None:
+            # Los registros fuera de la ventana son más viejos que todos los de adentro
+            # Records outside the window are older than every record inside it
+            if covered or len(matching) >= last:
+                return matching[-last:]
+            return None
+        if not covered:
+            return None
+        return matching[:limit] if limit is not None else matching
+
+
+# Caché en memoria de los registros más recientes de cada dispositivo (un buffer circular por
+# dispositivo de `depth` registros), para las consultas de "los últimos N" o "los últimos 15 minutos".
+# Una ventana se carga de la base la primera vez que se lee el dispositivo y después la alimentan
+# las escrituras de crud.py; las actualizaciones y borrados la descartan. El total de registros está
+# acotado por `max_records`: se desalojan los dispositivos usados hace más tiempo. El TTL acota lo
+# que puede quedar viejo cuando otro proceso escribe en la misma base.
+# In-memory cache of each device's newest records (one `depth`-record ring buffer per device), for
+# "last N" or "last 15 minutes" queries. A window is loaded from the database the first time the
+# device is read and is then fed by the writes in crud.py; updates and deletes discard it. The total
+# record count is bounded by `max_records`: the least recently used devices are evicted. The TTL
+# bounds staleness when another process writes to the same database.
+class RecentRecordCache:
+    def __init__(self, enabled: bool = RECENT_CACHE_ENABLED, depth: int = RECENT_CACHE_DEPTH,
+                 max_records: int = RECENT_CACHE_MAX_RECORDS, ttl: float = RECENT_CACHE_TTL):
+        self.enabled = enabled
+        self.depth = depth
+        self.max_records = max_records
+        self.ttl = ttl
+        self._windows = OrderedDict()
+        self._size = 0
+        # Cargas en curso por dispositivo: [cargas, hubo escrituras mientras tanto]
+        # Loads in progress per device: [loads, writes happened meanwhile]
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    # Responde desde la ventana del dispositivo (cargándola con `loader` si falta) o devuelve None
+    # para que la consulta vaya a la base
+    # Answers from the device's window (loading it with `loader` if missing) or returns None so the
+    # query goes to the database
+    def read(self, id_device: int, loader, since=None, until=None, after_id: Optional[int] = None,
+             limit: Optional[int] = None, last: Optional[int] = None) -> Optional[list]:
+        if not self.enabled:
+            return None
+        query = (_bound(since), _bound(until), after_id, limit, last)
+        result = self._select(id_device, query)
+        if result is _NOT_LOADED:
+            self._begin_load(id_device)
+            records = None
+            try:
+                records = loader()
+            finally:
+                result = self._finish_load(id_device, records, query)
+        return self._count(result)
+
+    # Versión para crud_async
+    # Version for crud_async
+    async def read_async(self, id_device: int, loader, since=None, until=None, after_id: Optional[int] = None,
+                         limit: Optional[int] = None, last: Optional[int] = None) -> Optional[list]:
+        if not self.enabled:
+            return None
+        query = (_bound(since), _bound(until), after_id, limit, last)
+        result = self._select(id_device, query)
+        if result is _NOT_LOADED:
+            self._begin_load(id_device)
+            records = None
+            try:
+                records = await loader()
+            finally:
+                result = self._finish_load(id_device, records, query)
+        return self._count(result)
+
+    # Agregar registros recién confirmados a las ventanas ya cargadas
+    # Add freshly committed records to the windows already loaded
+    def records_written(self, rows):
+        if not self.enabled:
+            return
+        with self._lock:
+            for row in rows:
+                id_device = int(row.id_device)
+                self._mark_stale(id_device)
+                window = self._windows.get(id_device)
+                if window is not None:
+                    self._size += window.add(_to_recent(row), self.depth)
+
+    # Descartar las ventanas de dispositivos con registros actualizados o borrados
+    # Discard the windows of devices with updated or deleted records
+    def invalidate(self, id_devices):
+        with self._lock:
+            for id_device in id_devices:
+                self._mark_stale(int(id_device))
+                window = self._windows.pop(int(id_device), None)
+                if window is not None:
+                    self._size -= len(window.records)
+
+    # Descartar todas las ventanas (borrados que pueden tocar cualquier dispositivo)
+    # Discard every window (deletes that may touch any device)
+    def clear(self):
+        with self._lock:
+            for loading in self._loading.values():
+                loading[1] = True
+            self._windows.clear()
+            self._size = 0
+
+    # Contadores para monitoreo
+    # Counters for monitoring
+    def stats(self) -> dict:
+        with self._lock:
+            devices, size = len(self._windows), self._size
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "devices": devices,
+            "records": size,
+            "depth": self.depth,
+            "max_records": self.max_records,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _select(self, id_device: int, query):
+        with self._lock:
+            window = self._windows.get(id_device)
+            if window is None or window.expires <= time.monotonic():
+                return _NOT_LOADED
+            self._windows.move_to_end(id_device)
+            return window.select(*query)
+
+    def _begin_load(self, id_device: int):
+        with self._lock:
+            self._loading.setdefault(id_device, [0, False])[0] += 1
+
+    def _mark_stale(self, id_device: int):
+        loading = self._loading.get(id_device)
+        if loading is not None:
+            loading[1] = True
+
+    # Responder con la ventana recién leída y guardarla, salvo que una escritura del mismo dispositivo
+    # haya llegado durante la lectura (la ventana podría no incluirla): entonces solo responde esta consulta
+    # Answer with the freshly read window and store it, unless a write to the same device arrived during
+    # the read (the window might not include it): then it only answers this query
+    def _finish_load(self, id_device: int, records: Optional[list], query):
+        with self._lock:
+            loading = self._loading[id_device]
+            loading[0] -= 1
+            if loading[0] == 0:
+                del self._loading[id_device]
+        if records is None:
+            return None
+        records = [_to_recent(record) for record in records]
+        # El loader pide `depth` registros: si llegan menos, la ventana tiene toda la historia
+        # The loader asks for `depth` records: if fewer arrive, the window holds the whole history
+        window = _Window(records, len(records) < self.depth, time.monotonic() + self.ttl)
+        result = window.select(*query)
+        if loading[1]:
+            return result
+        with self._lock:
+            self.loads += 1
+            previous = self._windows.pop(id_device, None)
+            if previous is not None:
+                self._size -= len(previous.records)
+            self._windows[id_device] = window
+            self._size += len(records)
+            while self._size > self.max_records and len(self._windows) > 1:
+                _, evicted = self._windows.popitem(last=False)
+                self._size -= len(evicted.records)
+                self.evictions += 1
+        return result
+
+    def _count(self, result):
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+
+_NOT_LOADED = object()
+
+
+# Fechas con zona horaria a UTC sin zona, como las guarda EpochMillis, para poder compararlas
+# Time zone aware date-times to naive UTC, the way EpochMillis stores them, so they can be compared
+def _naive(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _bound(value):
+    return _naive(date_record_bound(value)) if value is not None else None
+
+
+def _to_recent(record) -> RecentRecord:
+    return RecentRecord(int(record.id_record), int(record.id_device), float(record.current_value),
+                        _naive(stored_date_value(record.date_record)))
+
+
+# Instancia global usada por crud.py y crud_async.py
+# Global instance used by crud.py and crud_async.py
+recent_cache = RecentRecordCache()
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from typing import Iterable, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from models import DevicesRecordsResponse, stored_date_value
+
+# Mensajes pendientes por suscriptor; al llenarse se descartan los más viejos
+# Pending messages per subscriber; when full the oldest ones are dropped
+RECORD_STREAM_QUEUE_SIZE = int(os.getenv("RECORD_STREAM_QUEUE_SIZE", "1000"))
+# Segundos sin mensajes antes de enviar un comentario de keep-alive por SSE
+# Seconds without messages before an SSE keep-alive comment is sent
+SSE_HEARTBEAT_SECONDS = 15
+
+
+# Suscripción a los registros nuevos de un conjunto de dispositivos (o de todos, con device_ids=None).
+# La cola es acotada: un cliente lento pierde sus mensajes más viejos en lugar de frenar la ingesta.
+# Subscription to the new records of a set of devices (or all of them, with device_ids=None).
+# The queue is bounded: a slow client loses its oldest messages instead of stalling ingestion.
+class Subscription:
+    def __init__(self, broker: "RecordBroker", device_ids: Optional[set[int]], maxsize: int):
+        self.broker = broker
+        self.device_ids = device_ids
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = deque()
+        self._event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._notified = False
+
+    # Espera y devuelve todos los mensajes pendientes (JSON ya serializado)
+    # Waits for and returns every pending message (already serialized JSON)
+    async def get(self) -> list[str]:
+        await self._event.wait()
+        with self.broker._lock:
+            messages = list(self._queue)
+            self._queue.clear()
+            self._event.clear()
+            self._notified = False
+        return messages
+
+    def _push(self, message: str) -> bool:
+        if len(self._queue) >= self.maxsize:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(message)
+        if self._notified:
+            return False
+        self._notified = True
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.broker.unsubscribe(self)
+
+
+# Pub/sub en proceso para los registros de dispositivos. crud.py publica después de cada commit
+# (desde el hilo que sea); cada registro se serializa una sola vez y se reparte a las colas de los
+# suscriptores, despertándolos con una sola llamada al event loop por publicación.
+# In-process pub/sub for device records. crud.py publishes after every commit (from any thread);
+# each record is serialized once and fanned out to the subscribers' queues, waking them with a
+# single call into the event loop per publish.
+class RecordBroker:
+    def __init__(self, queue_size: int = RECORD_STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._all = set()
+        self._by_device = {}
+        self.published = 0
+
+    # Debe llamarse desde el event loop que va a consumir la suscripción
+    # Must be called from the event loop that will consume the subscription
+    def subscribe(self, device_ids: Optional[Iterable[int]] = None) -> Subscription:
+        device_ids = set(device_ids) if device_ids is not None else None
+        subscription = Subscription(self, device_ids, self.queue_size)
+        with self._lock:
+            if device_ids is None:
+                self._all.add(subscription)
+            else:
+                for id_device in device_ids:
+                    self._by_device.setdefault(id_device, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription.device_ids is None:
+                self._all.discard(subscription)
+                return
+            for id_device in subscription.device_ids:
+                subscribers = self._by_device.get(id_device)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_device[id_device]
+
+    # Publicar registros ya confirmados (objetos ORM o modelos Pydantic). La fecha se envía como quedó
+    # guardada, igual que la devuelven las lecturas, y no como la mandó el cliente.
+    # Publish already committed records (ORM objects or Pydantic models). The date is sent as it was
+    # stored, the same way reads return it, and not as the client sent it.
+    def publish(self, records: Iterable):
+        if not self._all and not self._by_device:
+            return
+        wake = {}
+        with self._lock:
+            for record in records:
+                subscribers = self._by_device.get(int(record.id_device))
+                if not self._all and not subscribers:
+                    continue
+                message = DevicesRecordsResponse(
+                    id_record=record.id_record, id_device=record.id_device, current_value=record.current_value,
+                    date_record=stored_date_value(record.date_record),
+                ).model_dump_json()
+                self.published += 1
+                for subscription in self._all.union(subscribers) if subscribers else self._all:
+                    if subscription._push(message):
+                        wake.setdefault(subscription._loop, []).append(subscription._event)
+        for loop, events in wake.items():
+            try:
+                loop.call_soon_threadsafe(_set_events, events)
+            except RuntimeError:
+                # El event loop ya se cerró (apagado del servidor)
+                # The event loop is already closed (server shutdown)
+                pass
+
+    # Contadores para monitoreo
+    # Counters for monitoring
+    def stats(self) -> dict:
+        with self._lock:
+            subscriptions = set(self._all)
+            for subscribers in self._by_device.values():
+                subscriptions |= subscribers
+        return {
+            "subscribers": len(subscriptions),
+            "published": self.published,
+            "dropped": sum(subscription.dropped for subscription in subscriptions),
+        }
+
+
+def _set_events(events):
+    for event in events:
+        event.set()
+
+
+# Instancia global usada por crud.py y por los endpoints de suscripción
+# Global instance used by crud.py and by the subscription endpoints
+record_broker = RecordBroker()
+
+
+# Respuesta Server-Sent Events con los registros nuevos; un evento "dropped" avisa si se perdieron mensajes
+# Server-Sent Events response with the new records; a "dropped" event reports lost messages
+def sse_response(device_ids: Optional[set[int]]):
+    async def eventos():
+        with record_broker.subscribe(device_ids) as subscription:
+            dropped = 0
+            while True:
+                try:
+                    messages = await asyncio.wait_for(subscription.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                chunk = "".join(f"data: {message}\n\n" for message in messages)
+                if subscription.dropped != dropped:
+                    dropped = subscription.dropped
+                    chunk = f"event: dropped\ndata: {json.dumps({'dropped': dropped})}\n\n" + chunk
+                yield chunk
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# Enviar los registros nuevos por un WebSocket ya aceptado hasta que el cliente se desconecte.
+# La desconexión se escucha en paralelo para soltar la suscripción aunque no lleguen registros.
+# Send the new records over an accepted WebSocket until the client disconnects.
+# Disconnection is listened for concurrently so the subscription is released even with no records.
+async def serve_websocket(websocket: WebSocket, device_ids: Optional[set[int]]):
+    with record_broker.subscribe(device_ids) as subscription:
+        disconnected = asyncio.ensure_future(_wait_disconnect(websocket))
+        dropped = 0
+        try:
+            while True:
+                pending = asyncio.ensure_future(subscription.get())
+                await asyncio.wait({pending, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    pending.cancel()
+                    return
+                messages = pending.result()
+                if subscription.dropped != dropped:
+                    dropped = subscription.dropped
+                    await websocket.send_text(json.dumps({"dropped": dropped}))
+                for message in messages:
+                    await websocket.send_text(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            disconnected.cancel()
+
+
+async def _wait_disconnect(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+import time
+
+from fastapi import Request, Response, status
+from pydantic import TypeAdapter
+
+from projection import projected_response, serialize_fields
+
+# RESPONSE_CACHE=0 desactiva la caché de respuestas serializadas y los ETag de los listados
+# RESPONSE_CACHE=0 turns off the serialized response cache and the list ETags
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1").lower() in ("1", "true", "yes")
+# Segundos que vive un listado en caché aunque su versión no cambie: acota lo que puede quedar viejo
+# cuando otro proceso (otro worker de uvicorn) escribe en la misma base, como en metadata_cache
+# Seconds a cached list lives even if its version does not change: bounds staleness when another
+# process (another uvicorn worker) writes to the same database, as in metadata_cache
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+
+
+# Contador de versión por tabla, incrementado por las funciones de escritura de crud.py.
+# Es por proceso: con varios workers cada uno solo ve sus propias escrituras, y las de los demás
+# llegan al vencer el TTL.
+# Per-table version counter, bumped by the write functions in crud.py.
+# It is per process: with several workers each one only sees its own writes, and the others'
+# arrive when the TTL runs out.
+class TableVersions:
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def bump(self, table: str):
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get(self, table: str) -> int:
+        return self._versions.get(table, 0)
+
+
+# Instancia global usada por crud.py, crud_async.py y los endpoints de listado
+# Global instance used by crud.py, crud_async.py and the list endpoints
+table_versions = TableVersions()
+
+# Último listado de cada tabla (y de cada proyección ?fields=):
+# {tabla o (tabla, campos): (versión, vence, etag, bytes)}
+# Last list of each table (and of each ?fields= projection):
+# {table or (table, fields): (version, expires, etag, bytes)}
+_bodies = {}
+_adapters = {}
+
+
+# El ETag sale del contenido, así que es el mismo en todos los workers y tras un reinicio, y cambia
+# solo si cambian los bytes. Cada proyección da otros bytes y por lo tanto su propio ETag.
+# The ETag comes from the content, so it is the same on every worker and after a restart, and it
+# changes only when the bytes do. Each projection gives other bytes and therefore its own ETag.
+def _etag(table: str, body: bytes) -> str:
+    return f'"{table}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+
+def _serialize(response_model, rows, fields=None) -> bytes:
+    if fields is not None:
+        return serialize_fields(response_model, fields, rows)
+    adapter = _adapters.get(response_model)
+    if adapter is None:
+        adapter = _adapters[response_model] = TypeAdapter(list[response_model])
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+
+# Entrada en caché de esa versión que todavía no venció, o None
+# Cached entry for that version that has not expired yet, or None
+def _fresh(key, version: int):
+    cached = _bodies.get(key)
+    if cached is None or cached[0] != version or cached[1] <= time.monotonic():
+        return None
+    return cached
+
+
+def _store(key, table: str, version: int, body: bytes):
+    cached = (version, time.monotonic() + RESPONSE_CACHE_TTL, _etag(table, body), body)
+    _bodies[key] = cached
+    return cached
+
+
+def _respond(request: Request, cached) -> Response:
+    _, _, etag, body = cached
+    if _not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+# Mientras la versión de la tabla no cambie y no venza el TTL se responden los bytes en caché, o 304
+# sin tocar la base si el ETag del cliente coincide. Si no, se consulta y serializa una sola vez.
+# Con `fields` (ver projection.py) solo se serializan esos campos.
+# While the table's version does not change and the TTL has not run out, the cached bytes are
+# returned, or 304 without touching the database if the client's ETag matches. Otherwise it queries
+# and serializes once. With `fields` (see projection.py) only those fields are serialized.
+def cached_list_response(request: Request, table: str, response_model, loader, fields=None):
+    if not RESPONSE_CACHE_ENABLED:
+        return loader() if fields is None else projected_response(response_model, fields, loader())
+    version = table_versions.get(table)
+    key = table if fields is None else (table, fields)
+    cached = _fresh(key, version)
+    if cached is None:
+        # Si hay una escritura durante la consulta, la versión guardada ya queda vieja y se recarga
+        # If a write happens during the query, the stored version is already stale and gets reloaded
+        cached = _store(key, table, version, _serialize(response_model, loader(), fields))
+    return _respond(request, cached)
+
+
+# Versión para los endpoints asíncronos (main_async)
+# Version for the async endpoints (main_async)
+async def cached_list_response_async(request: Request, table: str, response_model, loader, fields=None):
+    if not RESPONSE_CACHE_ENABLED:
+        rows = await loader()
+        return rows if fields is None else projected_response(response_model, fields, rows)
+    version = table_versions.get(table)
+    key = table if fields is None else (table, fields)
+    cached = _fresh(key, version)
+    if cached is None:
+        cached = _store(key, table, version, _serialize(response_model, await loader(), fields))
+    return _respond(request, cached)
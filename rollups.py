@@ -0,0 +1,299 @@
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import Integer, String, case, delete, func, insert, literal, select, tuple_, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased
+
+import partitions
+from database import COMPACT_STORAGE_ENABLED
+from models import DevicesRecordsDB, DevicesRecordsRollupDB, stored_date_value
+
+# Tablas de resumen (rollups) por dispositivo y por minuto/hora/día, mantenidas en cada escritura
+# de crud.py. Se activan con RECORD_ROLLUPS=1; después de activarlas en una base existente hay que
+# reconstruirlas una vez con `python rollups.py rebuild`.
+# Per-device minute/hour/day summary tables (rollups), maintained on every write in crud.py.
+# Enabled with RECORD_ROLLUPS=1; after enabling them on an existing database, rebuild them once
+# with `python rollups.py rebuild`.
+ROLLUPS_ENABLED = os.getenv("RECORD_ROLLUPS", "0").lower() in ("1", "true", "yes")
+
+# Longitud del prefijo ISO de date_record que identifica cada intervalo (fecha, hora, minuto).
+# Con la columna Date se corta el texto guardado, mucho más barato que strftime por fila; en modo
+# compacto (milisegundos epoch) el prefijo sale de strftime.
+# Length of the ISO prefix of date_record that identifies each bucket (date, hour, minute).
+# With the Date column the stored text is sliced, much cheaper than a per-row strftime; in compact
+# mode (epoch milliseconds) the prefix comes from strftime.
+BUCKET_PREFIX_LENGTHS = {"1m": 16, "1h": 13, "1d": 10}
+BUCKET_PREFIX_FORMATS = {10: "%Y-%m-%d", 13: "%Y-%m-%d %H", 16: "%Y-%m-%d %H:%M"}
+
+# Resoluciones de rollup de la más gruesa a la más fina, con su duración en minutos. Una consulta
+# lee del rollup más grueso cuya duración divide al intervalo pedido.
+# Rollup resolutions from coarsest to finest, with their length in minutes. A query reads from
+# the coarsest rollup whose length divides the requested bucket.
+ROLLUP_MINUTES = {"1d": 24 * 60, "1h": 60, "1m": 1}
+
+
+# Prefijo del intervalo de una resolución al que pertenece un date_record
+# Prefix of the bucket of one resolution a date_record belongs to
+def bucket_prefix(value, resolution: str) -> str:
+    length = BUCKET_PREFIX_LENGTHS[resolution]
+    if COMPACT_STORAGE_ENABLED:
+        return stored_date_value(value).strftime(BUCKET_PREFIX_FORMATS[length])
+    return stored_date_value(value).isoformat()[:length]
+
+
+# Expresión SQL del prefijo del intervalo de cada fila de DevicesRecords (o de una partición)
+# SQL expression for the bucket prefix of each row of DevicesRecords (or of a partition)
+def bucket_expression(resolution: str, model=DevicesRecordsDB):
+    length = BUCKET_PREFIX_LENGTHS[resolution]
+    if COMPACT_STORAGE_ENABLED:
+        seconds = type_coerce(model.date_record, Integer) / 1000
+        return func.strftime(BUCKET_PREFIX_FORMATS[length], seconds, "unixepoch")
+    return func.substr(model.date_record, 1, length)
+
+
+# Filtros de date_record que seleccionan las filas de un intervalo
+# date_record filters that select the rows of one bucket
+def _bucket_filters(resolution: str, prefix: str, model=DevicesRecordsDB):
+    return _bucket_range_filters(resolution, prefix, prefix, model)
+
+
+# Filtros de date_record que seleccionan las filas de los intervalos `first` a `last` (None = sin límite)
+# date_record filters that select the rows of buckets `first` to `last` (None = unbounded)
+def _bucket_range_filters(resolution: str, first: Optional[str], last: Optional[str], model=DevicesRecordsDB):
+    filters = []
+    if COMPACT_STORAGE_ENABLED:
+        if first is not None:
+            filters.append(model.date_record >= bucket_start(first))
+        if last is not None:
+            filters.append(model.date_record < bucket_start(last) + timedelta(minutes=ROLLUP_MINUTES[resolution]))
+        return filters
+    # Rango de texto [first, last + "~") = todos los date_record que empiezan con un prefijo entre ambos
+    # Text range [first, last + "~") = every date_record starting with a prefix between both
+    date_text_column = type_coerce(model.date_record, String)
+    if first is not None:
+        filters.append(date_text_column >= first)
+    if last is not None:
+        filters.append(date_text_column < last + "~")
+    return filters
+
+
+# Convertir el prefijo de un intervalo en la fecha/hora de inicio
+# Convert a bucket prefix into its start datetime
+def bucket_start(prefix: str) -> datetime:
+    prefix = prefix.replace("T", " ")
+    return datetime.strptime(prefix, BUCKET_PREFIX_FORMATS[len(prefix)])
+
+
+# Elegir el rollup más grueso que satisface la resolución pedida
+# Pick the coarsest rollup that satisfies the requested resolution
+def source_resolution(bucket: str) -> str:
+    for resolution, minutes in ROLLUP_MINUTES.items():
+        if ROLLUP_MINUTES[bucket] % minutes == 0:
+            return resolution
+    return "1m"
+
+
+# SELECT que calcula las filas de rollup de una resolución a partir de DevicesRecords (o de una partición)
+# SELECT that computes the rollup rows of one resolution from DevicesRecords (or from a partition)
+def _rollup_select(resolution: str, model, *filters):
+    prefix = bucket_expression(resolution, model)
+    grouped = select(
+        model.id_device.label("id_device"),
+        prefix.label("bucket"),
+        func.count().label("count"),
+        func.sum(model.current_value).label("sum"),
+        func.min(model.current_value).label("min"),
+        func.max(model.current_value).label("max"),
+        func.max(model.date_record).label("last_date"),
+    ).where(*filters).group_by(model.id_device, prefix).subquery()
+    # El último registro de cada intervalo sale de una búsqueda por índice
+    # The newest record of each bucket comes from an index seek
+    newest = aliased(model)
+    last_record = select(newest.id_record).where(
+        newest.id_device == grouped.c.id_device,
+        newest.date_record == grouped.c.last_date,
+    ).order_by(newest.id_record.desc()).limit(1).correlate(grouped).scalar_subquery()
+    by_id = aliased(model)
+    last_value = select(by_id.current_value).where(by_id.id_record == last_record).scalar_subquery()
+    return select(
+        grouped.c.id_device,
+        literal(resolution, String),
+        grouped.c.bucket,
+        grouped.c.count,
+        grouped.c.sum,
+        grouped.c.min,
+        grouped.c.max,
+        last_value,
+        grouped.c.last_date,
+        last_record,
+    )
+
+
+_ROLLUP_COLUMNS = ["id_device", "resolution", "bucket", "count", "sum", "min", "max",
+                   "last_value", "last_date", "last_id"]
+
+
+# Sumar registros recién insertados a los rollups (upsert agregado por intervalo)
+# Add freshly inserted records to the rollups (upsert aggregated per bucket)
+def records_inserted(db: Session, rows: list[dict]):
+    if not ROLLUPS_ENABLED or not rows:
+        return
+    # Agregar primero en Python para hacer un solo upsert por intervalo
+    # Aggregate in Python first so each bucket gets a single upsert
+    buckets = {}
+    for row in rows:
+        stored_date = stored_date_value(row["date_record"])
+        value = float(row["current_value"])
+        for resolution in BUCKET_PREFIX_LENGTHS:
+            key = (int(row["id_device"]), resolution, bucket_prefix(stored_date, resolution))
+            current = buckets.get(key)
+            if current is None:
+                buckets[key] = {
+                    "id_device": key[0], "resolution": resolution, "bucket": key[2],
+                    "count": 1, "sum": value, "min": value, "max": value,
+                    "last_value": value, "last_date": stored_date, "last_id": row["id_record"],
+                }
+                continue
+            current["count"] += 1
+            current["sum"] += value
+            current["min"] = min(current["min"], value)
+            current["max"] = max(current["max"], value)
+            if (stored_date, row["id_record"]) >= (current["last_date"], current["last_id"]):
+                current["last_value"] = value
+                current["last_date"] = stored_date
+                current["last_id"] = row["id_record"]
+
+    rollup = DevicesRecordsRollupDB
+    stmt = sqlite_insert(rollup)
+    is_newer = tuple_(stmt.excluded.last_date, stmt.excluded.last_id) >= tuple_(rollup.last_date, rollup.last_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[rollup.id_device, rollup.resolution, rollup.bucket],
+        set_={
+            "count": rollup.count + stmt.excluded.count,
+            "sum": rollup.sum + stmt.excluded.sum,
+            "min": func.min(rollup.min, stmt.excluded.min),
+            "max": func.max(rollup.max, stmt.excluded.max),
+            "last_value": case((is_newer, stmt.excluded.last_value), else_=rollup.last_value),
+            "last_date": case((is_newer, stmt.excluded.last_date), else_=rollup.last_date),
+            "last_id": case((is_newer, stmt.excluded.last_id), else_=rollup.last_id),
+        },
+    )
+    db.execute(stmt, list(buckets.values()))
+
+
+# Recalcular desde DevicesRecords los intervalos tocados por una actualización o un borrado.
+# min/max/last no se pueden "restar", así que se recalcula solo el intervalo afectado.
+# Recompute from DevicesRecords the buckets touched by an update or a delete.
+# min/max/last cannot be "subtracted", so only the affected bucket is recomputed.
+def records_changed(db: Session, keys: list[tuple]):
+    if not ROLLUPS_ENABLED or not keys:
+        return
+    db.flush()
+    for id_device, date_record in set((int(id_device), stored_date_value(d)) for id_device, d in keys):
+        # Un intervalo nunca cruza el límite de un mes: basta con la partición de ese date_record
+        # A bucket never crosses a month boundary: the partition of that date_record is enough
+        model = partitions.model_for(db, date_record)
+        for resolution in BUCKET_PREFIX_LENGTHS:
+            prefix = bucket_prefix(date_record, resolution)
+            db.execute(delete(DevicesRecordsRollupDB).where(
+                DevicesRecordsRollupDB.id_device == id_device,
+                DevicesRecordsRollupDB.resolution == resolution,
+                DevicesRecordsRollupDB.bucket == prefix,
+            ))
+            db.execute(insert(DevicesRecordsRollupDB).from_select(_ROLLUP_COLUMNS, _rollup_select(
+                resolution,
+                model,
+                model.id_device == id_device,
+                *_bucket_filters(resolution, prefix, model),
+            )))
+
+
+# Recalcular desde las tablas todos los intervalos que se solapan con [since, until] (de los dispositivos
+# `id_devices` o, con None, de todos), después de un borrado por rango. Los intervalos de adentro quedan
+# vacíos y los de los bordes se recalculan con los registros que quedan fuera del rango.
+# Recompute from the tables every bucket overlapping [since, until] (of the `id_devices` devices or, with
+# None, of all of them), after a range delete. The inner buckets end up empty and the edge ones are
+# recomputed from the records left outside the range.
+def range_changed(db: Session, id_devices: Optional[list[int]], since: Optional[datetime],
+                  until: Optional[datetime]):
+    if not ROLLUPS_ENABLED:
+        return
+    db.flush()
+    rollup = DevicesRecordsRollupDB
+    models = partitions.record_models(db, since, until)
+    for resolution in BUCKET_PREFIX_LENGTHS:
+        first = bucket_prefix(since, resolution) if since is not None else None
+        last = bucket_prefix(until, resolution) if until is not None else None
+        conditions = [rollup.resolution == resolution]
+        if id_devices is not None:
+            conditions.append(rollup.id_device.in_(id_devices))
+        if first is not None:
+            conditions.append(rollup.bucket >= first)
+        if last is not None:
+            conditions.append(rollup.bucket <= last)
+        db.execute(delete(rollup).where(*conditions))
+        for model in models:
+            filters = _bucket_range_filters(resolution, first, last, model)
+            if id_devices is not None:
+                filters.append(model.id_device.in_(id_devices))
+            db.execute(insert(rollup).from_select(_ROLLUP_COLUMNS, _rollup_select(resolution, model, *filters)))
+
+
+# Reconstruir todos los rollups desde DevicesRecords (para backfills o al activarlos)
+# Rebuild every rollup from DevicesRecords (for backfills or when enabling them)
+def rebuild(db: Session):
+    db.execute(delete(DevicesRecordsRollupDB))
+    for model in partitions.record_models(db):
+        for resolution in BUCKET_PREFIX_LENGTHS:
+            db.execute(insert(DevicesRecordsRollupDB).from_select(_ROLLUP_COLUMNS, _rollup_select(resolution, model)))
+    # Los registros archivados en bloques (CHUNKED_STORAGE=1) no están en las tablas; se suman con upserts
+    # Records archived in chunks (CHUNKED_STORAGE=1) are not in the tables; they are added with upserts
+    import chunk_store
+    for batch in chunk_store.iter_record_batches(db, 10_000):
+        records_inserted(db, [record._asdict() for record in batch])
+    db.commit()
+
+
+# Agregados por intervalo leídos del rollup más grueso que satisface la resolución pedida
+# Per-bucket aggregates read from the coarsest rollup that satisfies the requested resolution
+def get_aggregate(db: Session, id_device: int, bucket: str, since: Optional[datetime] = None,
+                  until: Optional[datetime] = None):
+    resolution = source_resolution(bucket)
+    rollup = DevicesRecordsRollupDB
+    query = select(rollup).where(rollup.id_device == id_device, rollup.resolution == resolution)
+    if since is not None:
+        query = query.where(rollup.bucket >= bucket_prefix(since, resolution))
+    if until is not None:
+        query = query.where(rollup.bucket <= bucket_prefix(until, resolution))
+    return [
+        {
+            "bucket_start": bucket_start(row.bucket),
+            "min": row.min,
+            "max": row.max,
+            "avg": row.sum / row.count,
+            "count": row.count,
+            "last": row.last_value,
+        }
+        for row in db.execute(query.order_by(rollup.bucket)).scalars()
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de rollups / Rollup maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        rebuild(session)
+        total = session.query(DevicesRecordsRollupDB).count()
+        print(f"Rollups reconstruidos / Rollups rebuilt: {total} filas / rows")
+    finally:
+        session.close()
@@ -0,0 +1,29 @@
+import os
+
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+
+# Tamaño de lote para las respuestas en streaming (NDJSON)
+# Batch size for streaming (NDJSON) responses
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Construir una respuesta NDJSON que lee filas por lotes y las emite conforme avanza.
+# Usa su propia sesión porque el generador sigue corriendo después de que el endpoint retorna.
+# Build an NDJSON response that reads rows in batches and emits them as it goes.
+# It uses its own session because the generator keeps running after the endpoint returns.
+def stream_ndjson(iter_fn, response_model):
+    def generar():
+        db = SessionLocal()
+        try:
+            lineas = []
+            for row in iter_fn(db, STREAM_BATCH_SIZE):
+                lineas.append(response_model.model_validate(row).model_dump_json())
+                if len(lineas) >= STREAM_BATCH_SIZE:
+                    yield "\n".join(lineas) + "\n"
+                    lineas = []
+            if lineas:
+                yield "\n".join(lineas) + "\n"
+        finally:
+            db.close()
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
@@ -0,0 +1,222 @@
+import json
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Optional
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack es opcional / msgpack is optional
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional / orjson is optional
+    orjson = None
+
+# Negociación de MessagePack (pip install msgpack): un cuerpo con Content-Type application/msgpack se
+# decodifica antes de llegar a los endpoints, y una respuesta JSON se envía como MessagePack si el Accept
+# lo prefiere. Los datos son los mismos que en JSON (fechas como texto ISO), solo cambia la codificación,
+# así que todos los endpoints de lectura e ingesta aceptan ambos formatos sin cambios. Sin msgpack
+# instalado, un cuerpo MessagePack recibe 415 y las respuestas siguen en JSON.
+# MessagePack negotiation (pip install msgpack): a body with Content-Type application/msgpack is decoded
+# before it reaches the endpoints, and a JSON response is sent as MessagePack when the Accept header
+# prefers it. The data is the same as in JSON (dates as ISO text), only the encoding changes, so every
+# read and ingest endpoint accepts both formats unchanged. Without msgpack installed, a MessagePack body
+# gets a 415 and responses stay JSON.
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# Tipo MessagePack negociado para la respuesta de la solicitud en curso (None = JSON). Los caminos que
+# arman sus propios bytes (fast_json) lo leen para codificar directamente, sin pasar por JSON.
+# MessagePack type negotiated for the current request's response (None = JSON). The paths that build
+# their own bytes (fast_json) read it to encode directly, without going through JSON.
+response_msgpack_type: ContextVar[Optional[str]] = ContextVar("response_msgpack_type", default=None)
+
+# Sufijo del ETag de la representación MessagePack (un ETag identifica una sola representación)
+# ETag suffix of the MessagePack representation (an ETag identifies a single representation)
+_ETAG_SUFFIX = b'-msgpack"'
+
+
+# Tipo MessagePack preferido por un encabezado Accept, o None si el cliente prefiere JSON.
+# Gana el de mayor q; con el mismo q que JSON (o que */*), MessagePack.
+# MessagePack type preferred by an Accept header, or None if the client prefers JSON.
+# The highest q wins; with the same q as JSON (or as */*), MessagePack.
+def preferred_msgpack_type(accept: str) -> Optional[str]:
+    best, best_q, json_q = None, 0.0, 0.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media_type = media_type.lower()
+        if media_type in MSGPACK_TYPES and q > best_q:
+            best, best_q = media_type, q
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return best if best is not None and best_q >= json_q else None
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# Bytes JSON de un cuerpo MessagePack ya decodificado (un Timestamp de MessagePack llega como datetime
+# y pasa a texto ISO)
+# JSON bytes of an already decoded MessagePack body (a MessagePack Timestamp arrives as a datetime and
+# becomes ISO text)
+def _to_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), default=_json_default).encode()
+
+
+def _from_json(body: bytes):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+# Bytes MessagePack; un datetime sin convertir (orjson los escribe solo en fast_json) pasa a texto ISO
+# MessagePack bytes; an unconverted datetime (orjson writes them by itself in fast_json) becomes ISO text
+def packb(data) -> bytes:
+    return msgpack.packb(data, default=_json_default)
+
+
+def _header(headers: list, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def _replace_headers(headers: list, values: dict) -> list:
+    return [(key, value) for key, value in headers if key not in values] + list(values.items())
+
+
+# Middleware ASGI que hace la negociación descrita arriba. Las respuestas en streaming (NDJSON, SSE,
+# Parquet/Arrow) y las que no son JSON pasan sin cambios.
+# ASGI middleware doing the negotiation described above. Streaming responses (NDJSON, SSE,
+# Parquet/Arrow) and non-JSON responses pass through unchanged.
+class MsgPackMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = scope["headers"]
+        content_type = (_header(headers, b"content-type") or b"").split(b";")[0].strip().lower().decode("latin-1")
+        if content_type in MSGPACK_TYPES:
+            if msgpack is None:
+                await _error(send, 415, "MessagePack bodies need the msgpack package")
+                return
+            body = await _read_body(receive)
+            if body:
+                try:
+                    body = _to_json(msgpack.unpackb(body, timestamp=3))
+                except (ValueError, TypeError):
+                    await _error(send, 400, "Invalid MessagePack body")
+                    return
+                headers = _replace_headers(headers, {b"content-type": b"application/json",
+                                                     b"content-length": str(len(body)).encode()})
+            receive = _replay(body, receive)
+        response_type = None
+        if msgpack is not None:
+            response_type = preferred_msgpack_type((_header(headers, b"accept") or b"").decode("latin-1"))
+        if response_type is None:
+            if headers is not scope["headers"]:
+                scope = dict(scope, headers=headers)
+            await self.app(scope, receive, send)
+            return
+        # Los ETags MessagePack que manda el cliente vuelven a ser los de la representación JSON; los que no
+        # tienen el sufijo son de la representación JSON y no deben dar 304
+        # The MessagePack ETags the client sends become the JSON representation's again; the ones without the
+        # suffix belong to the JSON representation and must not produce a 304
+        if_none_match = _header(headers, b"if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(b",")]
+            tags = [tag if tag == b"*" else tag[:-len(_ETAG_SUFFIX)] + b'"' for tag in tags
+                    if tag == b"*" or tag.endswith(_ETAG_SUFFIX)]
+            headers = [(key, value) for key, value in headers if key != b"if-none-match"]
+            if tags:
+                headers.append((b"if-none-match", b", ".join(tags)))
+        scope = dict(scope, headers=headers)
+        token = response_msgpack_type.set(response_type)
+        try:
+            await self.app(scope, receive, _MsgPackSender(send, response_type.encode()))
+        finally:
+            response_msgpack_type.reset(token)
+
+
+# Envoltura de `send` que junta el cuerpo de una respuesta JSON y lo reenvía como MessagePack
+# Wrapper around `send` that collects a JSON response body and sends it on as MessagePack
+class _MsgPackSender:
+    def __init__(self, send, media_type: bytes):
+        self.send = send
+        self.media_type = media_type
+        self.start = None
+        self.chunks = []
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            values = {b"vary": b"Accept"}
+            etag = _header(headers, b"etag")
+            if etag is not None and etag.endswith(b'"'):
+                values[b"etag"] = etag[:-1] + _ETAG_SUFFIX
+            content_type = (_header(headers, b"content-type") or b"").split(b";")[0].strip()
+            if content_type == b"application/json" and message["status"] not in (204, 304):
+                # Se retiene el inicio hasta tener el cuerpo, que cambia de tamaño
+                # The start is held back until the body is complete, since its size changes
+                self.start = dict(message, headers=_replace_headers(headers, values))
+                return
+            message = dict(message, headers=_replace_headers(headers, values))
+        elif message["type"] == "http.response.body" and self.start is not None:
+            self.chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(self.chunks)
+            if body:
+                body = packb(_from_json(body))
+                headers = _replace_headers(self.start["headers"], {b"content-type": self.media_type,
+                                                                   b"content-length": str(len(body)).encode()})
+            else:
+                headers = self.start["headers"]
+            await self.send(dict(self.start, headers=headers))
+            message = {"type": "http.response.body", "body": body}
+        await self.send(message)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+# `receive` que entrega el cuerpo ya convertido y después sigue con el original (para la desconexión)
+# `receive` that delivers the converted body and then goes on with the original one (for disconnects)
+def _replay(body: bytes, original):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return await original()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+    return receive
+
+
+async def _error(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})